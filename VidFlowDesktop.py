@@ -2,6 +2,7 @@
 import os
 import sys
 from inspect import getsourcefile
+from multiprocessing import freeze_support
 from pathlib import Path
 
 from PyQt5.QtCore import Qt
@@ -10,24 +11,28 @@ from qfluentwidgets import Theme, setTheme
 
 os.chdir(Path(getsourcefile(lambda: 0)).resolve().parent)
 
-from app.common.application import SingletonApplication
-from app.view.main_window import MainWindow
-from app.common.config import config
+if __name__ == '__main__':
+    # 后处理进程池的子进程（以及打包后的程序）会重新导入本模块，界面只在主进程中创建
+    freeze_support()
 
-# enable dpi scale
-if config.get(config.dpiScale) == "Auto":
-    QApplication.setHighDpiScaleFactorRoundingPolicy(
-        Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
-    QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
-else:
-    os.environ["QT_ENABLE_HIGHDPI_SCALING"] = "0"
-    os.environ["QT_SCALE_FACTOR"] = str(config.get(config.dpiScale))
+    from app.common.application import SingletonApplication
+    from app.view.main_window import MainWindow
+    from app.common.config import config
 
-QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps)
-app = SingletonApplication(sys.argv, "VidFlowDesktop")
-# app.setAttribute(Qt.AA_DontCreateNativeWidgetSiblings)
-w = MainWindow()
-# setTheme(Theme.DARK)
-w.show()
+    # enable dpi scale
+    if config.get(config.dpiScale) == "Auto":
+        QApplication.setHighDpiScaleFactorRoundingPolicy(
+            Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
+        QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
+    else:
+        os.environ["QT_ENABLE_HIGHDPI_SCALING"] = "0"
+        os.environ["QT_SCALE_FACTOR"] = str(config.get(config.dpiScale))
 
-app.exec()
+    QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps)
+    app = SingletonApplication(sys.argv, "VidFlowDesktop")
+    # app.setAttribute(Qt.AA_DontCreateNativeWidgetSiblings)
+    w = MainWindow()
+    # setTheme(Theme.DARK)
+    w.show()
+
+    app.exec()
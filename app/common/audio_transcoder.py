@@ -0,0 +1,244 @@
+# coding:utf-8
+"""
+音频转码模块
+下载音频时把已到达的数据通过管道交给 FFmpeg 边下载边转码，批量转换已有文件时在后处理线程池中并行执行
+"""
+
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import wait
+from typing import List, Optional
+
+from PyQt5.QtCore import pyqtSignal
+
+from .config import config
+from .downloader import DownloadCancelled, PartFileReader, SegmentedDownloader
+from .ffmpeg import ffmpegLocator
+from .media_jobs import AUDIO_FORMATS, CREATE_NO_WINDOW, audio_transcode_command, ffmpeg_transcode_audio
+from .postprocess import postProcessPool
+from .staging import finalize
+from .transfer_engine import TransferTask, transferEngine
+
+ORIGINAL_FORMAT = 'original'
+PIPE_CHUNK_SIZE = 1024 * 1024
+
+
+class TranscodeError(Exception):
+    """FFmpeg 转码失败"""
+
+
+def audio_format() -> Optional[str]:
+    """设置中选择的目标格式，保留原始格式时返回 None"""
+    fmt = config.get(config.audioFormat)
+    return None if fmt == ORIGINAL_FORMAT else fmt
+
+
+def audio_extension(fmt: str) -> str:
+    return AUDIO_FORMATS[fmt][1]
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _pipe_to_ffmpeg(reader: PartFileReader, cmd: List[str]):
+    """把 ``reader`` 的内容写入 FFmpeg 的标准输入，FFmpeg 失败时抛出 :class:`TranscodeError`"""
+    process = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        creationflags=CREATE_NO_WINDOW
+    )
+    # 单独读取错误输出，避免管道写满后 FFmpeg 阻塞
+    stderr = []
+    stderr_thread = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+    stderr_thread.start()
+
+    try:
+        with reader:
+            while True:
+                chunk = reader.read(PIPE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                process.stdin.write(chunk)
+    except BrokenPipeError:
+        # FFmpeg 提前退出，按返回码判断
+        pass
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
+        stderr_thread.join()
+
+    if process.returncode != 0:
+        message = b''.join(stderr).decode('utf-8', errors='ignore').strip()
+        raise TranscodeError(f"音频转码失败: {message}")
+
+
+def stream_transcode(downloader: SegmentedDownloader, ffmpeg_path: str, output_path: str,
+                     fmt: str, bitrate: int) -> bool:
+    """下载的同时把 ``.part`` 中已连续到达的数据送入 FFmpeg
+
+    ``downloader`` 需使用流式模式。完成返回 True，下载被取消返回 False；
+    FFmpeg 无法处理管道输入（例如 moov 位于文件末尾的 MP4）时抛出 :class:`TranscodeError`，
+    此时下载仍会完成，调用方可以改为转换完整文件。
+    """
+    cmd = audio_transcode_command(ffmpeg_path, 'pipe:0', output_path, fmt, bitrate)
+    # 下载在传输引擎中进行，当前线程只负责向 FFmpeg 输送数据
+    download_future = transferEngine.submit(downloader.download_async())
+    transcode_error = None
+    try:
+        _pipe_to_ffmpeg(PartFileReader(downloader), cmd)
+    except DownloadCancelled:
+        pass
+    except TranscodeError as e:
+        transcode_error = e
+    except Exception:
+        # 等下载结束后再抛出，不留下仍在写入的 .part
+        wait([download_future])
+        raise
+
+    try:
+        completed = download_future.result()
+    except Exception:
+        _remove_file(output_path)
+        raise
+
+    if not completed:
+        _remove_file(output_path)
+        return False
+    if transcode_error is not None:
+        _remove_file(output_path)
+        raise transcode_error
+    return True
+
+
+class AudioTranscodeJob:
+    """单个音频下载的转码流程
+
+    先尝试边下载边转码；FFmpeg 无法从管道读取时，下载完成后登记为 :attr:`pending`，
+    由任务的 ``post_process`` 在后处理线程池中转换完整文件。转码结果写在暂存目录，
+    完成后移动到 ``output_path``。
+    """
+
+    def __init__(self, downloader: SegmentedDownloader, ffmpeg_path: str, output_path: str,
+                 temp_dir: str, fmt: str, bitrate: int):
+        self.downloader = downloader
+        self.ffmpeg_path = ffmpeg_path
+        self.output_path = output_path
+        self.temp_dir = temp_dir
+        self.fmt = fmt
+        self.bitrate = bitrate
+        self.staged_path = os.path.join(temp_dir, 'output' + audio_extension(fmt))
+        self.pending = False
+
+    def run(self) -> bool:
+        """下载并转码，被取消返回 False"""
+        try:
+            return stream_transcode(self.downloader, self.ffmpeg_path, self.staged_path, self.fmt, self.bitrate)
+        except TranscodeError:
+            self.pending = True
+            return True
+
+    async def post_process(self):
+        """在后处理线程池中转换已下载完成的文件，失败时保留下载缓存"""
+        try:
+            await postProcessPool.run(
+                ffmpeg_transcode_audio, self.ffmpeg_path, self.downloader.part_path,
+                self.staged_path, self.fmt, self.bitrate)
+        except Exception:
+            _remove_file(self.staged_path)
+            raise
+        await transferEngine.run_blocking(self.finish)
+
+    def finish(self):
+        """移动转码结果并清理下载缓存"""
+        finalize(self.staged_path, self.output_path)
+        self.downloader.discard()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class AudioConvertTask(TransferTask):
+    """批量音频转换任务
+
+    每个文件作为一个后处理作业提交到 :data:`postProcessPool`，按设置中的后处理并发数并行转换，
+    输出与源文件放在同一目录。``progress`` 上报已完成的文件数，``converted`` 在每个文件完成时发出，
+    全部结束后有成功的文件时发出 ``finished``，有失败的文件时发出 ``error``。
+    """
+
+    converted = pyqtSignal(str)
+
+    def __init__(self, paths: List[str], fmt: Optional[str] = None, bitrate: Optional[int] = None, parent=None):
+        super().__init__(parent)
+        self.paths = list(paths)
+        self.fmt = fmt or audio_format() or 'mp3'
+        self.bitrate = bitrate or config.get(config.audioBitrate)
+        self._done = 0
+        self._reserved = set()  # 已分配给转换中文件的输出路径，同名不同格式的源文件不会得到同一路径
+
+    async def run(self):
+        try:
+            ffmpeg_path = (await transferEngine.run_blocking(ffmpegLocator.require)).path
+        except Exception as e:
+            self.error.emit(str(e))
+            return
+
+        self.report_progress(0, len(self.paths))
+        results = await asyncio.gather(
+            *(self._convert(ffmpeg_path, path) for path in self.paths), return_exceptions=True)
+        if self.is_stopped:
+            return
+
+        succeeded = [result for result in results if isinstance(result, str)]
+        failed = [result for result in results if isinstance(result, Exception)]
+        self.report_finished(len(self.paths))
+        if succeeded:
+            self.finished.emit(os.path.dirname(succeeded[0]))
+        if failed:
+            self.error.emit(f"{len(failed)} 个文件转换失败: {failed[0]}")
+
+    async def _convert(self, ffmpeg_path: str, path: str) -> Optional[str]:
+        if self.is_stopped:
+            return None
+
+        ext = audio_extension(self.fmt)
+        output_path = self._unique_path(os.path.splitext(path)[0] + ext)
+        self._reserved.add(output_path)
+        temp_path = None
+        try:
+            # 转换中的文件使用同目录下的唯一临时文件，完成后再重命名，扩展名保持不变以便 FFmpeg 选择封装格式
+            fd, temp_path = tempfile.mkstemp(
+                suffix='.converting' + ext, prefix=os.path.splitext(os.path.basename(output_path))[0] + '.',
+                dir=os.path.dirname(output_path))
+            os.close(fd)
+            await postProcessPool.run(ffmpeg_transcode_audio, ffmpeg_path, path, temp_path, self.fmt, self.bitrate)
+            os.replace(temp_path, output_path)
+        except Exception:
+            if temp_path:
+                _remove_file(temp_path)
+            raise
+        finally:
+            self._reserved.discard(output_path)
+            self._done += 1
+            self.report_progress(self._done, len(self.paths))
+
+        self.converted.emit(output_path)
+        return output_path
+
+    def _unique_path(self, path: str) -> str:
+        base, ext = os.path.splitext(path)
+        counter = 1
+        while os.path.exists(path) or path in self._reserved:
+            path = f"{base}_{counter}{ext}"
+            counter += 1
+        return path
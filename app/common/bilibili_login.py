@@ -11,11 +11,12 @@ import hashlib
 import urllib.parse
 import os
 from typing import Dict, Optional
-from PyQt5.QtCore import QThread, pyqtSignal
 import requests
+from PyQt5.QtCore import QThread, pyqtSignal
 import qrcode
 from io import BytesIO
 from .config import LOGIN_FILE_PATH
+from .http_client import httpClient
 
 
 class BilibiliLogin:
@@ -34,7 +35,7 @@ class BilibiliLogin:
         """初始化客户端，获取基础Cookie"""
         try:
             # 获取buvid3和buvid4
-            response = requests.get('https://www.bilibili.com/', headers=self.headers)
+            response = httpClient.get('https://www.bilibili.com/', headers=self.headers)
             for cookie in response.cookies:
                 self.cookies[cookie.name] = cookie.value
 
@@ -44,7 +45,7 @@ class BilibiliLogin:
                 'webid': self.cookies.get('buvid3', ''),
             }
 
-            response = requests.post(
+            response = httpClient.post(
                 'https://api.bilibili.com/x/frontend/finger/spi',
                 headers=self.headers,
                 json=finger_data
@@ -72,7 +73,7 @@ class BilibiliLogin:
     def get_qrcode(self) -> Optional[bytes]:
         """获取登录二维码"""
         try:
-            response = requests.get(
+            response = httpClient.get(
                 'https://passport.bilibili.com/x/passport-login/web/qrcode/generate',
                 headers=self.headers
             )
@@ -110,7 +111,7 @@ class BilibiliLogin:
 
         try:
             params = {'qrcode_key': self.qrcode_key}
-            response = requests.get(
+            response = httpClient.get(
                 'https://passport.bilibili.com/x/passport-login/web/qrcode/poll',
                 headers=self.headers,
                 params=params
@@ -197,21 +198,35 @@ class BilibiliLogin:
     def get_user_info(self) -> Optional[Dict]:
         """获取用户信息，验证登录状态"""
         try:
-            response = requests.get(
-                'https://api.bilibili.com/x/web-interface/nav',
-                headers=self.headers
-            )
-
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('code') == 0:
-                    return data.get('data')
+            return self.fetch_user_info()
+        except Exception as e:
+            print(f"获取用户信息失败: {e}")
+            return None
 
+    def fetch_user_info(self) -> Optional[Dict]:
+        """请求 nav 接口获取用户信息
+
+        接口明确返回未登录（HTTP 401 或 code -101）时返回 None；
+        网络错误、服务器错误或风控等无法判断登录状态的情况抛出 :class:`requests.RequestException`。
+        """
+        response = httpClient.get(
+            'https://api.bilibili.com/x/web-interface/nav',
+            headers=self.headers
+        )
+        if response.status_code == 401:
             return None
+        response.raise_for_status()
 
-        except Exception as e:
-            print(f"获取用户信息失败: {e}")
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise requests.RequestException(f"nav 接口返回无法解析的内容: {e}", response=response)
+        if data.get('code') == 0:
+            return data.get('data')
+        if data.get('code') == -101:
             return None
+        raise requests.RequestException(f"nav 接口返回错误: {data.get('code')} {data.get('message', '')}",
+                                        response=response)
 
 
 class LoginThread(QThread):
@@ -6,7 +6,7 @@ from pathlib import Path
 
 from PyQt5.QtCore import QLocale
 from qfluentwidgets import ConfigItem, OptionsConfigItem, OptionsValidator, BoolValidator, FolderValidator, \
-    FolderListValidator, QConfig, ConfigSerializer, setTheme, Theme, qconfig
+    FolderListValidator, RangeConfigItem, RangeValidator, QConfig, ConfigSerializer, setTheme, Theme, qconfig
 
 # 应用程序信息
 APP_NAME = "VidFlowDesktop"
@@ -70,6 +70,35 @@ class Config(QConfig):
     downloadFolder = ConfigItem(
         "Folders", "Download", Path(os.environ['USERPROFILE']) / 'Downloads', FolderValidator())
 
+    # download
+    downloadConnections = RangeConfigItem(
+        "Download", "Connections", 4, RangeValidator(1, 16))
+    maxConcurrentDownloads = RangeConfigItem(
+        "Download", "MaxConcurrent", 3, RangeValidator(1, 10))
+    maxDownloadsPerHost = RangeConfigItem(
+        "Download", "MaxPerHost", 2, RangeValidator(1, 10))
+    speedLimit = RangeConfigItem(
+        "Download", "SpeedLimit", 0, RangeValidator(0, 102400))  # KB/s，0 表示不限速
+    speedLimitScheduleEnabled = ConfigItem(
+        "Download", "SpeedLimitScheduleEnabled", False, BoolValidator())
+    speedLimitStartHour = RangeConfigItem(
+        "Download", "SpeedLimitStartHour", 9, RangeValidator(0, 23))
+    speedLimitEndHour = RangeConfigItem(
+        "Download", "SpeedLimitEndHour", 18, RangeValidator(0, 23))
+
+    # post-processing
+    maxPostProcessJobs = RangeConfigItem(
+        "PostProcess", "MaxJobs", min(2, os.cpu_count() or 1), RangeValidator(1, os.cpu_count() or 1))
+
+    # audio
+    audioFormat = OptionsConfigItem(
+        "Audio", "Format", "original", OptionsValidator(["original", "mp3", "aac", "opus", "flac"]))
+    audioBitrate = OptionsConfigItem(
+        "Audio", "Bitrate", 192, OptionsValidator([96, 128, 192, 256, 320]))  # kbps
+
+    # tools
+    ffmpegPath = ConfigItem("Tools", "FFmpegPath", "")
+
     # dpiScale
     dpiScale = OptionsConfigItem(
         "MainWindow", "DpiScale", "Auto", OptionsValidator([1, 1.25, 1.5, 1.75, 2, "Auto"]), restart=True)
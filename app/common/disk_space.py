@@ -0,0 +1,192 @@
+# coding:utf-8
+"""
+磁盘空间模块
+下载开始前按预计大小检查目标文件系统的剩余空间，并为下载文件预分配空间，避免传输大半后才因空间不足失败
+"""
+
+import ctypes
+import errno
+import os
+import shutil
+import sys
+import threading
+from typing import Callable, Dict, Optional
+
+from .progress import format_size
+
+
+class InsufficientSpaceError(OSError):
+    """磁盘空间不足"""
+
+    def __init__(self, path: str, required: int, free: int):
+        super().__init__(errno.ENOSPC, f"磁盘空间不足，需要 {format_size(required)}，"
+                                       f"可用 {format_size(max(0, free))}", path)
+        self.required = required
+        self.free = free
+
+
+def device_of(path: str):
+    """返回 (所在设备, 最近的已存在路径)，路径不存在时取最近的已存在上级目录"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev, path
+
+
+def preallocate(f, size: int) -> bool:
+    """为已打开的文件预分配 ``size`` 字节，返回磁盘块是否已真正分配
+
+    支持 ``posix_fallocate`` 时真正占用磁盘块，空间不足立即报错，也能减少碎片；
+    其他平台或文件系统不支持时退回 ``truncate``。POSIX 下 ``truncate`` 得到的是稀疏文件，
+    写入时才分配空间，返回 False；Windows 上扩展非稀疏文件会直接分配簇，返回 True。
+    """
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return True
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise InsufficientSpaceError(getattr(f, 'name', ''), size, 0) from e
+            if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS):
+                raise
+    f.truncate(size)
+    return os.name == 'nt'
+
+
+# Linux fallocate 标志：释放区间的磁盘块，文件长度不变
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+# Windows 稀疏文件控制码
+FSCTL_SET_SPARSE = 0x000900C4
+FSCTL_SET_ZERO_DATA = 0x000980C8
+
+
+def punch_hole(path: str, offset: int, length: int) -> bool:
+    """释放文件中 [offset, offset + length) 占用的磁盘块，文件长度不变，之后读到的是零
+
+    Linux 上调用 ``fallocate(PUNCH_HOLE)``，Windows 上把文件设为稀疏文件后写零；
+    其他平台或文件系统不支持时返回 False，文件保持原样。
+    """
+    if length <= 0:
+        return True
+    try:
+        with open(path, 'r+b') as f:
+            if sys.platform.startswith('linux'):
+                return _punch_hole_linux(f.fileno(), offset, length)
+            if sys.platform == 'win32':
+                return _punch_hole_windows(f.fileno(), offset, length)
+    except OSError:
+        pass
+    return False
+
+
+def _punch_hole_linux(fd: int, offset: int, length: int) -> bool:
+    libc = ctypes.CDLL(None, use_errno=True)
+    fallocate = libc.fallocate
+    fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong)
+    fallocate.restype = ctypes.c_int
+    return fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) == 0
+
+
+def _punch_hole_windows(fd: int, offset: int, length: int) -> bool:
+    import msvcrt
+    from ctypes import wintypes
+
+    class FileZeroDataInformation(ctypes.Structure):
+        _fields_ = [('FileOffset', ctypes.c_longlong), ('BeyondFinalZero', ctypes.c_longlong)]
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    device_io_control = kernel32.DeviceIoControl
+    device_io_control.argtypes = (wintypes.HANDLE, wintypes.DWORD, wintypes.LPVOID, wintypes.DWORD,
+                                  wintypes.LPVOID, wintypes.DWORD, ctypes.POINTER(wintypes.DWORD), wintypes.LPVOID)
+    device_io_control.restype = wintypes.BOOL
+
+    handle = msvcrt.get_osfhandle(fd)
+    returned = wintypes.DWORD()
+    if not device_io_control(handle, FSCTL_SET_SPARSE, None, 0, None, 0, ctypes.byref(returned), None):
+        return False
+    info = FileZeroDataInformation(offset, offset + length)
+    return bool(device_io_control(handle, FSCTL_SET_ZERO_DATA, ctypes.byref(info), ctypes.sizeof(info),
+                                  None, 0, ctypes.byref(returned), None))
+
+
+class Reservation:
+    """一次空间预留，任务结束时调用 :meth:`release`"""
+
+    def __init__(self, manager: 'DiskSpaceManager', device, size: int):
+        self._manager = manager
+        self.device = device
+        self.size = size
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._manager._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class DiskSpaceManager:
+    """磁盘空间检查
+
+    同一文件系统上正在进行的任务会预留其尚未写入的空间（例如 DASH 合并后的输出），
+    后来的任务按扣除预留后的剩余空间判断。空间不足时，如果同一文件系统上还有持有预留的任务，
+    它们结束后可能释放临时文件，新任务会排队等待；否则立即拒绝。
+    """
+
+    SAFETY_MARGIN = 64 * 1024 * 1024  # 始终保留的空间
+    WAIT_INTERVAL = 1.0
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._reserved: Dict[object, Dict[Reservation, int]] = {}
+
+    def _free_space(self, device, existing: str) -> int:
+        reserved = sum(self._reserved.get(device, {}).values())
+        return shutil.disk_usage(existing).free - reserved - self.SAFETY_MARGIN
+
+    def check(self, path: str, required: int):
+        """检查 ``path`` 所在文件系统是否有 ``required`` 字节可用，不足时立即抛出异常"""
+        device, existing = device_of(path)
+        with self._condition:
+            free = self._free_space(device, existing)
+        if free < required:
+            raise InsufficientSpaceError(path, required, free)
+
+    def reserve(self, path: str, required: int, held: Optional[int] = None,
+                is_stopped: Optional[Callable[[], bool]] = None) -> Optional[Reservation]:
+        """等待 ``required`` 字节可用后预留 ``held`` 字节（默认等于 ``required``），被取消返回 None"""
+        held = required if held is None else held
+        device, existing = device_of(path)
+        with self._condition:
+            while True:
+                free = self._free_space(device, existing)
+                if free >= required:
+                    reservation = Reservation(self, device, held)
+                    if held > 0:
+                        self._reserved.setdefault(device, {})[reservation] = held
+                    return reservation
+                if not self._reserved.get(device):
+                    raise InsufficientSpaceError(path, required, free)
+                if is_stopped and is_stopped():
+                    return None
+                self._condition.wait(self.WAIT_INTERVAL)
+
+    def _release(self, reservation: Reservation):
+        with self._condition:
+            reservations = self._reserved.get(reservation.device, {})
+            reservations.pop(reservation, None)
+            if not reservations:
+                self._reserved.pop(reservation.device, None)
+            self._condition.notify_all()
+
+
+diskSpace = DiskSpaceManager()
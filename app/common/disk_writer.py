@@ -0,0 +1,257 @@
+# coding:utf-8
+"""
+后台写盘模块
+网络接收与磁盘写入解耦：接收线程把数据复制到有限的缓冲区环中立即返回，每个磁盘设备一个写线程负责批量写入
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, fields, replace
+from typing import Callable, Dict, Optional
+
+from .disk_space import device_of
+
+
+@dataclass
+class WriterStats:
+    """写线程的统计数据，用于判断瓶颈在网络还是磁盘"""
+
+    bytes_written: int = 0
+    batches: int = 0            # 写线程每次取出一批请求计一次
+    producer_waits: int = 0     # 缓冲区用尽、接收线程等待的次数
+    producer_wait_time: float = 0.0
+    writer_waits: int = 0       # 队列为空、写线程等待的次数
+    writer_wait_time: float = 0.0
+
+    def since(self, earlier: 'WriterStats') -> 'WriterStats':
+        """相对于之前某次快照的增量"""
+        return WriterStats(**{item.name: getattr(self, item.name) - getattr(earlier, item.name)
+                              for item in fields(self)})
+
+
+class _WriteRequest:
+    __slots__ = ('file', 'offset', 'buffer', 'size', 'callback')
+
+    def __init__(self, file, offset, buffer, size, callback):
+        self.file = file
+        self.offset = offset
+        self.buffer = buffer
+        self.size = size
+        self.callback = callback
+
+
+class DiskWriter:
+    """单个磁盘设备的写线程
+
+    缓冲区最多 :attr:`RING_SIZE` 块，全部在途时 :meth:`submit` 阻塞等待，形成背压；
+    写线程每次取出队列中的全部请求，同一文件中首尾相接的请求合并为一次 ``pwritev``。
+    """
+
+    RING_SIZE = 16          # 缓冲区数量
+    MIN_BUFFER_SIZE = 256 * 1024
+
+    def __init__(self, name: str):
+        self.stats = WriterStats()
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._free = []        # 可复用的缓冲区
+        self._allocated = 0
+        self._thread = threading.Thread(target=self._run, name=f'DiskWriter-{name}', daemon=True)
+        self._thread.start()
+
+    def submit(self, file: 'WriteBehindFile', offset: int, data, callback: Optional[Callable]):
+        """复制 ``data`` 并排队写入，缓冲区用尽时等待写线程归还"""
+        size = len(data)
+        with self._condition:
+            buffer = self._acquire_buffer(size)
+            file.pending += 1
+        buffer[:size] = data
+        with self._condition:
+            self._queue.append(_WriteRequest(file, offset, buffer, size, callback))
+            self._condition.notify_all()
+
+    def _acquire_buffer(self, size: int) -> bytearray:
+        if not self._free and self._allocated >= self.RING_SIZE:
+            started = time.monotonic()
+            self.stats.producer_waits += 1
+            while not self._free:
+                self._condition.wait()
+            self.stats.producer_wait_time += time.monotonic() - started
+
+        if self._free:
+            buffer = self._free.pop()
+            if len(buffer) < size:
+                buffer = bytearray(max(size, self.MIN_BUFFER_SIZE))
+            return buffer
+
+        self._allocated += 1
+        return bytearray(max(size, self.MIN_BUFFER_SIZE))
+
+    def wait_idle(self, file: 'WriteBehindFile'):
+        """等待 ``file`` 的所有请求写完"""
+        with self._condition:
+            while file.pending:
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._queue:
+                    started = time.monotonic()
+                    self.stats.writer_waits += 1
+                    while not self._queue:
+                        self._condition.wait()
+                    self.stats.writer_wait_time += time.monotonic() - started
+                batch = list(self._queue)
+                self._queue.clear()
+                self.stats.batches += 1
+
+            index = 0
+            while index < len(batch):
+                # 合并同一文件中连续的请求
+                end = index + 1
+                while (end < len(batch) and batch[end].file is batch[index].file
+                       and batch[end].offset == batch[end - 1].offset + batch[end - 1].size):
+                    end += 1
+                self._write(batch[index:end])
+                index = end
+
+    def _write(self, requests):
+        file = requests[0].file
+        views = [memoryview(request.buffer)[:request.size] for request in requests]
+        try:
+            if file.error is None:
+                file.write_views(requests[0].offset, views)
+                for request, view in zip(requests, views):
+                    if request.callback:
+                        request.callback(view)
+        except BaseException as e:
+            file.error = e
+        finally:
+            for view in views:
+                view.release()
+            with self._condition:
+                for request in requests:
+                    self._free.append(request.buffer)
+                    request.file.pending -= 1
+                    self.stats.bytes_written += request.size
+                self._condition.notify_all()
+
+
+class WriteBehindFile:
+    """通过设备写线程异步写入的文件
+
+    :meth:`write_at` 在数据复制到缓冲区后立即返回，写入完成后在写线程中回调 ``callback(data)``；
+    写入出错后，后续的 :meth:`write_at`、:meth:`flush` 会抛出该错误。关闭时等待所有请求写完。
+    """
+
+    def __init__(self, path: str, writer: DiskWriter):
+        self.path = path
+        self.writer = writer
+        self.pending = 0
+        self.error: Optional[BaseException] = None
+        self._fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+
+    def write_at(self, offset: int, data, callback: Optional[Callable] = None):
+        self._raise_error()
+        self.writer.submit(self, offset, data, callback)
+
+    def write_views(self, offset: int, views):
+        """在写线程中执行实际写入"""
+        if hasattr(os, 'pwritev') and len(views) > 1:
+            total = sum(len(view) for view in views)
+            written = os.pwritev(self._fd, views, offset)
+            if written == total:
+                return
+            # 部分写入时退回逐块写入剩余部分
+            views = [memoryview(b''.join(views))[written:]]
+            offset += written
+
+        for view in views:
+            while len(view):
+                if hasattr(os, 'pwrite'):
+                    count = os.pwrite(self._fd, view, offset)
+                else:
+                    # 只有写线程写这个描述符，seek 与 write 之间不会被打断
+                    os.lseek(self._fd, offset, os.SEEK_SET)
+                    count = os.write(self._fd, view)
+                view = view[count:]
+                offset += count
+
+    def view(self, start: int, end: int):
+        """不支持直接接收，调用方使用自己的缓冲区"""
+        return None
+
+    def release(self, view):
+        pass
+
+    def flush(self):
+        """等待已提交的数据写完"""
+        self.writer.wait_idle(self)
+        self._raise_error()
+
+    def sync(self):
+        """等待已提交的数据写完并刷到磁盘，不能在写线程中调用"""
+        self.flush()
+        os.fsync(self._fd)
+
+    def close(self):
+        if self._fd is None:
+            return
+        try:
+            self.writer.wait_idle(self)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # 已经有异常时关闭过程中的写入错误不再覆盖它
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class DiskWriterPool:
+    """按设备分配写线程，同一块磁盘上的所有下载共用一个写线程"""
+
+    def __init__(self):
+        self._writers: Dict[object, DiskWriter] = {}
+        self._lock = threading.Lock()
+
+    def open(self, path: str) -> WriteBehindFile:
+        """打开已存在的文件进行异步写入"""
+        device = device_of(path)[0]
+        with self._lock:
+            writer = self._writers.get(device)
+            if writer is None:
+                writer = self._writers[device] = DiskWriter(str(device))
+        return WriteBehindFile(path, writer)
+
+    def stats(self) -> Dict[object, WriterStats]:
+        """各设备写线程统计数据的快照"""
+        with self._lock:
+            return {device: replace(writer.stats) for device, writer in self._writers.items()}
+
+    def stats_for(self, path: str) -> WriterStats:
+        """``path`` 所在设备写线程统计数据的快照，尚未写入过时全部为 0"""
+        device = device_of(path)[0]
+        with self._lock:
+            writer = self._writers.get(device)
+            return replace(writer.stats) if writer is not None else WriterStats()
+
+
+diskWriters = DiskWriterPool()
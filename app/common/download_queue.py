@@ -0,0 +1,120 @@
+# coding:utf-8
+"""
+下载队列模块
+所有下载任务进入同一个队列，按优先级 + 先进先出调度，并限制全局与单站点的并发数
+"""
+
+import asyncio
+import heapq
+import itertools
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .config import config
+from .transfer_engine import TransferTask, transferEngine
+
+
+class DownloadQueue(QObject):
+    """全局下载队列
+
+    任务提交后立即进入排队状态（``isRunning()`` 为 True），调度器在传输引擎的事件循环中运行：
+    优先级高的先执行，同优先级按提交顺序执行；全局并发和单站点并发达到上限时继续排队。
+    B站 CDN 在单个客户端打开过多连接时会返回 403/412，因此站点维度按主域名合并计数。
+    """
+
+    PRIORITY_LOW = -10
+    PRIORITY_NORMAL = 0
+    PRIORITY_HIGH = 10
+
+    queueChanged = pyqtSignal(int, int)  # 排队中的任务数, 运行中的任务数
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pending = []  # 堆：(-优先级, 序号, 站点, 准入 Future)
+        self._counter = itertools.count()
+        self._running = 0
+        self._host_running = defaultdict(int)
+
+        config.maxConcurrentDownloads.valueChanged.connect(self._requestDispatch)
+        config.maxDownloadsPerHost.valueChanged.connect(self._requestDispatch)
+
+    @staticmethod
+    def host_key(url: str) -> str:
+        """站点标识，同一 CDN 的不同节点（如 upos-sz-mirrorcos.bilivideo.com）归为一类"""
+        host = urlparse(url).hostname or ''
+        return '.'.join(host.split('.')[-2:])
+
+    def enqueue(self, task: TransferTask, priority: int = PRIORITY_NORMAL):
+        """提交任务，排队期间调用 ``task.stop()`` 会直接出队"""
+        task.is_stopped = False
+        task._queued = True
+        task._future = transferEngine.submit(self._run(task, priority))
+
+    async def _run(self, task: TransferTask, priority: int):
+        host = self.host_key(task.target_url())
+        admission = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._pending, (-priority, next(self._counter), host, admission))
+        self._dispatch()
+
+        try:
+            await admission
+        except asyncio.CancelledError:
+            # 排队期间被取消时不占用并发名额；已获准入、尚未恢复运行时被取消则归还名额
+            if admission.done() and not admission.cancelled():
+                self._release(host)
+            raise
+        task._queued = False
+
+        try:
+            if not task.is_stopped:
+                await task.run()
+        finally:
+            self._release(host)
+
+        # 后处理不占用下载名额，下一个任务此时已经开始下载
+        if not task.is_stopped:
+            await task.post_process()
+
+    def _release(self, host: str):
+        """归还并发名额并调度下一个任务"""
+        self._running -= 1
+        self._host_running[host] -= 1
+        self._dispatch()
+
+    def _requestDispatch(self):
+        """并发上限修改后立即尝试调度"""
+        transferEngine.loop.call_soon_threadsafe(self._dispatch)
+
+    def _dispatch(self):
+        """按顺序放行可以运行的任务，只在引擎事件循环中调用"""
+        max_total = config.get(config.maxConcurrentDownloads)
+        max_per_host = config.get(config.maxDownloadsPerHost)
+
+        deferred = []
+        while self._pending and self._running < max_total:
+            entry = heapq.heappop(self._pending)
+            _, _, host, admission = entry
+
+            # 排队期间已取消
+            if admission.done():
+                continue
+
+            # 该站点已满，让后面其他站点的任务先运行
+            if self._host_running[host] >= max_per_host:
+                deferred.append(entry)
+                continue
+
+            self._running += 1
+            self._host_running[host] += 1
+            admission.set_result(None)
+
+        for entry in deferred:
+            heapq.heappush(self._pending, entry)
+
+        pending = sum(1 for entry in self._pending if not entry[3].done())
+        self.queueChanged.emit(pending, self._running)
+
+
+downloadQueue = DownloadQueue()
@@ -0,0 +1,925 @@
+# coding:utf-8
+"""
+多连接分段下载模块
+探测服务器是否支持 Range 请求，支持时将文件切分为多个字节区间并行下载，
+下载过程写入 ``.part`` 文件并用旁路清单记录已完成区间，中断后可断点续传；
+各连接都是传输引擎事件循环中的 aiohttp 协程
+"""
+
+import asyncio
+import functools
+import glob
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import aiohttp
+
+from .config import config
+from .disk_space import diskSpace, preallocate, punch_hole
+from .disk_writer import WriterStats, diskWriters
+from .output_file import open_output
+from .progress import format_size
+from .http_client import HttpClient
+from .rate_limiter import TokenBucket, bandwidthLimiter
+from .transfer_engine import transferEngine
+from .verifier import VerificationError, tail_digest, verify_file
+
+PART_SUFFIX = '.part'
+MANIFEST_SUFFIX = '.part.json'
+# 每次解析都会变化、不标识资源本身的查询参数（签名、过期时间、CDN 节点和统计信息），比较 URL 时忽略
+VOLATILE_QUERY_PARAMS = frozenset((
+    'deadline', 'e', 'upsig', 'uparams', 'nbs', 'oi', 'trid', 'mid', 'platform', 'gen', 'os', 'og',
+    'bw', 'logo', 'orderid', 'buvid', 'build', 'agrr', 'tag', 'uipk', 'f', 'bvc', 'nettype', 'qn_dyeid',
+    'x-expires', 'x-signature', 'expires', 'signature', 'sign', 'token', 'auth_key', 'wssecret', 'wstime',
+    'line', 'ts', 'timestamp', 'policy', 'key-pair-id', 'x-amz-signature', 'x-amz-date',
+    'x-amz-expires', 'x-amz-credential', 'x-amz-security-token', 'x-amz-algorithm', 'x-amz-signedheaders',
+))
+
+# 正在下载的输出文件，PartManifest.find 不会把它们交给其他任务续传
+_activeOutputs = set()
+_activeLock = threading.Lock()
+
+
+def _output_key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+class DownloadCancelled(Exception):
+    """下载被取消"""
+
+
+class PartManifest:
+    """断点续传清单
+
+    与 ``<输出文件>.part`` 同目录保存为 ``<输出文件>.part.json``，记录来源 URL、
+    ETag/Last-Modified、文件总大小以及已完成的字节区间（闭区间）。
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.path = output_path + MANIFEST_SUFFIX
+        self.url = ''
+        self.etag = ''
+        self.last_modified = ''
+        self.total_size = 0
+        self.completed: List[List[int]] = []
+        self.released = 0  # 开头已从 .part 中释放的字节数，不写入清单
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        """URL 的稳定部分：路径加上标识资源的查询参数
+
+        B站/抖音的签名、过期时间和 CDN 节点等参数每次解析都会变化，见 :data:`VOLATILE_QUERY_PARAMS`；
+        ``video_id``、``ratio`` 等参数决定下载的是哪个文件，必须保留。
+        """
+        parsed = urlparse(url)
+        params = sorted((name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+                        if name.lower() not in VOLATILE_QUERY_PARAMS)
+        return parsed.path + ('?' + urlencode(params) if params else '')
+
+    @classmethod
+    def find(cls, directory: str, url: str) -> Optional[str]:
+        """在目录中查找同一来源的未完成下载，返回其输出文件路径；正在被其他任务下载的文件不会返回"""
+        key = cls.url_key(url)
+        for manifest_path in glob.glob(os.path.join(glob.escape(directory), '*' + MANIFEST_SUFFIX)):
+            output_path = manifest_path[:-len(MANIFEST_SUFFIX)]
+            with _activeLock:
+                if _output_key(output_path) in _activeOutputs:
+                    continue
+            manifest = cls(output_path)
+            if manifest.load() and cls.url_key(manifest.url) == key and os.path.exists(output_path + PART_SUFFIX):
+                return output_path
+        return None
+
+    def load(self) -> bool:
+        """读取清单，文件不存在或损坏时返回 False"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            self.url = data.get('url', '')
+            self.etag = data.get('etag', '')
+            self.last_modified = data.get('last_modified', '')
+            self.total_size = int(data.get('total_size', 0))
+            self.completed = [[int(start), int(end)] for start, end in data.get('completed', [])]
+            self.released = 0
+            return True
+        except (OSError, ValueError, TypeError):
+            return False
+
+    def save(self, completed: Optional[List[List[int]]] = None):
+        """原子地写入清单，避免崩溃时留下半截 JSON
+
+        ``completed`` 为调用方在加锁时取得的完成区间快照，默认使用当前记录。
+        开头已释放的 :attr:`released` 字节不再记为完成，续传时重新下载。
+        """
+        completed = self.completed if completed is None else completed
+        if self.released:
+            completed = [[max(start, self.released), end] for start, end in completed if end >= self.released]
+        data = {
+            'url': self.url,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'total_size': self.total_size,
+            'completed': completed
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        """删除清单文件"""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def matches(self, url: str, total_size: int, etag: str, last_modified: str) -> bool:
+        """判断清单是否对应同一份远端文件"""
+        if self.url_key(self.url) != self.url_key(url) or self.total_size != total_size:
+            return False
+        if self.etag and etag and self.etag != etag:
+            return False
+        if self.last_modified and last_modified and self.last_modified != last_modified:
+            return False
+        return True
+
+    def add_range(self, start: int, end: int):
+        """记录已完成区间并与相邻区间合并"""
+        if end < start:
+            return
+
+        ranges = sorted(self.completed + [[start, end]])
+        merged = [ranges[0]]
+        for range_start, range_end in ranges[1:]:
+            if range_start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        self.completed = merged
+
+    def completed_size(self) -> int:
+        """已完成的字节数"""
+        return sum(end - start + 1 for start, end in self.completed)
+
+    def missing_ranges(self) -> List[Tuple[int, int]]:
+        """尚未完成的区间"""
+        missing = []
+        position = 0
+        for start, end in self.completed:
+            if start > position:
+                missing.append((position, start - 1))
+            position = max(position, end + 1)
+        if position < self.total_size:
+            missing.append((position, self.total_size - 1))
+        return missing
+
+
+class ReceiveBuffer:
+    """可复用的接收缓冲区
+
+    用 ``StreamReader.read(n)`` 把响应数据直接拷贝到预分配的 ``bytearray``（或输出文件的内存映射）中，
+    填满一批后再交给调用方一次性写盘，不为每个网络包单独写入。缓冲区大小根据实测吞吐量在
+    64KB 到 4MB 之间自适应，使每批大约耗时 :attr:`TARGET_BATCH_TIME` 秒，
+    慢速连接下仍能及时响应取消和上报进度。限速时每批不超过限速器的桶容量。
+    """
+
+    MIN_SIZE = 64 * 1024
+    MAX_SIZE = 4 * 1024 * 1024
+    TARGET_BATCH_TIME = 0.2  # 每批数据的目标接收时间（秒）
+
+    def __init__(self, limiters=()):
+        self.size = self.MIN_SIZE
+        self.limiters = limiters
+        self._buffer = bytearray(self.size)
+
+    def _batch_size(self) -> int:
+        """本批读取的大小，限速时不超过最小的桶容量"""
+        bursts = [limiter.burst for limiter in self.limiters if limiter.burst > 0]
+        return min([self.size] + bursts)
+
+    async def chunks(self, response: aiohttp.ClientResponse, limit: Optional[int] = None,
+                     target: Optional[memoryview] = None):
+        """逐批读取响应体，产出的 ``memoryview`` 在下一次迭代前有效，之后即被释放
+
+        ``limit`` 为最多读取的字节数。给出 ``target`` 时直接依次读入其中（例如输出文件的内存映射），
+        产出的是 ``target`` 的切片。
+        """
+        remaining = limit
+        target_offset = 0
+        while remaining is None or remaining > 0:
+            batch_size = self._batch_size()
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            if target is not None:
+                size = min(size, len(target) - target_offset)
+                if not size:
+                    break
+                view = target[target_offset:target_offset + size]
+                target_offset += size
+            else:
+                view = memoryview(self._buffer)[:size]
+
+            try:
+                started = time.monotonic()
+                filled = 0
+                while filled < size:
+                    data = await response.content.read(size - filled)
+                    if not data:
+                        break
+                    view[filled:filled + len(data)] = data
+                    filled += len(data)
+                elapsed = time.monotonic() - started
+
+                if filled:
+                    chunk = view[:filled]
+                    try:
+                        yield chunk
+                    finally:
+                        chunk.release()
+                    if remaining is not None:
+                        remaining -= filled
+            finally:
+                # 切片不再使用时立即释放，输出文件的内存映射才能在下载结束后关闭
+                view.release()
+
+            if filled < size:
+                break
+            if size == self.size:
+                self._adapt(filled, elapsed)
+
+    def _adapt(self, filled: int, elapsed: float):
+        """按本批耗时调整缓冲区大小"""
+        if elapsed < self.TARGET_BATCH_TIME / 2 and self.size < self.MAX_SIZE:
+            self.size = min(self.size * 2, self.MAX_SIZE)
+        elif elapsed > self.TARGET_BATCH_TIME * 2 and self.size > self.MIN_SIZE:
+            self.size = max(self.size // 2, self.MIN_SIZE)
+        else:
+            return
+
+        if len(self._buffer) < self.size:
+            self._buffer = bytearray(self.size)
+
+
+class SegmentedDownloader:
+    """分段下载器
+
+    先用 ``Range: bytes=0-0`` 请求探测 ``Accept-Ranges``/``Content-Length``，
+    服务器支持时将文件切分为 N 个字节区间并行下载，写入预分配的 ``.part`` 文件，
+    全部完成后重命名为目标文件；不支持分段时退回单连接流式下载，文件过小时只切分为一个区间。
+
+    所有网络传输都是运行在 :data:`~.transfer_engine.transferEngine` 事件循环中的协程，
+    共用引擎的 aiohttp 会话，每个分段是一个协程而不是一个线程；只有刷盘、预分配和校验等
+    磁盘操作交给引擎线程池。协程中调用 :meth:`download_async`，工作线程中调用 :meth:`download`。
+
+    分段模式下已完成区间会定期写入 :class:`PartManifest`，取消、出错或进程崩溃后
+    再次下载同一路径时，只会用 Range 请求补齐缺失的部分。
+
+    每批数据写入前依次经过全局限速器和任务自身的 ``rate_limiter``。
+
+    流式模式（``streaming=True``）下按固定大小的块从前往后分配给各连接，使文件前缀连续增长，
+    下载完成后保留 ``.part`` 文件，供 :class:`PartFileReader` 边下载边读取。
+
+    传入备用地址（如 B站 ``backup_url``）时，探测阶段同时请求所有地址，按首字节到达顺序
+    排列镜像；传输中某个镜像出错或吞吐量持续低于阈值时，分段从当前位置切换到下一个镜像继续。
+
+    流式模式下同时指定 ``release_consumed`` 时，读取方处理过的开头部分会通过 :meth:`release_prefix`
+    从 ``.part`` 中释放磁盘块，磁盘上只保留尚未被读取的数据；被释放的区间从清单中去掉，续传时重新下载。
+
+    下载结束后用 :func:`verify_file` 检查长度和 MP4/FLV 结构（开头会被释放时只检查长度，结构由读取方检查），
+    发现截断或损坏时只用 Range 请求重新下载损坏位置之后的部分；重新下载的尾部与上次完全相同时，
+    说明服务器上的文件本身如此，只给出警告并保留。
+    """
+
+    MIN_SEGMENT_SIZE = 1024 * 1024  # 每个分段至少 1MB，避免小文件也开多连接
+    MAX_RETRIES = 3
+    MANIFEST_SAVE_INTERVAL = 1.0  # 清单落盘间隔（秒）
+    MIRROR_CHECK_INTERVAL = 5.0   # 镜像吞吐量统计窗口（秒）
+    MIN_MIRROR_SPEED = 128 * 1024  # 单个连接低于该速度（字节/秒）时切换镜像
+    STREAMING_BLOCK_SIZE = 4 * 1024 * 1024  # 流式模式下每次分配给连接的块大小
+    MAX_REPAIR_ATTEMPTS = 2  # 校验失败后重新下载尾部的次数
+    CONNECT_TIMEOUT = 5
+
+    def __init__(self, url: str, output_path: str, headers: Optional[Dict[str, str]] = None,
+                 connections: Optional[int] = None,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 is_stopped: Optional[Callable[[], bool]] = None, timeout: int = 30,
+                 mirrors: Optional[List[str]] = None, rate_limiter: Optional[TokenBucket] = None,
+                 streaming: bool = False, release_consumed: bool = False):
+        self.url = url
+        # 实际使用的地址列表，探测后按首字节速度排序
+        self.mirrors = [url] + [mirror for mirror in (mirrors or []) if mirror and mirror != url]
+        self.output_path = output_path
+        self.part_path = output_path + PART_SUFFIX
+        self.headers = dict(headers or {})
+        # 视频 CDN 本身不压缩，明确要求原始字节以便直接读入输出文件
+        self.headers.setdefault('Accept-Encoding', 'identity')
+        self.connections = max(1, connections or config.get(config.downloadConnections))
+        self.progress_callback = progress_callback
+        self.is_stopped = is_stopped or (lambda: False)
+        self.timeout = timeout
+        self.limiters = (bandwidthLimiter, rate_limiter) if rate_limiter else (bandwidthLimiter,)
+        self.streaming = streaming
+        self.release_consumed = streaming and release_consumed
+
+        self.total_size = 0
+        self.downloaded = 0
+        self.manifest = PartManifest(output_path)
+        self._abort = False
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)  # 通知流式读取方有新数据
+        self._segmented = False
+        self._ready = False      # .part 文件已就绪，可以打开读取
+        self._finished = False   # 下载已结束（成功、取消或失败）
+        self._succeeded = False
+        self._last_save = 0.0
+        self._save_lock = threading.Lock()  # 串行化清单保存，刷盘期间不阻塞接收协程
+        self._output = None      # 分段下载时各连接共用的输出文件
+        self._allocated = False  # .part 的磁盘块是否已真正分配，决定能否内存映射
+        self.writer_stats = WriterStats()  # 下载期间所在磁盘写线程的统计增量
+
+    def download(self) -> bool:
+        """在工作线程中执行下载并等待结束，传输本身仍在引擎事件循环中进行，不能在引擎线程中调用"""
+        return transferEngine.submit(self.download_async()).result()
+
+    async def download_async(self) -> bool:
+        """执行下载，完成返回 True，被取消返回 False（已下载部分保留用于续传）
+
+        同一输出文件同时只能有一个下载器，已有任务在写入时抛出 :class:`OSError`。
+        """
+        output_key = _output_key(self.output_path)
+        with _activeLock:
+            if output_key in _activeOutputs:
+                raise OSError(f"文件正在被其他任务下载: {self.output_path}")
+            _activeOutputs.add(output_key)
+
+        try:
+            writer_stats = diskWriters.stats_for(self.part_path)
+            response, total_size, accept_ranges = await self._probe()
+            self.total_size = total_size
+
+            try:
+                if accept_ranges:
+                    response.close()
+                    self._segmented = True
+                    await transferEngine.run_blocking(self._prepare_manifest, response.headers)
+                    self._mark_ready()
+                    if self.downloaded and self.progress_callback:
+                        # 续传时先上报已有的部分
+                        self.progress_callback(self.downloaded, self.total_size)
+                    await self._download_segmented()
+                else:
+                    await transferEngine.run_blocking(self.manifest.remove)
+                    await self._download_single(response)
+                await self._verify()
+            except DownloadCancelled:
+                return False
+            finally:
+                response.close()
+
+            # 流式模式下 .part 文件仍在被读取，由调用方处理完后调用 discard() 删除
+            if not self.streaming:
+                os.replace(self.part_path, self.output_path)
+                self.manifest.remove()
+            self._report_writer_stats(writer_stats)
+            self._succeeded = True
+            return True
+        finally:
+            with _activeLock:
+                _activeOutputs.discard(output_key)
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+    def _report_writer_stats(self, before: WriterStats):
+        """下载期间接收方曾等待写线程时输出所在磁盘的统计，说明瓶颈在磁盘而不是网络"""
+        self.writer_stats = diskWriters.stats_for(self.part_path).since(before)
+        if self.writer_stats.producer_waits:
+            print(f"磁盘写入慢于网络接收: {self.output_path}，"
+                  f"接收等待写盘 {self.writer_stats.producer_waits} 次，"
+                  f"共 {self.writer_stats.producer_wait_time:.1f} 秒，"
+                  f"期间写入 {format_size(self.writer_stats.bytes_written)}")
+
+    def _mark_ready(self):
+        with self._condition:
+            self._ready = True
+            self._condition.notify_all()
+
+    def available_size(self) -> int:
+        """``.part`` 文件开头已连续写入的字节数"""
+        with self._lock:
+            return self._available_size()
+
+    def _available_size(self) -> int:
+        if not self._segmented:
+            return self.downloaded
+        completed = self.manifest.completed
+        if completed and completed[0][0] == 0:
+            return completed[0][1] + 1
+        return 0
+
+    def wait_available(self, position: int, timeout: float = 0.5) -> Tuple[int, bool, bool]:
+        """等待 ``position`` 处的数据写入或下载结束
+
+        返回 (连续可读字节数, 是否已结束, 是否成功)，超时后也会返回，便于调用方检查取消
+        """
+        with self._condition:
+            if not (self._ready and self._available_size() > position) and not self._finished:
+                self._condition.wait(timeout)
+            available = self._available_size() if self._ready else 0
+            return available, self._finished, self._succeeded
+
+    def release_prefix(self, size: int):
+        """读取方已处理完开头 ``size`` 字节，释放这部分占用的磁盘块
+
+        先把这些区间从清单中去掉再释放，进程在两步之间退出也不会把已释放的区间当作已下载。
+        未指定 ``release_consumed`` 或文件系统不支持时不做任何事。
+        """
+        if not self.release_consumed or size <= self.manifest.released:
+            return
+
+        with self._save_lock:
+            with self._lock:
+                self.manifest.released = size
+                completed = [list(item) for item in self.manifest.completed]
+            if self._segmented:
+                self.manifest.save(completed)
+        punch_hole(self.part_path, 0, size)
+
+    def discard(self):
+        """放弃续传，删除 ``.part`` 文件和清单"""
+        for path in (self.part_path, self.manifest.path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def _request(self, url: str, headers: Dict[str, str]) -> aiohttp.ClientResponse:
+        """通过引擎的共享会话发起 GET 请求，返回尚未读取响应体的响应"""
+        session = await transferEngine.session()
+        request_headers = HttpClient.default_headers(url)
+        request_headers.update(headers)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.CONNECT_TIMEOUT, sock_read=self.timeout)
+        return await session.get(url, headers=request_headers, timeout=timeout)
+
+    async def _probe(self) -> Tuple[aiohttp.ClientResponse, int, bool]:
+        """探测文件大小与 Range 支持情况
+
+        返回探测用的响应对象（服务器忽略 Range 时可直接用于单连接下载）、文件总大小、是否支持分段
+        """
+        if len(self.mirrors) == 1:
+            return await self._probe_url(self.mirrors[0])
+        return await self._race_mirrors()
+
+    async def _race_mirrors(self) -> Tuple[aiohttp.ClientResponse, int, bool]:
+        """同时探测所有镜像，采用最先返回的结果，其余镜像排在其后作为备用"""
+        failed = []
+        winner = None
+        error = None
+
+        probes = {asyncio.ensure_future(self._probe_url(mirror)): mirror for mirror in self.mirrors}
+        pending = set(probes)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for probe in done:
+                    if probe.exception() is not None:
+                        error = error or probe.exception()
+                        failed.append(probes[probe])
+                    elif winner is None:
+                        winner = probe.result()
+                        self.mirrors.remove(probes[probe])
+                        self.mirrors.insert(0, probes[probe])
+                    else:
+                        probe.result()[0].close()
+        finally:
+            # 不再等待落后的探测，已经返回的响应直接关闭
+            for probe in pending:
+                probe.cancel()
+                probe.add_done_callback(self._close_probe)
+
+        if winner is None:
+            raise error
+
+        # 探测失败的镜像排在最后，传输中仍可作为最后的备选
+        self.mirrors = [mirror for mirror in self.mirrors if mirror not in failed] + failed
+        return winner
+
+    @staticmethod
+    def _close_probe(probe: asyncio.Future):
+        if not probe.cancelled() and probe.exception() is None:
+            probe.result()[0].close()
+
+    async def _probe_url(self, url: str) -> Tuple[aiohttp.ClientResponse, int, bool]:
+        """探测单个地址"""
+        response = await self._request(url, dict(self.headers, Range='bytes=0-0'))
+
+        if response.status == 206:
+            total_size = self._parse_content_range(response.headers.get('Content-Range', ''))
+            if total_size > 0:
+                return response, total_size, True
+
+            # 无法得知总大小，重新发起完整请求
+            response.close()
+            response = await self._request(url, self.headers)
+
+        if response.status != 200:
+            response.close()
+            raise Exception(f"下载失败，状态码: {response.status}")
+
+        total_size = int(response.headers.get('Content-Length', 0))
+        accept_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes' and total_size > 0
+        return response, total_size, accept_ranges
+
+    @staticmethod
+    def _parse_content_range(content_range: str) -> int:
+        """从 ``bytes 0-0/12345`` 中解析文件总大小"""
+        match = re.match(r'bytes\s+\d+-\d+/(\d+)', content_range)
+        return int(match.group(1)) if match else 0
+
+    def _prepare_manifest(self, headers):
+        """加载可续传的清单，远端文件已变化或 ``.part`` 丢失时重新开始"""
+        etag = headers.get('ETag', '')
+        last_modified = headers.get('Last-Modified', '')
+
+        resumable = (
+            self.manifest.load()
+            and os.path.exists(self.part_path)
+            and os.path.getsize(self.part_path) == self.total_size
+            and self.manifest.matches(self.url, self.total_size, etag, last_modified)
+        )
+
+        if not resumable:
+            # 检查剩余空间并预分配 .part 文件，各分段直接写入自己的偏移位置
+            self._check_space()
+            with open(self.part_path, 'wb') as f:
+                self._allocated = preallocate(f, self.total_size)
+            self.manifest.completed = []
+        else:
+            # 续传的文件可能是稀疏的，补齐尚未分配的磁盘块，已有数据不受影响
+            with open(self.part_path, 'r+b') as f:
+                self._allocated = preallocate(f, self.total_size)
+
+        # 始终记录最新的来源信息
+        self.manifest.url = self.url
+        self.manifest.etag = etag
+        self.manifest.last_modified = last_modified
+        self.manifest.total_size = self.total_size
+        self.manifest.save()
+
+        self.downloaded = self.manifest.completed_size()
+
+    def _split_ranges(self, missing: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """将缺失区间切分为大约 N 个闭区间 [start, end]，流式模式下切分为固定大小的块"""
+        if self.streaming:
+            ranges = []
+            for start, end in missing:
+                for block_start in range(start, end + 1, self.STREAMING_BLOCK_SIZE):
+                    ranges.append((block_start, min(end, block_start + self.STREAMING_BLOCK_SIZE - 1)))
+            return ranges
+
+        remaining = sum(end - start + 1 for start, end in missing)
+        count = min(self.connections, max(1, remaining // self.MIN_SEGMENT_SIZE))
+        segment_size = max(1, remaining // count)
+
+        ranges = []
+        for start, end in missing:
+            while start <= end:
+                # 末尾不足半个分段的部分并入当前分段
+                segment_end = start + segment_size - 1
+                if end - segment_end < segment_size // 2:
+                    segment_end = end
+                ranges.append((start, segment_end))
+                start = segment_end + 1
+        return ranges
+
+    def _create_part(self):
+        """创建单连接下载的 ``.part`` 文件，已知大小时检查空间并预分配"""
+        if self.total_size:
+            self._check_space()
+        with open(self.part_path, 'wb') as f:
+            if self.total_size:
+                preallocate(f, self.total_size)
+
+    async def _download_single(self, response: aiohttp.ClientResponse):
+        """单连接流式下载"""
+        await transferEngine.run_blocking(self._create_part)
+        self._mark_ready()
+
+        f = await transferEngine.run_blocking(diskWriters.open, self.part_path)
+        try:
+            await self._receive_sequential(response, f, 0)
+        finally:
+            await transferEngine.run_blocking(f.close)
+
+        if self.downloaded < self.total_size:
+            # 响应提前结束，去掉预分配的空白部分，由校验阶段补齐
+            os.truncate(self.part_path, self.downloaded)
+
+    async def _receive_sequential(self, response: aiohttp.ClientResponse, f, position: int):
+        """顺序接收整个响应，从 ``position`` 起交给写线程写入"""
+        async for chunk in ReceiveBuffer(self.limiters).chunks(response):
+            await self._throttle(len(chunk))
+            if self.is_stopped():
+                raise DownloadCancelled()
+
+            # 写线程的缓冲区用尽时 write_at 会等待，放到线程池中执行，不阻塞事件循环
+            await transferEngine.run_blocking(f.write_at, position, chunk, self._add_progress)
+            position += len(chunk)
+
+    def _check_space(self):
+        """写入前检查剩余空间，已有的 .part 文件会被覆盖，其占用的空间不计入需求"""
+        try:
+            existing = os.path.getsize(self.part_path)
+        except OSError:
+            existing = 0
+        diskSpace.check(os.path.dirname(os.path.abspath(self.part_path)), self.total_size - existing)
+
+    async def _verify(self):
+        """校验下载结果，损坏时从完好的位置起重新下载，多次修复仍失败时抛出 :class:`VerificationError`"""
+        attempt = 0
+        previous_tail = None  # 上一次失败时的 (损坏位置, 其后内容的摘要)
+        while True:
+            try:
+                await transferEngine.run_blocking(
+                    verify_file, self.part_path, self.total_size, not self.release_consumed)
+                break
+            except VerificationError as e:
+                tail = await transferEngine.run_blocking(self._tail_state, e.valid_size)
+                if tail is not None and tail == previous_tail:
+                    # 长度正确且重新下载的内容完全相同，不是传输造成的损坏，可能只是校验器不认识的格式
+                    print(f"文件结构校验未通过，重新下载后内容不变，按原样保留: {self.output_path}: {e}")
+                    break
+
+                attempt += 1
+                if attempt > self.MAX_REPAIR_ATTEMPTS or (self.total_size and e.valid_size >= self.total_size):
+                    raise
+                previous_tail = tail
+                await self._refetch_tail(e.valid_size)
+
+    def _tail_state(self, valid_size: int) -> Optional[Tuple[int, str]]:
+        """文件长度正确时返回 (损坏位置, 其后内容的摘要)，长度不对时返回 None"""
+        size = os.path.getsize(self.part_path)
+        if self.total_size and size != self.total_size:
+            return None
+        return valid_size, tail_digest(self.part_path, valid_size)
+
+    async def _refetch_tail(self, valid_size: int):
+        """丢弃 ``valid_size`` 之后的数据并重新下载"""
+        with self._condition:
+            self.downloaded = valid_size
+            if self._segmented:
+                self.manifest.completed = [[0, valid_size - 1]] if valid_size > 0 else []
+                self.manifest.save()
+
+        if self._segmented:
+            await self._download_segmented()
+            return
+
+        # 单连接模式下服务器未声明支持 Range，仍然尝试续传，不支持时只能报错
+        response = await self._request(self.mirrors[0], dict(self.headers, Range=f'bytes={valid_size}-'))
+        try:
+            if response.status != 206:
+                raise VerificationError("文件不完整且服务器不支持续传", valid_size)
+
+            os.truncate(self.part_path, valid_size)
+            f = await transferEngine.run_blocking(diskWriters.open, self.part_path)
+            try:
+                await self._receive_sequential(response, f, valid_size)
+            finally:
+                await transferEngine.run_blocking(f.close)
+        finally:
+            response.close()
+
+    async def _download_segmented(self):
+        """多连接分段下载缺失区间，每个连接是一个依次领取区间的协程"""
+        ranges = deque(self._split_ranges(self.manifest.missing_ranges()))
+        if not ranges:
+            return
+
+        self._output = await transferEngine.run_blocking(
+            open_output, self.part_path, self.total_size, self._allocated)
+        workers = [asyncio.ensure_future(self._range_worker(ranges))
+                   for _ in range(min(len(ranges), self.connections))]
+        try:
+            done, pending = await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+
+            # 任一分段失败时通知其余分段尽快退出，尚未开始的分段不再发送请求
+            errors = [worker.exception() for worker in done]
+            error = next((error for error in errors if error is not None), None)
+            if error:
+                self._abort = True
+                ranges.clear()
+                for worker in pending:
+                    worker.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                raise error
+        except asyncio.CancelledError:
+            self._abort = True
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        finally:
+            try:
+                await transferEngine.run_blocking(self._save_manifest)
+            finally:
+                output, self._output = self._output, None
+                await transferEngine.run_blocking(output.close)
+
+    async def _range_worker(self, ranges: deque):
+        """领取并下载区间，直到没有剩余区间"""
+        while ranges:
+            if self.is_stopped() or self._abort:
+                raise DownloadCancelled()
+            start, end = ranges.popleft()
+            await self._download_range(start, end)
+
+    def _save_manifest(self, periodic: bool = False):
+        """先把已写入的数据刷到磁盘再保存清单，保证清单中记录的区间确实已经落盘
+
+        ``periodic`` 为 True 时未到保存间隔或其他连接正在保存则直接返回。
+        """
+        if periodic:
+            if time.monotonic() - self._last_save < self.MANIFEST_SAVE_INTERVAL:
+                return
+            if not self._save_lock.acquire(blocking=False):
+                return
+        else:
+            self._save_lock.acquire()
+
+        try:
+            self._last_save = time.monotonic()
+            with self._lock:
+                completed = [list(item) for item in self.manifest.completed]
+            if self._output is not None:
+                self._output.sync()
+            self.manifest.save(completed)
+        finally:
+            self._save_lock.release()
+
+    async def _download_range(self, start: int, end: int):
+        """下载单个字节区间，连接中断或镜像过慢时从已写入位置换镜像继续"""
+        position = start
+        retries = 0
+        mirror_index = 0
+        receive_buffer = ReceiveBuffer(self.limiters)
+
+        while position <= end:
+            # 已取消或其他分段失败时不再发起请求
+            if self.is_stopped() or self._abort:
+                raise DownloadCancelled()
+            url = self.mirrors[mirror_index % len(self.mirrors)]
+            headers = dict(self.headers, Range=f'bytes={position}-{end}')
+            last_position = position
+            error = None
+            try:
+                response = await self._request(url, headers)
+                try:
+                    if response.status != 206:
+                        raise Exception(f"分段下载失败，状态码: {response.status}")
+
+                    window_start = time.monotonic()
+                    window_position = position
+                    # 输出文件能映射时直接接收到映射中，否则交给设备写线程，写入完成后才记录完成区间
+                    target = self._output.view(position, end)
+                    chunks = receive_buffer.chunks(response, end - position + 1, target)
+                    try:
+                        async for chunk in chunks:
+                            await self._throttle(len(chunk))
+                            if self.is_stopped() or self._abort:
+                                raise DownloadCancelled()
+
+                            callback = functools.partial(self._add_progress, offset=position)
+                            if target is not None:
+                                self._output.write_at(position, chunk, callback)
+                            else:
+                                await transferEngine.run_blocking(self._output.write_at, position, chunk, callback)
+                            position += len(chunk)
+
+                            if position > end:
+                                break
+                            if time.monotonic() - self._last_save >= self.MANIFEST_SAVE_INTERVAL:
+                                # 刷盘可能较慢，放到线程池中执行
+                                await transferEngine.run_blocking(self._save_manifest, True)
+
+                            # 当前镜像吞吐量过低且还有其他镜像时，断开并从当前位置换镜像（限速期间不判断）
+                            elapsed = time.monotonic() - window_start
+                            if elapsed >= self.MIRROR_CHECK_INTERVAL:
+                                if (len(self.mirrors) > 1 and not self._is_throttled()
+                                        and (position - window_position) / elapsed < self.MIN_MIRROR_SPEED):
+                                    mirror_index += 1
+                                    break
+                                window_start = time.monotonic()
+                                window_position = position
+                    finally:
+                        # 提前退出循环时关闭生成器，释放其中尚未归还的切片，再归还本分段的映射切片
+                        await chunks.aclose()
+                        if target is not None:
+                            self._output.release(target)
+                finally:
+                    # 响应体已读完时连接回到会话的连接池，否则直接断开
+                    response.release()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            except DownloadCancelled:
+                raise
+            except Exception as e:
+                # 状态码异常等错误只有在还有其他镜像时才重试
+                if len(self.mirrors) == 1:
+                    raise
+                error = e
+
+            if position > end:
+                break
+
+            # 出错时换下一个镜像；所有镜像轮过一遍都没有任何进展才计入重试次数
+            if error is not None:
+                mirror_index += 1
+            if position == last_position:
+                retries += 1
+                if retries > self.MAX_RETRIES * len(self.mirrors):
+                    raise error or Exception("分段下载失败，连接多次中断")
+            else:
+                retries = 0
+
+    async def _throttle(self, size: int):
+        """按限速器等待"""
+        for limiter in self.limiters:
+            await limiter.consume_async(size, lambda: self.is_stopped() or self._abort)
+
+    def _is_throttled(self) -> bool:
+        return any(limiter.rate > 0 for limiter in self.limiters)
+
+    def _add_progress(self, chunk, offset: Optional[int] = None):
+        """累加已下载字节，记录完成区间并回调进度，单连接模式下 ``offset`` 为 None"""
+        size = len(chunk)
+        with self._condition:
+            self.downloaded += size
+            downloaded = self.downloaded
+
+            if offset is not None:
+                self.manifest.add_range(offset, offset + size - 1)
+
+            self._condition.notify_all()
+
+        if self.progress_callback:
+            self.progress_callback(downloaded, self.total_size)
+
+
+class PartFileReader(io.RawIOBase):
+    """边下载边读取 ``.part`` 文件
+
+    只读取下载器已连续写入的前缀，数据未到达时阻塞等待；下载被取消或失败时抛出
+    :class:`DownloadCancelled`。配合流式模式的 :class:`SegmentedDownloader` 使用，
+    可以把正在下载的流直接交给封装器，不必等整个文件下载完成。读取位置每前进 :attr:`RELEASE_STEP`
+    就通知下载器释放已读过的部分（下载器指定了 ``release_consumed`` 时生效）。
+    """
+
+    RELEASE_STEP = 16 * 1024 * 1024
+
+    def __init__(self, downloader: SegmentedDownloader):
+        super().__init__()
+        self.downloader = downloader
+        self._file = None
+        self._position = 0
+        self._released = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while True:
+            available, finished, succeeded = self.downloader.wait_available(self._position)
+            if self._position < available:
+                break
+            if finished:
+                if succeeded:
+                    return 0
+                raise DownloadCancelled()
+
+        if self._file is None:
+            self._file = open(self.downloader.part_path, 'rb')
+
+        size = min(len(buffer), available - self._position)
+        self._file.seek(self._position)
+        count = self._file.readinto(memoryview(buffer)[:size])
+        self._position += count
+        if self._position - self._released >= self.RELEASE_STEP:
+            # 读到的数据已复制到调用方的缓冲区，输入只顺序读取一次，文件中的这部分不会再用到
+            self._released = self._position // self.RELEASE_STEP * self.RELEASE_STEP
+            self.downloader.release_prefix(self._released)
+        return count
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
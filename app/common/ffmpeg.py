@@ -0,0 +1,182 @@
+# coding:utf-8
+"""
+FFmpeg 模块
+依次在设置中的路径、程序自带目录和 PATH 中查找 FFmpeg，探测到的版本与封装格式按可执行文件的修改时间缓存到磁盘
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from .config import CONFIG_DIR, config
+from .media_jobs import CREATE_NO_WINDOW
+
+FFMPEG_CACHE_PATH = CONFIG_DIR / "ffmpeg_cache.json"
+FFMPEG_NAME = 'ffmpeg.exe' if sys.platform == 'win32' else 'ffmpeg'
+
+# 程序根目录下自带的 ffmpeg 目录
+BUNDLED_FFMPEG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'ffmpeg', FFMPEG_NAME)
+
+
+class FFmpegNotFoundError(Exception):
+    """未找到可用的 FFmpeg"""
+
+
+@dataclass
+class FFmpegInfo:
+    """FFmpeg 可执行文件及其能力"""
+
+    path: str
+    version: str = ''
+    muxers: List[str] = field(default_factory=list)
+
+    def supports_muxer(self, name: str) -> bool:
+        return name in self.muxers
+
+
+class FFmpegLocator:
+    """FFmpeg 查找器
+
+    查找顺序：设置中指定的路径、程序自带的 ``ffmpeg`` 目录、系统 PATH。
+    每个可执行文件只在修改时间或大小变化后才重新运行 ``-version``/``-muxers`` 探测，
+    结果写入配置目录下的 ``ffmpeg_cache.json``，启动和每次合并都不需要额外启动进程。
+    """
+
+    PROBE_TIMEOUT = 10
+
+    def __init__(self):
+        self._info: Optional[FFmpegInfo] = None
+        self._located = False
+        self._lock = threading.Lock()
+        config.ffmpegPath.valueChanged.connect(self.invalidate)
+
+    def candidates(self) -> List[str]:
+        """按优先级返回候选路径"""
+        paths = []
+        custom = config.get(config.ffmpegPath)
+        if custom:
+            # 允许填写所在目录
+            paths.append(os.path.join(custom, FFMPEG_NAME) if os.path.isdir(custom) else custom)
+        paths.append(BUNDLED_FFMPEG_PATH)
+        system = shutil.which('ffmpeg')
+        if system:
+            paths.append(system)
+        return paths
+
+    def locate(self) -> Optional[FFmpegInfo]:
+        """返回第一个可用的 FFmpeg，找不到时返回 None"""
+        with self._lock:
+            if not self._located:
+                self._info = self._locate()
+                self._located = True
+            return self._info
+
+    def require(self, muxer: Optional[str] = None) -> FFmpegInfo:
+        """返回可用的 FFmpeg，不可用或不支持指定封装格式时抛出 :class:`FFmpegNotFoundError`"""
+        info = self.locate()
+        if info is None:
+            raise FFmpegNotFoundError("未找到FFmpeg，请在设置中指定FFmpeg路径")
+        if muxer and info.muxers and not info.supports_muxer(muxer):
+            raise FFmpegNotFoundError(f"当前FFmpeg不支持 {muxer} 格式")
+        return info
+
+    def invalidate(self):
+        """设置中的路径变化后重新查找"""
+        with self._lock:
+            self._info = None
+            self._located = False
+
+    def _locate(self) -> Optional[FFmpegInfo]:
+        cache = self._load_cache()
+        for path in self.candidates():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            path = os.path.abspath(path)
+            entry = cache.get(path)
+            if entry and entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size:
+                return FFmpegInfo(path, entry.get('version', ''), entry.get('muxers', []))
+
+            info = self._probe(path)
+            if info is None:
+                continue
+
+            cache[path] = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'version': info.version,
+                'muxers': info.muxers
+            }
+            self._save_cache(cache)
+            return info
+        return None
+
+    def _probe(self, path: str) -> Optional[FFmpegInfo]:
+        """运行 FFmpeg 获取版本和支持的封装格式，无法运行时返回 None"""
+        try:
+            version_output = self._run(path, '-version')
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+        first_line = version_output.splitlines()[0] if version_output else ''
+        if not first_line.startswith('ffmpeg version'):
+            return None
+        version = first_line.split()[2] if len(first_line.split()) > 2 else ''
+
+        try:
+            muxers = self._parse_muxers(self._run(path, '-muxers'))
+        except (OSError, subprocess.SubprocessError):
+            muxers = []
+        return FFmpegInfo(path, version, muxers)
+
+    def _run(self, path: str, option: str) -> str:
+        result = subprocess.run(
+            [path, '-hide_banner', option],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            timeout=self.PROBE_TIMEOUT, creationflags=CREATE_NO_WINDOW
+        )
+        return result.stdout.decode('utf-8', errors='ignore')
+
+    @staticmethod
+    def _parse_muxers(output: str) -> List[str]:
+        """解析 ``-muxers`` 输出中 `` E mp4   MP4 (MPEG-4 Part 14)`` 形式的行"""
+        muxers = []
+        started = False
+        for line in output.splitlines():
+            if line.strip().startswith('--'):
+                started = True
+                continue
+            parts = line.split()
+            if not started or len(parts) < 2 or 'E' not in parts[0]:
+                continue
+            muxers.extend(parts[1].split(','))
+        return muxers
+
+    @staticmethod
+    def _load_cache() -> dict:
+        try:
+            with open(FFMPEG_CACHE_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _save_cache(cache: dict):
+        try:
+            temp_path = str(FFMPEG_CACHE_PATH) + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, FFMPEG_CACHE_PATH)
+        except OSError as e:
+            print(f"保存FFmpeg缓存失败: {e}")
+
+
+ffmpegLocator = FFmpegLocator()
@@ -0,0 +1,94 @@
+# coding:utf-8
+"""
+共享 HTTP 客户端模块
+进程内所有请求复用同一个连接池，解析、封面、头像、下载之间保持长连接，避免重复 TCP+TLS 握手
+"""
+
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+BILIBILI_REFERER = 'https://www.bilibili.com/'
+
+# 需要带 B站 Referer 的域名（API、图片、视频 CDN）
+BILIBILI_DOMAINS = ('bilibili.com', 'hdslb.com', 'bilivideo.com', 'bilivideo.cn', 'b23.tv')
+
+
+class HttpClient:
+    """线程安全的共享 HTTP 客户端
+
+    底层为单个 ``requests.Session``，urllib3 按主机维护独立的 keep-alive 连接池。
+    会话本身不保存任何 Cookie，登录态始终由调用方通过请求头显式传入，
+    避免不同调用方之间的 Cookie 串用。
+    """
+
+    DEFAULT_TIMEOUT = (5, 30)  # (连接超时, 读取超时)
+    POOL_CONNECTIONS = 16      # 缓存的主机连接池数量
+    POOL_MAXSIZE = 32          # 每个主机保持的最大连接数
+    MAX_RETRIES = 2            # 建立连接失败时的重试次数
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """延迟创建共享会话"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers.update({'User-Agent': USER_AGENT})
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        adapter = HTTPAdapter(
+            pool_connections=self.POOL_CONNECTIONS,
+            pool_maxsize=self.POOL_MAXSIZE,
+            max_retries=self.MAX_RETRIES
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @staticmethod
+    def default_headers(url: str) -> Dict[str, str]:
+        """根据目标主机返回公共请求头"""
+        host = urlparse(url).hostname or ''
+        if any(host == domain or host.endswith('.' + domain) for domain in BILIBILI_DOMAINS):
+            return {'Referer': BILIBILI_REFERER}
+        return {}
+
+    def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, **kwargs) -> requests.Response:
+        """发送请求，未指定时使用默认超时和公共请求头"""
+        kwargs.setdefault('timeout', self.DEFAULT_TIMEOUT)
+        merged_headers = self.default_headers(url)
+        merged_headers.update(headers or {})
+        return self.session.request(method, url, headers=merged_headers, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request('HEAD', url, **kwargs)
+
+    def close(self):
+        """关闭所有连接"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+httpClient = HttpClient()
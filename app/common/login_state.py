@@ -0,0 +1,167 @@
+# coding:utf-8
+"""
+登录状态模块
+B站 Cookie 只从磁盘读取一次，登录是否有效通过 nav 接口在后台验证并缓存一段时间，
+解析、下载和界面直接读取缓存的状态，不再每次操作都请求一次 nav 接口
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .bilibili_login import BilibiliLogin
+from .config import LOGIN_FILE_PATH
+
+
+class LoginState(QObject):
+    """B站登录状态
+
+    :attr:`is_logged_in`、:attr:`user_info` 只返回缓存的结果，可以在界面线程中调用；
+    :meth:`ensure_valid` 在缓存过期时同步验证，只在工作线程中调用；:meth:`refresh` 在后台线程中验证。
+    登录、退出登录以及接口返回未登录（HTTP 401 或 code -101）时缓存失效；
+    验证时遇到网络错误保留原有状态，下次调用时重试。每次验证或失效后发送 :attr:`changed`。
+    """
+
+    changed = pyqtSignal()
+
+    TTL = 10 * 60  # 验证结果的有效期（秒）
+
+    def __init__(self):
+        super().__init__()
+        self._cookies: Optional[Dict[str, str]] = None
+        self._user_info: Optional[Dict] = None
+        self._logged_in = False
+        self._validated_at: Optional[float] = None
+        self._refreshing = False
+        self._generation = 0  # 每次 Cookie 失效加一，丢弃失效前发出的验证请求的结果
+        self._lock = threading.Lock()
+
+    @property
+    def is_logged_in(self) -> bool:
+        """缓存的登录状态，尚未验证时有 Cookie 即视为已登录"""
+        with self._lock:
+            if not self._load_cookies():
+                return False
+            return self._logged_in if self._validated_at is not None else True
+
+    @property
+    def user_info(self) -> Optional[Dict]:
+        """缓存的 nav 接口用户信息，未验证或未登录时为 None"""
+        with self._lock:
+            return self._user_info
+
+    @property
+    def validated(self) -> bool:
+        """是否已有验证结果"""
+        with self._lock:
+            return self._validated_at is not None
+
+    def cookie_header(self) -> str:
+        """已登录时返回 ``Cookie`` 请求头的值，否则返回空字符串"""
+        with self._lock:
+            cookies = self._load_cookies() if self._logged_in or self._validated_at is None else {}
+            return '; '.join(f'{key}={value}' for key, value in cookies.items())
+
+    def headers(self) -> Dict[str, str]:
+        """带 Cookie 的B站接口请求头"""
+        with self._lock:
+            cookies = dict(self._load_cookies())
+        return self._client(cookies).headers
+
+    def ensure_valid(self) -> bool:
+        """缓存过期时请求 nav 接口重新验证，返回是否已登录；会阻塞，不要在界面线程中调用
+
+        请求期间不持有锁，界面线程读取缓存状态不受影响。
+        """
+        with self._lock:
+            if self._is_fresh():
+                return self._logged_in
+            cookies = dict(self._load_cookies())
+            generation = self._generation
+
+        try:
+            user_info = self._client(cookies).fetch_user_info() if cookies else None
+        except requests.RequestException as e:
+            print(f"验证登录状态失败: {e}")
+            with self._lock:
+                return self._logged_in if self._validated_at is not None else bool(self._load_cookies())
+
+        with self._lock:
+            if generation != self._generation:
+                # 验证期间登录或退出登录，结果已不对应当前 Cookie
+                return self._logged_in if self._validated_at is not None else bool(self._load_cookies())
+            self._set_result(user_info)
+            logged_in = self._logged_in
+
+        self.changed.emit()
+        return logged_in
+
+    def refresh(self):
+        """缓存过期时在后台线程中重新验证"""
+        with self._lock:
+            if self._refreshing or self._is_fresh():
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='LoginStateRefresh', daemon=True).start()
+
+    def invalidate(self):
+        """登录或退出登录后重新读取 Cookie 并在后台验证"""
+        with self._lock:
+            self._generation += 1
+            self._cookies = None
+            self._user_info = None
+            self._validated_at = None
+        self.changed.emit()
+        self.refresh()
+
+    def report_auth_error(self):
+        """接口返回未登录时调用，Cookie 已失效"""
+        with self._lock:
+            if self._validated_at is not None and not self._logged_in:
+                return
+            self._generation += 1
+            self._set_result(None)
+        self.changed.emit()
+
+    def logout(self):
+        """删除保存的 Cookie"""
+        if os.path.exists(LOGIN_FILE_PATH):
+            os.remove(LOGIN_FILE_PATH)
+        self.invalidate()
+
+    def _refresh(self):
+        try:
+            self.ensure_valid()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _is_fresh(self) -> bool:
+        return self._validated_at is not None and time.monotonic() - self._validated_at < self.TTL
+
+    def _set_result(self, user_info: Optional[Dict]):
+        self._logged_in = bool(user_info and user_info.get('isLogin'))
+        self._user_info = user_info if self._logged_in else None
+        self._validated_at = time.monotonic()
+
+    def _load_cookies(self) -> Dict[str, str]:
+        if self._cookies is None:
+            client = BilibiliLogin()
+            self._cookies = dict(client.cookies) if client.load_cookies() else {}
+        return self._cookies
+
+    @staticmethod
+    def _client(cookies: Dict[str, str]) -> BilibiliLogin:
+        """带有给定 Cookie 的 :class:`BilibiliLogin`，不读取磁盘"""
+        client = BilibiliLogin()
+        client.cookies = dict(cookies)
+        if client.cookies:
+            client._update_headers()
+        return client
+
+
+loginState = LoginState()
@@ -0,0 +1,65 @@
+# coding:utf-8
+"""
+媒体处理任务模块
+在后处理线程池中执行的函数，启动 FFmpeg 子进程并等待其完成
+"""
+
+import subprocess
+
+# Windows 下调用命令行程序时不弹出控制台窗口
+CREATE_NO_WINDOW = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+
+
+def ffmpeg_merge(ffmpeg_path: str, video_path: str, audio_path: str, output_path: str):
+    """使用FFmpeg合并视频和音频"""
+    cmd = [
+        ffmpeg_path,
+        '-i', video_path,
+        '-i', audio_path,
+        '-c', 'copy',
+        '-y',  # 覆盖输出文件
+        output_path
+    ]
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=CREATE_NO_WINDOW)
+    stdout, stderr = process.communicate()
+
+    if process.returncode != 0:
+        raise RuntimeError(f"视频合并失败: {stderr.decode('utf-8', errors='ignore')}")
+
+
+# 目标格式: (编码器, 扩展名)
+AUDIO_FORMATS = {
+    'mp3': ('libmp3lame', '.mp3'),
+    'aac': ('aac', '.m4a'),
+    'opus': ('libopus', '.opus'),
+    'flac': ('flac', '.flac'),
+}
+
+
+def audio_transcode_command(ffmpeg_path: str, input_path: str, output_path: str, fmt: str, bitrate: int) -> list:
+    """生成音频转码命令，``input_path`` 为 ``pipe:0`` 时从标准输入读取；FLAC 为无损格式，忽略码率"""
+    codec, _ = AUDIO_FORMATS[fmt]
+    cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'error']
+    if input_path != 'pipe:0':
+        cmd.append('-nostdin')  # 读取文件时不占用标准输入
+    cmd += [
+        '-i', input_path,
+        '-vn',  # 丢弃封面等视频流
+        '-map_metadata', '0',
+        '-c:a', codec
+    ]
+    if fmt != 'flac':
+        cmd += ['-b:a', f'{bitrate}k']
+    cmd += ['-y', output_path]
+    return cmd
+
+
+def ffmpeg_transcode_audio(ffmpeg_path: str, input_path: str, output_path: str, fmt: str, bitrate: int):
+    """使用FFmpeg把完整的音频文件转换为指定格式"""
+    cmd = audio_transcode_command(ffmpeg_path, input_path, output_path, fmt, bitrate)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=CREATE_NO_WINDOW)
+    stdout, stderr = process.communicate()
+
+    if process.returncode != 0:
+        raise RuntimeError(f"音频转码失败: {stderr.decode('utf-8', errors='ignore')}")
@@ -0,0 +1,453 @@
+# coding:utf-8
+"""
+MP4 封装模块
+把 B站 DASH 的视频、音频两路分片 MP4（fMP4）在盒子层面合并为一个 MP4，不转码、不依赖 FFmpeg
+"""
+
+import struct
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+# 分片之间可以直接丢弃的顶层盒子，sidx 只描述单轨道的字节偏移，合并后失效
+SKIPPED_BOXES = (b'sidx', b'styp', b'emsg', b'free', b'skip', b'prft', b'mfra')
+
+# moov 之前允许出现并跳过的盒子
+INIT_SKIPPED_BOXES = SKIPPED_BOXES + (b'uuid', b'pdin', b'meta', b'wide')
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class Mp4RemuxError(Exception):
+    """输入不是可合并的分片 MP4"""
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', 8 + len(payload)) + box_type + payload
+
+
+def _full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return _box(box_type, struct.pack('>I', (version << 24) | flags) + payload)
+
+
+def _iter_boxes(data, start: int = 0, end: Optional[int] = None):
+    """遍历内存中的盒子，返回 (类型, 盒子起点, 内容起点, 盒子终点)"""
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, position)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, position + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size or position + size > end:
+            raise Mp4RemuxError(f"盒子 {box_type!r} 长度无效")
+        yield box_type, position, position + header_size, position + size
+        position += size
+
+
+def _find_box(data, path: Tuple[bytes, ...], start: int = 0, end: Optional[int] = None):
+    """按路径查找第一个子盒子，返回 (盒子起点, 内容起点, 盒子终点)"""
+    for box_type, box_start, payload_start, box_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return box_start, payload_start, box_end
+            return _find_box(data, path[1:], payload_start, box_end)
+    return None
+
+
+@dataclass
+class TrackInfo:
+    """源文件中唯一轨道的信息"""
+
+    trak: bytearray
+    trex: bytearray
+    track_id: int
+    timescale: int
+    handler: bytes
+    default_sample_duration: int = 0
+
+
+@dataclass
+class Fragment:
+    """一个 moof + mdat 分片，mdat 内容留在源文件中按需复制"""
+
+    moof: bytearray
+    moof_position: int           # moof 在源文件中的偏移
+    mdat_header: bytes
+    payload_size: int
+    decode_time: int             # 轨道时间刻度下的解码时间
+    duration: int = 0
+
+
+class FragmentedTrackReader:
+    """按顺序读取单轨道分片 MP4
+
+    只需要顺序的 ``read``，mdat 内容不进入内存，可以直接接在正在写入的文件后面读取。
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.position = 0
+        self.ftyp = b''
+        self.moov = bytearray()
+        self.track: Optional[TrackInfo] = None
+        self._next_time = 0
+        self._buffer = bytearray(COPY_BUFFER_SIZE)
+
+    def _read_exact(self, size: int) -> bytes:
+        data = self.stream.read(size)
+        while len(data) < size:
+            more = self.stream.read(size - len(data))
+            if not more:
+                raise Mp4RemuxError("文件意外结束")
+            data += more
+        self.position += size
+        return data
+
+    def _read_header(self) -> Optional[Tuple[bytes, bytes, int]]:
+        """读取下一个盒子头，返回 (类型, 头部字节, 内容长度)，文件结束时返回 None"""
+        header = self.stream.read(8)
+        if not header:
+            return None
+        self.position += len(header)
+        if len(header) < 8:
+            header += self._read_exact(8 - len(header))
+
+        size, box_type = struct.unpack('>I4s', header)
+        if size == 1:
+            large = self._read_exact(8)
+            header += large
+            size = struct.unpack('>Q', large)[0]
+        elif size == 0:
+            raise Mp4RemuxError(f"不支持长度未知的盒子 {box_type!r}")
+
+        if size < len(header):
+            raise Mp4RemuxError(f"盒子 {box_type!r} 长度无效")
+        return box_type, header, size - len(header)
+
+    def _skip(self, size: int):
+        while size > 0:
+            size -= len(self._read_exact(min(size, COPY_BUFFER_SIZE)))
+
+    def read_init(self):
+        """读取 ftyp 和 moov，停在第一个分片之前"""
+        while not self.moov:
+            box = self._read_header()
+            if box is None:
+                raise Mp4RemuxError("未找到 moov")
+            box_type, header, size = box
+
+            if box_type == b'ftyp':
+                self.ftyp = header + self._read_exact(size)
+            elif box_type == b'moov':
+                self.moov = bytearray(header + self._read_exact(size))
+            elif box_type in (b'moof', b'mdat'):
+                raise Mp4RemuxError("moov 位于媒体数据之后")
+            elif box_type in INIT_SKIPPED_BOXES:
+                self._skip(size)
+            else:
+                # 尽早识别非 MP4 输入（如 FLV），不必等待读完整个文件
+                raise Mp4RemuxError(f"不是 MP4 文件（{box_type!r}）")
+
+        self.track = self._parse_track()
+
+    def _parse_track(self) -> TrackInfo:
+        moov = self.moov
+        traks = [(start, end) for box_type, start, _, end in _iter_boxes(moov, 8) if box_type == b'trak']
+        if len(traks) != 1:
+            raise Mp4RemuxError("只支持单轨道的分片 MP4")
+        trak = bytearray(moov[traks[0][0]:traks[0][1]])
+
+        if _find_box(moov, (b'mvex',), 8) is None:
+            raise Mp4RemuxError("不是分片 MP4")
+        trex_box = _find_box(moov, (b'mvex', b'trex'), 8)
+        if trex_box is None:
+            raise Mp4RemuxError("缺少 trex")
+        trex = bytearray(moov[trex_box[0]:trex_box[2]])
+
+        tkhd = _find_box(trak, (b'trak', b'tkhd'))
+        mdhd = _find_box(trak, (b'trak', b'mdia', b'mdhd'))
+        hdlr = _find_box(trak, (b'trak', b'mdia', b'hdlr'))
+        if not (tkhd and mdhd and hdlr):
+            raise Mp4RemuxError("轨道信息不完整")
+
+        version = trak[tkhd[1]]
+        track_id = struct.unpack_from('>I', trak, tkhd[1] + (20 if version == 1 else 12))[0]
+        version = trak[mdhd[1]]
+        timescale = struct.unpack_from('>I', trak, mdhd[1] + (20 if version == 1 else 12))[0]
+        handler = bytes(trak[hdlr[1] + 8:hdlr[1] + 12])
+        default_duration = struct.unpack_from('>I', trex, 20)[0]
+        return TrackInfo(trak, trex, track_id, timescale, handler, default_duration)
+
+    def next_fragment(self) -> Optional[Fragment]:
+        """读取下一个分片的 moof 和 mdat 头，调用方必须随后调用 :meth:`copy_payload`"""
+        while True:
+            box = self._read_header()
+            if box is None:
+                return None
+            box_type, header, size = box
+
+            if box_type == b'moof':
+                moof_position = self.position - len(header)
+                moof = bytearray(header + self._read_exact(size))
+                break
+            if box_type in SKIPPED_BOXES:
+                self._skip(size)
+                continue
+            raise Mp4RemuxError(f"意外的盒子 {box_type!r}")
+
+        # moof 后必须紧跟对应的 mdat，trun 中的数据偏移以此为前提
+        box = self._read_header()
+        if box is None:
+            raise Mp4RemuxError("moof 之后缺少 mdat")
+        box_type, mdat_header, payload_size = box
+        if box_type != b'mdat':
+            raise Mp4RemuxError(f"moof 之后应为 mdat，实际为 {box_type!r}")
+
+        decode_time, duration = self._parse_timing(moof)
+        if decode_time is None:
+            decode_time = self._next_time
+        self._next_time = decode_time + duration
+        return Fragment(moof, moof_position, mdat_header, payload_size, decode_time, duration)
+
+    def _parse_timing(self, moof: bytearray) -> Tuple[Optional[int], int]:
+        """从 tfdt 和 trun 中计算分片的起始解码时间和时长"""
+        traf = _find_box(moof, (b'moof', b'traf'))
+        if traf is None:
+            raise Mp4RemuxError("moof 中缺少 traf")
+
+        decode_time = None
+        default_duration = self.track.default_sample_duration
+        duration = 0
+        for box_type, _, payload, _ in _iter_boxes(moof, traf[1], traf[2]):
+            version, flags = moof[payload], struct.unpack_from('>I', moof, payload)[0] & 0xFFFFFF
+
+            if box_type == b'tfhd':
+                offset = payload + 8
+                offset += 8 if flags & 0x1 else 0
+                offset += 4 if flags & 0x2 else 0
+                if flags & 0x8:
+                    default_duration = struct.unpack_from('>I', moof, offset)[0]
+            elif box_type == b'tfdt':
+                decode_time = struct.unpack_from('>Q' if version == 1 else '>I', moof, payload + 4)[0]
+            elif box_type == b'trun':
+                sample_count = struct.unpack_from('>I', moof, payload + 4)[0]
+                if not flags & 0x100:
+                    duration += sample_count * default_duration
+                    continue
+
+                offset = payload + 8
+                offset += 4 if flags & 0x1 else 0
+                offset += 4 if flags & 0x4 else 0
+                sample_size = 4 * sum(1 for bit in (0x100, 0x200, 0x400, 0x800) if flags & bit)
+                for _ in range(sample_count):
+                    duration += struct.unpack_from('>I', moof, offset)[0]
+                    offset += sample_size
+        return decode_time, duration
+
+    def copy_payload(self, fragment: Fragment, output: BinaryIO):
+        """把分片的 mdat 内容复制到输出，使用固定大小的缓冲区"""
+        view = memoryview(self._buffer)
+        remaining = fragment.payload_size
+        readinto = getattr(self.stream, 'readinto', None)
+        while remaining > 0:
+            size = min(remaining, len(view))
+            if readinto:
+                count = readinto(view[:size])
+                if not count:
+                    raise Mp4RemuxError("文件意外结束")
+                output.write(view[:count])
+            else:
+                data = self.stream.read(size)
+                if not data:
+                    raise Mp4RemuxError("文件意外结束")
+                count = len(data)
+                output.write(data)
+            remaining -= count
+            self.position += count
+
+
+@dataclass
+class _OutputTrack:
+    reader: FragmentedTrackReader
+    track_id: int
+    end_time: int = 0
+    tkhd_duration_offset: int = 0
+    tkhd_duration_size: int = 4
+    mdhd_duration_offset: int = 0
+    mdhd_duration_size: int = 4
+    random_access: List[Tuple[int, int]] = field(default_factory=list)  # (解码时间, moof 偏移)
+
+
+class FragmentedMp4Muxer:
+    """把多个单轨道分片 MP4 合并为一个分片 MP4
+
+    输出结构为 ``ftyp``、合并后的 ``moov``（每个源轨道一个 ``trak``，轨道 ID 重新编号）、
+    按解码时间交错的 ``moof``/``mdat`` 分片，最后附带 ``mfra`` 随机访问索引以便播放器快速拖动。
+    分片内容逐块复制，内存占用与文件大小无关。输出可定位时，结束后回填总时长。
+    """
+
+    def __init__(self, streams: List[BinaryIO], output: BinaryIO):
+        self.readers = [FragmentedTrackReader(stream) for stream in streams]
+        self.output = output
+        self.position = 0
+        self.tracks: List[_OutputTrack] = []
+        self.movie_timescale = 1000
+        self._mvhd_duration = (0, 4)
+        self._mehd_duration_offset = 0
+        self._sequence = 1
+
+    def mux(self):
+        """执行合并"""
+        for reader in self.readers:
+            reader.read_init()
+
+        # 视频轨道排在前面
+        readers = sorted(self.readers, key=lambda reader: reader.track.handler != b'vide')
+        self.tracks = [_OutputTrack(reader, index + 1) for index, reader in enumerate(readers)]
+        self._write_init()
+
+        heads: Dict[int, Optional[Fragment]] = {
+            index: track.reader.next_fragment() for index, track in enumerate(self.tracks)
+        }
+        while any(heads.values()):
+            # 取解码时间（换算为秒）最早的分片，使音视频在文件中交错排列
+            index = min(
+                (index for index, fragment in heads.items() if fragment),
+                key=lambda index: heads[index].decode_time / self.tracks[index].reader.track.timescale
+            )
+            self._write_fragment(self.tracks[index], heads[index])
+            heads[index] = self.tracks[index].reader.next_fragment()
+
+        self._write(self._build_mfra())
+        self._patch_durations()
+
+    def _write(self, data):
+        self.output.write(data)
+        self.position += len(data)
+
+    def _write_init(self):
+        first = self.tracks[0].reader
+        self._write(first.ftyp or _box(b'ftyp', b'isom\x00\x00\x02\x00isomiso2avc1mp41'))
+
+        moov = first.moov
+        mvhd = _find_box(moov, (b'mvhd',), 8)
+        if mvhd is None:
+            raise Mp4RemuxError("缺少 mvhd")
+        mvhd = bytearray(moov[mvhd[0]:mvhd[2]])
+        version = mvhd[8]
+        self.movie_timescale = struct.unpack_from('>I', mvhd, 8 + (20 if version == 1 else 12))[0] or 1000
+        struct.pack_into('>I', mvhd, len(mvhd) - 4, len(self.tracks) + 1)  # next_track_ID
+
+        moov_start = self.position
+        children = bytearray(mvhd)
+        mvhd_duration_offset = 8 + (24 if version == 1 else 16)
+        self._mvhd_duration = (moov_start + 8 + mvhd_duration_offset, 8 if version == 1 else 4)
+
+        for track in self.tracks:
+            trak_offset = moov_start + 8 + len(children)
+            children += self._rewrite_trak(track, trak_offset)
+
+        # mvex：mehd 记录总时长，每个轨道一个 trex
+        mvex_offset = moov_start + 8 + len(children)
+        mehd = _full_box(b'mehd', 1, 0, struct.pack('>Q', 0))
+        self._mehd_duration_offset = mvex_offset + 8 + 12
+        trex_boxes = b''
+        for track in self.tracks:
+            trex = bytearray(track.reader.track.trex)
+            struct.pack_into('>I', trex, 12, track.track_id)
+            trex_boxes += trex
+        children += _box(b'mvex', mehd + trex_boxes)
+
+        # 保留视频源的其他 moov 子盒子（如 udta）
+        for box_type, start, _, end in _iter_boxes(moov, 8):
+            if box_type not in (b'mvhd', b'trak', b'mvex'):
+                children += moov[start:end]
+
+        self._write(_box(b'moov', bytes(children)))
+
+    def _rewrite_trak(self, track: _OutputTrack, trak_offset: int) -> bytearray:
+        """重写轨道 ID，并记录时长字段在输出中的位置"""
+        trak = bytearray(track.reader.track.trak)
+        tkhd = _find_box(trak, (b'trak', b'tkhd'))
+        version = trak[tkhd[1]]
+        struct.pack_into('>I', trak, tkhd[1] + (20 if version == 1 else 12), track.track_id)
+        track.tkhd_duration_offset = trak_offset + tkhd[1] + (28 if version == 1 else 20)
+        track.tkhd_duration_size = 8 if version == 1 else 4
+
+        mdhd = _find_box(trak, (b'trak', b'mdia', b'mdhd'))
+        version = trak[mdhd[1]]
+        track.mdhd_duration_offset = trak_offset + mdhd[1] + (24 if version == 1 else 16)
+        track.mdhd_duration_size = 8 if version == 1 else 4
+        return trak
+
+    def _write_fragment(self, track: _OutputTrack, fragment: Fragment):
+        """重写 moof 中的序号、轨道 ID 和绝对偏移后写出分片"""
+        moof = fragment.moof
+        moof_offset = self.position
+
+        mfhd = _find_box(moof, (b'moof', b'mfhd'))
+        if mfhd:
+            struct.pack_into('>I', moof, mfhd[1] + 4, self._sequence)
+        self._sequence += 1
+
+        for box_type, start, payload, end in _iter_boxes(moof, 8):
+            if box_type != b'traf':
+                continue
+            tfhd = _find_box(moof, (b'tfhd',), payload, end)
+            if tfhd is None:
+                raise Mp4RemuxError("traf 中缺少 tfhd")
+            flags = struct.unpack_from('>I', moof, tfhd[1])[0] & 0xFFFFFF
+            struct.pack_into('>I', moof, tfhd[1] + 4, track.track_id)
+
+            # 显式的 base_data_offset 是源文件中的绝对偏移，按 moof 的新位置平移
+            if flags & 0x1:
+                base = struct.unpack_from('>Q', moof, tfhd[1] + 8)[0]
+                struct.pack_into('>Q', moof, tfhd[1] + 8, base - fragment.moof_position + moof_offset)
+
+        track.random_access.append((fragment.decode_time, moof_offset))
+        track.end_time = max(track.end_time, fragment.decode_time + fragment.duration)
+
+        self._write(moof)
+        self._write(fragment.mdat_header)
+        track.reader.copy_payload(fragment, self.output)
+        self.position += fragment.payload_size
+
+    def _build_mfra(self) -> bytes:
+        """为每个轨道生成 tfra，分片起点即随机访问点"""
+        tfras = b''
+        for track in self.tracks:
+            entries = b''.join(
+                struct.pack('>QQBBB', decode_time, offset, 1, 1, 1)
+                for decode_time, offset in track.random_access
+            )
+            tfras += _full_box(
+                b'tfra', 1, 0,
+                struct.pack('>III', track.track_id, 0, len(track.random_access)) + entries
+            )
+        size = 8 + len(tfras) + 16
+        return _box(b'mfra', tfras + _full_box(b'mfro', 0, 0, struct.pack('>I', size)))
+
+    def _patch_durations(self):
+        """回填 mvhd、mehd、tkhd、mdhd 中的时长，输出不可定位时跳过"""
+        if not (hasattr(self.output, 'seekable') and self.output.seekable()):
+            return
+
+        movie_duration = 0
+        patches = []
+        for track in self.tracks:
+            timescale = track.reader.track.timescale or 1
+            duration = track.end_time * self.movie_timescale // timescale
+            movie_duration = max(movie_duration, duration)
+            patches.append((track.tkhd_duration_offset, track.tkhd_duration_size, duration))
+            patches.append((track.mdhd_duration_offset, track.mdhd_duration_size, track.end_time))
+        patches.append((self._mvhd_duration[0], self._mvhd_duration[1], movie_duration))
+        patches.append((self._mehd_duration_offset, 8, movie_duration))
+
+        end = self.output.tell()
+        for offset, size, value in patches:
+            self.output.seek(offset)
+            self.output.write(struct.pack('>Q' if size == 8 else '>I', min(value, (1 << (size * 8)) - 1)))
+        self.output.seek(end)
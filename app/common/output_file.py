@@ -0,0 +1,85 @@
+# coding:utf-8
+"""
+下载输出文件模块
+分段下载时各连接按偏移写入互不重叠的区间，不共享文件位置也不加锁；能映射时直接把数据接收到映射的内存中
+"""
+
+import mmap
+from typing import Callable, Dict, Optional
+
+from .disk_writer import diskWriters
+
+
+class MmapOutputFile:
+    """内存映射的输出文件
+
+    文件需已用 ``posix_fallocate`` 等方式真正分配磁盘块：稀疏文件在磁盘写满时，
+    写入映射会触发 ``SIGBUS`` 直接终止进程。:meth:`view` 返回映射中的切片，接收缓冲区可以直接
+    读入这里，数据进入页缓存后只复制一次，由内核在后台回写；:meth:`sync` 调用 ``msync``
+    把已接收的数据刷到磁盘，保存续传清单前调用。每个切片在对应分段结束时用 :meth:`release` 归还。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._views: Dict[int, memoryview] = {}  # 尚未归还的切片，关闭映射前全部释放
+        self._file = open(path, 'r+b')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        except BaseException:
+            self._file.close()
+            raise
+
+    def view(self, start: int, end: int) -> Optional[memoryview]:
+        """闭区间 [start, end] 对应的可写切片，用完后调用 :meth:`release`"""
+        view = memoryview(self._map)[start:end + 1]
+        self._views[id(view)] = view
+        return view
+
+    def release(self, view: memoryview):
+        """归还 :meth:`view` 返回的切片"""
+        self._views.pop(id(view), None)
+        view.release()
+
+    def write_at(self, offset: int, data, callback: Optional[Callable] = None):
+        """写入数据并立即回调；``data`` 本身就是映射中的切片时无需复制"""
+        if not (isinstance(data, memoryview) and data.obj is self._map):
+            self._map[offset:offset + len(data)] = data
+        if callback:
+            callback(data)
+
+    def sync(self):
+        self._map.flush()
+
+    def close(self):
+        """释放未归还的切片后关闭映射和文件；仍有派生切片未释放时抛出 :class:`BufferError`，映射保持打开"""
+        if self._map is None:
+            return
+        self._map.flush()
+        for view in self._views.values():
+            view.release()
+        self._views.clear()
+        self._map.close()
+        self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_output(path: str, size: int, allocated: bool):
+    """打开已预分配的输出文件
+
+    ``allocated`` 为磁盘块是否已真正分配（见 :func:`~.disk_space.preallocate`），
+    只有这时才使用 :class:`MmapOutputFile`；稀疏文件或无法映射（空文件、32 位进程映射大文件等）时
+    使用经设备写线程 ``pwrite`` 的 :class:`~.disk_writer.WriteBehindFile`，磁盘写满时只会得到写入错误。
+    两者都提供 ``view``/``release``/``write_at``/``sync``/``close``。
+    """
+    if allocated and size > 0:
+        try:
+            return MmapOutputFile(path)
+        except (OSError, ValueError, OverflowError):
+            pass
+    return diskWriters.open(path)
@@ -0,0 +1,213 @@
+# coding:utf-8
+"""
+解析结果缓存模块
+按规范化的视频 ID 缓存解析结果，内存中保留最近使用的条目，磁盘上持久化到配置目录；
+视频信息长期有效，带签名的播放地址按其 deadline 参数过期
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from .config import CONFIG_DIR
+from .login_state import loginState
+
+PARSE_CACHE_DIR = CONFIG_DIR / "parse_cache"
+
+# 从链接中提取视频 ID 的规则，依次尝试
+VIDEO_ID_PATTERNS = (
+    ('bilibili', re.compile(r'\b(BV[0-9A-Za-z]{10})')),
+    ('bilibili', re.compile(r'(?<![0-9A-Za-z])av(\d+)', re.IGNORECASE)),
+    ('douyin', re.compile(r'douyin\.com/(?:video|note)/(\d+)')),
+    ('douyin', re.compile(r'douyin\.com/share/(?:video|note)/(\d+)')),
+    ('douyin', re.compile(r'[?&](?:modal_id|aweme_id|vid)=(\d+)')),
+)
+# 播放地址中表示过期时间（Unix 时间戳）的查询参数
+DEADLINE_PARAMS = ('deadline', 'x-expires', 'expires')
+
+
+def canonical_key(url: str) -> Optional[str]:
+    """返回链接对应的缓存键，例如 ``bilibili:BV1xx411c7mD:guest``，无法确定视频 ID（如未展开的短链接）时返回 None
+
+    B站登录与否得到的播放信息不同，键中区分两种状态；第 2 个及以后的分P各自缓存。
+    """
+    for platform, pattern in VIDEO_ID_PATTERNS:
+        match = pattern.search(url)
+        if not match:
+            continue
+        video_id = match.group(1)
+        if platform == 'bilibili':
+            if not video_id.startswith('BV'):
+                video_id = f'av{video_id}'
+            # 多P视频的各分P播放地址不同
+            page = re.search(r'[?&]p=(\d+)', url)
+            if page and int(page.group(1)) > 1:
+                video_id += f':p{int(page.group(1))}'
+            variant = 'login' if loginState.is_logged_in else 'guest'
+            return f'bilibili:{video_id}:{variant}'
+        return f'{platform}:{video_id}'
+    return None
+
+
+def stream_deadline(data: Any) -> Optional[float]:
+    """遍历解析结果中的所有链接，返回最早的过期时间，没有带过期参数的链接时返回 None"""
+    deadline = None
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, str) and value.startswith('http') and '?' in value:
+            query = parse_qs(urlparse(value).query)
+            for name in DEADLINE_PARAMS:
+                try:
+                    expires = float(query[name][0])
+                except (KeyError, ValueError):
+                    continue
+                deadline = expires if deadline is None else min(deadline, expires)
+    return deadline
+
+
+def has_streams(data: Dict[str, Any]) -> bool:
+    """解析结果是否包含可下载的播放信息，B站获取播放地址失败时只有视频信息"""
+    if data.get('platform') == 'B站':
+        play_info = data.get('play_info') or {}
+        return bool(play_info.get('dash') or play_info.get('durl'))
+    return True
+
+
+class ParseCache:
+    """两级解析结果缓存
+
+    内存中按 LRU 保留最近 :attr:`MEMORY_SIZE` 条，磁盘上每条一个 JSON 文件，超过
+    :attr:`DISK_SIZE` 条时删除最久未写入的。每条记录分别记录视频信息和播放地址的过期时间：
+    :meth:`get` 要求两者都有效；:meth:`get_metadata` 只要求视频信息有效，
+    调用方可以只重新获取播放地址。
+    """
+
+    MEMORY_SIZE = 64
+    DISK_SIZE = 500
+    METADATA_TTL = 7 * 24 * 3600    # 标题、封面等视频信息的有效期
+    STREAM_TTL = 30 * 60            # 播放地址没有 deadline 参数时的有效期
+    DEADLINE_MARGIN = 5 * 60        # 播放地址在过期前这么久就视为失效，留出下载开始的时间
+
+    def __init__(self, directory=PARSE_CACHE_DIR):
+        self.directory = str(directory)
+        self._memory: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """返回视频信息和播放地址都有效的解析结果"""
+        entry = self._entry(key)
+        if entry is None or time.time() >= entry['streams_expire']:
+            return None
+        return entry['data']
+
+    def get_metadata(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """返回视频信息有效的解析结果，其中的播放地址可能已经过期"""
+        entry = self._entry(key)
+        return entry['data'] if entry is not None else None
+
+    def put(self, key: Optional[str], data: Dict[str, Any]):
+        """缓存解析结果，没有播放信息的结果不缓存，下次解析时重新获取"""
+        if not key or not has_streams(data):
+            return
+        now = time.time()
+        deadline = stream_deadline(data)
+        entry = {
+            'key': key,
+            'data': json.loads(json.dumps(data)),
+            'metadata_expire': now + self.METADATA_TTL,
+            'streams_expire': (now + self.STREAM_TTL if deadline is None
+                               else deadline - self.DEADLINE_MARGIN)
+        }
+        with self._lock:
+            self._remember(key, entry)
+        self._save(entry)
+
+    def remove(self, key: Optional[str]):
+        """删除缓存，例如缓存的播放地址已无法下载时"""
+        if not key:
+            return
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _entry(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not key:
+            return None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is None:
+                return None
+            with self._lock:
+                self._remember(key, entry)
+
+        if time.time() >= entry['metadata_expire']:
+            self.remove(key)
+            return None
+        # 返回副本，调用方修改解析结果不影响缓存
+        return dict(entry, data=json.loads(json.dumps(entry['data'])))
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.MEMORY_SIZE:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.md5(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            if entry.get('key') != key:
+                return None
+            entry['metadata_expire'] = float(entry['metadata_expire'])
+            entry['streams_expire'] = float(entry['streams_expire'])
+            return entry
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save(self, entry: Dict[str, Any]):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(entry['key'])
+            temp_path = path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+            self._prune()
+        except (OSError, TypeError, ValueError) as e:
+            print(f"保存解析缓存失败: {e}")
+
+    def _prune(self):
+        """条目过多时删除最久未写入的"""
+        names = [name for name in os.listdir(self.directory) if name.endswith('.json')]
+        if len(names) <= self.DISK_SIZE:
+            return
+        paths = sorted((os.path.join(self.directory, name) for name in names), key=os.path.getmtime)
+        for path in paths[:len(paths) - self.DISK_SIZE]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+parseCache = ParseCache()
@@ -0,0 +1,84 @@
+# coding:utf-8
+"""
+后处理模块
+合并、转码等后处理交给 FFmpeg 子进程完成，在独立的线程池中等待，与下载队列的并发名额分开计算
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .config import config
+from .transfer_engine import transferEngine
+
+
+class PostProcessPool:
+    """后处理线程池
+
+    任务在下载结束、释放下载名额之后提交到这里，按提交顺序排队，同时运行的数量由设置中的
+    ``MaxJobs`` 控制，修改后立即生效。作业只是启动 FFmpeg 并等待其退出，用线程即可，
+    不需要另起 Python 进程；线程数取 ``MaxJobs`` 的上限，实际并发由排队控制。
+    只能在传输引擎的事件循环中 ``await`` :meth:`run`。
+    """
+
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._running = 0
+        self._waiters = deque()
+        config.maxPostProcessJobs.valueChanged.connect(self._requestDispatch)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=config.maxPostProcessJobs.validator.max, thread_name_prefix='PostProcess')
+        return self._executor
+
+    async def run(self, func: Callable, *args) -> Any:
+        """排队并在后处理线程中执行 ``func(*args)``"""
+        await self._acquire()
+        try:
+            return await asyncio.wrap_future(self.executor.submit(func, *args))
+        finally:
+            self._running -= 1
+            self._dispatch()
+
+    async def _acquire(self):
+        if not self._waiters and self._running < config.get(config.maxPostProcessJobs):
+            self._running += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # 已被放行但随即取消时归还名额
+            if waiter.done() and not waiter.cancelled():
+                self._running -= 1
+                self._dispatch()
+            raise
+
+    def _requestDispatch(self):
+        """并发上限修改后立即尝试调度"""
+        transferEngine.loop.call_soon_threadsafe(self._dispatch)
+
+    def _dispatch(self):
+        """按顺序放行等待中的任务，只在引擎事件循环中调用"""
+        while self._waiters and self._running < config.get(config.maxPostProcessJobs):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self._running += 1
+            waiter.set_result(None)
+
+    def shutdown(self):
+        """取消尚未开始的作业"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+postProcessPool = PostProcessPool()
@@ -0,0 +1,107 @@
+# coding:utf-8
+"""
+下载进度模块
+把下载线程中高频的字节回调合并为固定频率的进度记录，并计算瞬时速度、平滑速度与剩余时间
+"""
+
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+@dataclass
+class DownloadProgress:
+    """一次进度上报"""
+
+    downloaded: int = 0       # 已下载字节数
+    total: int = 0            # 总字节数，未知时为 0
+    speed: float = 0.0        # 瞬时速度（字节/秒）
+    smoothed_speed: float = 0.0  # 指数平滑后的速度（字节/秒）
+    eta: Optional[float] = None  # 预计剩余秒数，无法估计时为 None
+
+    @property
+    def percent(self) -> int:
+        if self.total <= 0:
+            return 0
+        return min(100, int(self.downloaded * 100 / self.total))
+
+
+def format_size(size: float) -> str:
+    """格式化字节数"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.2f}GB"
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    """格式化剩余时间"""
+    if seconds is None:
+        return '--:--'
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+class ProgressReporter:
+    """进度合并器
+
+    下载线程可以任意频繁地调用 :meth:`update`，只有距上次上报超过 ``interval`` 秒且字节数
+    有变化时才会回调一次，避免跨线程信号淹没界面线程。线程安全，多个分段可同时调用。
+    """
+
+    DEFAULT_INTERVAL = 0.1  # 10Hz
+    SMOOTHING_TIME = 3.0    # 平滑速度的时间常数（秒）
+
+    def __init__(self, callback: Callable[[DownloadProgress], None], interval: float = DEFAULT_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_time = None
+        self._last_downloaded = 0
+        self._smoothed_speed = 0.0
+
+    def update(self, downloaded: int, total: int, force: bool = False):
+        """记录最新的字节数，到达上报周期时回调"""
+        with self._lock:
+            now = time.monotonic()
+
+            # 第一次调用只作为测速基准，续传时已有的字节不计入速度
+            if self._last_time is None:
+                self._last_time = now
+                self._last_downloaded = downloaded
+                record = DownloadProgress(downloaded, total)
+            else:
+                elapsed = now - self._last_time
+                if downloaded == self._last_downloaded and not force:
+                    return
+                if elapsed < self.interval and not force:
+                    return
+
+                speed = max(0, downloaded - self._last_downloaded) / elapsed if elapsed > 0 else 0.0
+                if self._smoothed_speed == 0:
+                    self._smoothed_speed = speed
+                else:
+                    alpha = 1 - math.exp(-elapsed / self.SMOOTHING_TIME)
+                    self._smoothed_speed += alpha * (speed - self._smoothed_speed)
+
+                eta = None
+                if total > 0 and self._smoothed_speed > 0:
+                    eta = max(0, total - downloaded) / self._smoothed_speed
+
+                self._last_time = now
+                self._last_downloaded = downloaded
+                record = DownloadProgress(downloaded, total, speed, self._smoothed_speed, eta)
+
+            # 在锁内回调，保证多个分段线程上报的记录按时间顺序送达
+            self.callback(record)
+
+    def finish(self, total: int):
+        """下载完成，强制上报一次 100%"""
+        self.update(total, total, force=True)
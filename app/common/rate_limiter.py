@@ -0,0 +1,141 @@
+# coding:utf-8
+"""
+下载限速模块
+令牌桶限速器，全局限速读取设置中的速度上限与时段，单个任务也可以另设上限
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from .config import config
+
+
+class TokenBucket:
+    """令牌桶
+
+    ``rate`` 为每秒补充的字节数，0 表示不限速。桶容量约为 :attr:`BURST_TIME` 秒的流量，
+    一次消费超过桶内余量时允许透支，调用方按欠额等待，因此大批量读取也能被均匀限速。
+    等待期间每隔一小段时间重新检查速率，运行中修改上限会立即生效。
+    """
+
+    BURST_TIME = 0.25        # 桶容量对应的时长（秒）
+    MIN_BURST = 16 * 1024    # 最小桶容量
+    SLEEP_SLICE = 0.1        # 等待时的检查间隔（秒）
+
+    def __init__(self, rate: int = 0):
+        self._rate = rate
+        self._tokens = 0.0
+        self._last_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> int:
+        return self._rate
+
+    def set_rate(self, rate: int):
+        """修改速率上限（字节/秒），0 表示不限速"""
+        self._rate = max(0, int(rate))
+
+    @property
+    def burst(self) -> int:
+        """桶容量，不限速时为 0"""
+        rate = self.rate
+        if rate <= 0:
+            return 0
+        return max(self.MIN_BURST, int(rate * self.BURST_TIME))
+
+    def _refill(self, rate: int):
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        self._last_time = now
+        self._tokens = min(self._tokens + elapsed * rate, max(self.MIN_BURST, rate * self.BURST_TIME))
+
+    def consume(self, size: int, is_stopped: Optional[Callable[[], bool]] = None):
+        """取出 ``size`` 字节的令牌，不足时阻塞等待"""
+        wait = self._debit(size)
+        while wait > 0:
+            if is_stopped and is_stopped():
+                return
+            time.sleep(min(wait, self.SLEEP_SLICE))
+            wait = self._deficit()
+
+    async def consume_async(self, size: int, is_stopped: Optional[Callable[[], bool]] = None):
+        """:meth:`consume` 的协程版本，在传输引擎的事件循环中等待，不占用线程"""
+        wait = self._debit(size)
+        while wait > 0:
+            if is_stopped and is_stopped():
+                return
+            await asyncio.sleep(min(wait, self.SLEEP_SLICE))
+            wait = self._deficit()
+
+    def _debit(self, size: int) -> float:
+        """扣除令牌，返回需要等待的秒数"""
+        with self._lock:
+            rate = self.rate
+            if rate <= 0:
+                return 0
+            self._refill(rate)
+            self._tokens -= size
+        return self._deficit()
+
+    def _deficit(self) -> float:
+        """欠额还需等待的秒数，限速已取消时清除欠额"""
+        with self._lock:
+            rate = self.rate
+            if rate <= 0:
+                self._tokens = 0.0
+                return 0
+            self._refill(rate)
+            return -self._tokens / rate if self._tokens < 0 else 0
+
+
+class RequestRateLimiter(TokenBucket):
+    """按请求次数限速的令牌桶，``rate`` 为每秒请求数，每次请求 ``consume(1)``
+
+    桶容量为一秒的请求数，开始时是满的，短时间内最多连续发出这么多请求。
+    """
+
+    BURST_TIME = 1.0
+    MIN_BURST = 1
+
+    def __init__(self, rate: int = 0):
+        super().__init__(rate)
+        self._tokens = float(self.burst)
+
+
+class GlobalBandwidthLimiter(TokenBucket):
+    """全局限速器
+
+    速率直接取自设置项，修改后正在进行的下载在下一批数据时生效；
+    开启时段限速后，只在设定的时段内限速，其余时间全速下载。
+    """
+
+    @property
+    def rate(self) -> int:
+        limit = config.get(config.speedLimit) * 1024
+        if limit <= 0:
+            return 0
+        if config.get(config.speedLimitScheduleEnabled) and not self.in_schedule():
+            return 0
+        return limit
+
+    def set_rate(self, rate: int):
+        config.set(config.speedLimit, max(0, int(rate)) // 1024)
+
+    @staticmethod
+    def in_schedule(now: Optional[datetime] = None) -> bool:
+        """当前是否处于限速时段，结束时间早于开始时间表示跨夜"""
+        hour = (now or datetime.now()).hour
+        start = config.get(config.speedLimitStartHour)
+        end = config.get(config.speedLimitEndHour)
+        if start == end:
+            return True
+        if start < end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+
+bandwidthLimiter = GlobalBandwidthLimiter()
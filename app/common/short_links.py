@@ -0,0 +1,125 @@
+# coding:utf-8
+"""
+短链接解析模块
+在本地跟随 b23.tv、v.douyin.com 等短链接的跳转得到原始链接，只发送 HEAD 请求、不下载页面；
+解析结果持久化到配置目录，同一短链接再次出现时无需联网
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Optional
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+from .config import CONFIG_DIR
+from .http_client import httpClient
+from .parse_cache import canonical_key
+
+SHORT_LINK_CACHE_PATH = CONFIG_DIR / "short_links.json"
+SHORT_LINK_HOSTS = ('b23.tv', 'bili2233.cn', 'v.douyin.com')
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+
+def is_short_link(url: str) -> bool:
+    host = (urlparse(url).hostname or '').lower()
+    return any(host == domain or host.endswith('.' + domain) for domain in SHORT_LINK_HOSTS)
+
+
+def _normalize(url: str) -> str:
+    """短链接的查询参数只是分享来源等信息，不影响跳转目标"""
+    parsed = urlparse(url)
+    return f"https://{(parsed.hostname or '').lower()}{parsed.path.rstrip('/')}"
+
+
+class ShortLinkResolver:
+    """短链接解析器
+
+    逐跳发送不跟随跳转的 HEAD 请求（服务器不支持 HEAD 时改用不读取响应体的 GET），
+    跳转目标中已经能识别出视频 ID 时即停止。短链接到原始链接的映射保存在
+    ``short_links.json`` 中，最多保留 :attr:`MAX_ENTRIES` 条。
+    """
+
+    MAX_REDIRECTS = 5
+    MAX_ENTRIES = 2000
+    TIMEOUT = (5, 10)
+
+    def __init__(self):
+        self._links: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+
+    def lookup(self, url: str) -> Optional[str]:
+        """只查询已保存的映射，不联网"""
+        if not is_short_link(url):
+            return None
+        with self._lock:
+            return self._load().get(_normalize(url))
+
+    def resolve(self, url: str) -> str:
+        """返回短链接对应的原始链接，不是短链接或无法解析时原样返回"""
+        if not is_short_link(url):
+            return url
+        cached = self.lookup(url)
+        if cached:
+            return cached
+
+        try:
+            target = self._follow(url)
+        except requests.RequestException as e:
+            print(f"解析短链接失败: {e}")
+            return url
+        if target is None:
+            return url
+
+        with self._lock:
+            links = self._load()
+            links.pop(_normalize(url), None)
+            links[_normalize(url)] = target
+            while len(links) > self.MAX_ENTRIES:
+                links.pop(next(iter(links)))
+            self._save(links)
+        return target
+
+    def _follow(self, url: str) -> Optional[str]:
+        """逐跳跟随跳转，得到能识别视频 ID 的链接，或已离开短链接域名的最终链接"""
+        current = url
+        for _ in range(self.MAX_REDIRECTS):
+            location = self._location(current, 'HEAD')
+            if location is None and current == url:
+                # 部分服务器不响应 HEAD 的跳转
+                location = self._location(current, 'GET')
+            if location is None:
+                break
+            current = urljoin(current, location)
+            if canonical_key(current) or not is_short_link(current):
+                return current
+        return None if current == url else current
+
+    def _location(self, url: str, method: str) -> Optional[str]:
+        with httpClient.request(method, url, allow_redirects=False, stream=True, timeout=self.TIMEOUT) as response:
+            if response.status_code in REDIRECT_STATUS:
+                return response.headers.get('Location')
+        return None
+
+    def _load(self) -> Dict[str, str]:
+        if self._links is None:
+            try:
+                with open(SHORT_LINK_CACHE_PATH, 'r', encoding='utf-8') as f:
+                    self._links = {str(key): str(value) for key, value in json.load(f).items()}
+            except (OSError, ValueError, AttributeError):
+                self._links = {}
+        return self._links
+
+    @staticmethod
+    def _save(links: Dict[str, str]):
+        try:
+            temp_path = str(SHORT_LINK_CACHE_PATH) + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(links, f, ensure_ascii=False)
+            os.replace(temp_path, SHORT_LINK_CACHE_PATH)
+        except OSError as e:
+            print(f"保存短链接缓存失败: {e}")
+
+
+shortLinks = ShortLinkResolver()
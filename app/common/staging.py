@@ -0,0 +1,112 @@
+# coding:utf-8
+"""
+暂存目录模块
+下载中的文件放在与下载目录同一文件系统的暂存目录中，完成后用原子重命名移动到下载目录
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+import sys
+
+from .config import APP_NAME, config
+from .disk_space import device_of
+from .downloader import PartManifest
+
+HIDDEN_STAGING_NAME = f".{APP_NAME}"  # 缓存目录不在同一设备时，在下载目录中使用的隐藏暂存目录
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def staging_root(target_dir: str) -> str:
+    """返回与 ``target_dir`` 同一文件系统的暂存根目录
+
+    优先使用设置中的缓存目录，跨设备时改用下载目录下的隐藏目录，保证完成时只需重命名。
+    """
+    cache_root = os.path.join(str(config.get(config.cacheFolder)), APP_NAME)
+    if device_of(cache_root)[0] == device_of(target_dir)[0]:
+        return cache_root
+    return os.path.join(target_dir, HIDDEN_STAGING_NAME)
+
+
+def task_staging_dir(target_dir: str, task_key: str) -> str:
+    """创建并返回单个任务的暂存目录，同一任务每次得到同一目录以便断点续传"""
+    path = os.path.join(staging_root(target_dir), task_key)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def url_staging_dir(target_dir: str, url: str) -> str:
+    """按下载地址确定的任务暂存目录，地址中的签名参数变化不影响续传"""
+    task_key = hashlib.md5(PartManifest.url_key(url).encode('utf-8')).hexdigest()[:16]
+    return task_staging_dir(target_dir, task_key)
+
+
+def finalize(source: str, destination: str):
+    """把暂存文件移动到最终位置
+
+    同一文件系统时直接 ``os.replace``；无法重命名时先零拷贝复制到目标目录下的临时文件，
+    再原子替换，目标位置不会出现写了一半的文件。
+    """
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    temp_path = destination + '.tmp'
+    try:
+        copy_file(source, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(source)
+
+
+def copy_file(source: str, destination: str):
+    """复制文件，依次尝试 ``copy_file_range``、``sendfile``，都不可用时退回普通复制"""
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        for copier in (_copy_file_range, _sendfile):
+            try:
+                if copier(src.fileno(), dst.fileno(), size):
+                    return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                                   errno.ENOTSUP, errno.EBADF):
+                    raise
+            # 零拷贝失败时从头重来
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(src_fd, dst_fd, min(COPY_CHUNK_SIZE, size - offset))
+        if copied == 0:
+            break
+        offset += copied
+    return offset == size
+
+
+def _sendfile(src_fd: int, dst_fd: int, size: int) -> bool:
+    # 只有 Linux 支持目标为普通文件的 sendfile
+    if not hasattr(os, 'sendfile') or not sys.platform.startswith('linux'):
+        return False
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, min(COPY_CHUNK_SIZE, size - offset))
+        if sent == 0:
+            break
+        offset += sent
+    return offset == size
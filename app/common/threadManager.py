@@ -1,76 +1,86 @@
+import asyncio
 import json
 import re
 import os
+import threading
 import requests
-import subprocess
-import tempfile
 import shutil
+import aiohttp
 import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, List, Optional
 from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtGui import QPixmap
 from urllib.parse import urlparse
 
 from .config import API_URL, config
-from .bilibili_login import BilibiliLogin
-
-
-class ParsingVideoThread(QThread):
-    finished = pyqtSignal(dict)
-    error = pyqtSignal(str)
-
-    def __init__(self, share_link):
-        super(ParsingVideoThread, self).__init__()
-        self.shareUrl = ""
-        self.shareLink = share_link
-
-    def run(self):
-        """线程运行方法"""
-        try:
-            # 提取URL并检测平台
-            url = self.extract_url_from_text(self.shareLink)
-            platform = self.detect_platform(url)
-            
-            if not platform:
-                self.error.emit('不支持的视频平台')
-                return
-            
-            # 平台解析器映射
-            parsers = {
-                'douyin': self.parse_douyin_video,
-                'bilibili': self.parse_bilibili_video
-            }
-            
-            # 执行解析
-            parser = parsers.get(platform)
-            data = parser(url) if parser else None
-            
-            if data:
-                self.finished.emit(data)
-            else:
-                platform_names = {'douyin': '抖音', 'bilibili': 'B站'}
-                self.error.emit(f'{platform_names.get(platform, platform)}视频解析失败')
-                
-        except Exception as e:
-            self.error.emit(f'解析过程中发生错误: {str(e)}')
-
-    @staticmethod
-    def extract_url_from_text(text: str) -> str:
-        """从分享文本中提取URL"""
-        # URL匹配模式
-        patterns = [
-            r'(https?://[^\s]+)',  # 完整URL
-            r'(v\.douyin\.com/[A-Za-z0-9]+)'  # 抖音短链接
-        ]
+from .login_state import loginState
+from .downloader import PART_SUFFIX, SegmentedDownloader, PartManifest, PartFileReader
+from .mp4_remuxer import FragmentedMp4Muxer, Mp4RemuxError
+from .ffmpeg import ffmpegLocator
+from .media_jobs import ffmpeg_merge
+from .postprocess import postProcessPool
+from .staging import url_staging_dir, finalize
+from .verifier import verify_file
+from .disk_space import diskSpace
+from .parse_cache import canonical_key, parseCache
+from .short_links import is_short_link, shortLinks
+from .rate_limiter import RequestRateLimiter
+from .audio_transcoder import AudioTranscodeJob, audio_extension, audio_format
+from .http_client import httpClient
+from .transfer_engine import TransferTask, transferEngine
+
+BILIBILI_VIEW_API = 'https://api.bilibili.com/x/web-interface/view'
+BILIBILI_PAGELIST_API = 'https://api.bilibili.com/x/player/pagelist'
+BILIBILI_PLAYURL_API = 'https://api.bilibili.com/x/player/playurl'
+
+# 分享文本中的链接：完整URL，或省略协议的抖音、B站短链接
+URL_PATTERN = re.compile(r'https?://[^\s]+|(?:v\.douyin\.com|b23\.tv)/[A-Za-z0-9]+')
+
+
+class ParseError(Exception):
+    """视频解析失败，消息可直接显示给用户"""
+
+
+class VideoParser:
+    """视频链接解析器
+
+    不依赖线程，单个链接的 :class:`ParsingVideoThread` 和 :class:`BatchParseThread` 共用。
+    B站登录解析时视频信息先于播放信息得到，给出 ``on_metadata`` 时先行回调，
+    回调在调用 :meth:`parse` 的线程中执行。
+    """
+
+    def __init__(self, on_metadata: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.on_metadata = on_metadata
+
+    def parse(self, url: str) -> Dict[str, Any]:
+        """解析单个已展开的链接，失败时抛出 :class:`ParseError`"""
+        platform = self.detect_platform(url)
+        if not platform:
+            raise ParseError('不支持的视频平台')
+        
+        # 同一视频近期解析过且播放地址仍有效时直接使用缓存
+        cache_key = canonical_key(url)
+        cached = parseCache.get(cache_key)
+        if cached:
+            return cached
         
-        for pattern in patterns:
-            matches = re.findall(pattern, text)
-            if matches:
-                url = matches[0]
-                return url if url.startswith('http') else f"https://{url}"
+        # 平台解析器映射
+        parsers = {
+            'douyin': self.parse_douyin_video,
+            'bilibili': self.parse_bilibili_video
+        }
+        
+        # 执行解析
+        parser = parsers.get(platform)
+        data = parser(url) if parser else None
         
-        return text.strip()
+        if not data:
+            platform_names = {'douyin': '抖音', 'bilibili': 'B站'}
+            raise ParseError(f'{platform_names.get(platform, platform)}视频解析失败')
+        parseCache.put(cache_key, data)
+        return data
 
     @staticmethod
     def detect_platform(url: str) -> Optional[str]:
@@ -91,7 +101,7 @@ class ParsingVideoThread(QThread):
     def _make_api_request(self, endpoint: str, url: str) -> Optional[Dict[str, Any]]:
         """通用API请求方法"""
         try:
-            response = requests.post(
+            response = httpClient.post(
                 f"{API_URL}{endpoint}",
                 headers={'Content-Type': 'application/json'},
                 json={'url': url}
@@ -125,19 +135,10 @@ class ParsingVideoThread(QThread):
 
     def parse_bilibili_video(self, url: str) -> Optional[Dict[str, Any]]:
         """解析B站视频"""
-        # 检查是否已登录B站
-        bili_login = BilibiliLogin()
-        is_logged_in = False
-        
-        # 尝试加载已保存的cookies
-        if bili_login.load_cookies():
-            user_info = bili_login.get_user_info()
-            if user_info and not user_info.get('isLogin', False) == False:
-                is_logged_in = True
-        
-        if is_logged_in:
+        # 检查是否已登录B站，验证结果在有效期内不会重复请求
+        if loginState.ensure_valid():
             # 已登录，使用带cookies的直接请求
-            return self._parse_bilibili_with_login(url, bili_login)
+            return self._parse_bilibili_with_login(url, loginState.headers())
         else:
             # 未登录，使用API请求
             api_response = self._make_api_request('/api/parse_bilibili', url)
@@ -148,8 +149,13 @@ class ParsingVideoThread(QThread):
             data['platform'] = 'B站'
             return data
     
-    def _parse_bilibili_with_login(self, url: str, bili_login: BilibiliLogin) -> Optional[Dict[str, Any]]:
-        """使用登录状态解析B站视频"""
+    def _parse_bilibili_with_login(self, url: str, headers: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """使用登录状态解析B站视频
+
+        播放地址需要分P的 cid。视频信息在缓存中时直接取 cid，只请求 playurl；否则同时请求
+        view 和较轻的 pagelist，拿到 cid 后立即请求 playurl，与 view 并行。
+        视频信息到达后先通过 ``metadata`` 信号显示，播放信息随后通过 ``finished`` 补充。
+        """
         try:
             # 提取BV号或AV号
             bv_match = re.search(r'[Bb][Vv]([A-Za-z0-9]+)', url)
@@ -164,64 +170,221 @@ class ParsingVideoThread(QThread):
             else:
                 return None
             
-            # 获取视频基本信息
-            response = requests.get(
-                'https://api.bilibili.com/x/web-interface/view',
-                headers=bili_login.headers,
-                params=params
-            )
-            
-            if response.status_code != 200:
-                return None
+            # 分P序号，从 1 开始
+            page_match = re.search(r'[?&]p=(\d+)', url)
+            page = int(page_match.group(1)) if page_match else 1
+            
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                # 视频信息仍在缓存有效期内时只需重新获取播放地址
+                video_info = parseCache.get_metadata(canonical_key(url))
+                if video_info and video_info.get('pages'):
+                    video_info.pop('play_info', None)
+                    play_future = executor.submit(
+                        self._request_playurl, params, self._page_cid(video_info['pages'], page), headers)
+                else:
+                    view_future = executor.submit(self._request_bilibili_api, BILIBILI_VIEW_API, params, headers)
+                    pages = self._request_bilibili_api(BILIBILI_PAGELIST_API, params, headers)
+                    play_future = None
+                    if pages:
+                        play_future = executor.submit(
+                            self._request_playurl, params, self._page_cid(pages, page), headers)
+                    
+                    video_info = view_future.result()
+                    if not video_info:
+                        return None
+                    if play_future is None:
+                        play_future = executor.submit(
+                            self._request_playurl, params, self._page_cid(video_info['pages'], page), headers)
                 
-            data = response.json()
-            if data.get('code') != 0:
-                return None
+                video_info['platform'] = 'B站'
+                if self.on_metadata:
+                    self.on_metadata(dict(video_info))
                 
-            video_info = data['data']
+                # 获取播放信息（包含下载链接）
+                play_info = play_future.result()
             
-            # 获取播放信息（包含下载链接）
-            play_params = {
-                'bvid': video_info.get('bvid'),
-                'cid': video_info['pages'][0]['cid'],
-                'qn': 80,  # 请求1080P质量
-                'fnval': 4048,  # 请求DASH格式
-                'fourk': 1
-            }
-            
-            play_response = requests.get(
-                'https://api.bilibili.com/x/player/playurl',
-                headers=bili_login.headers,
-                params=play_params
-            )
-            
-            if play_response.status_code == 200:
-                play_data = play_response.json()
-                if play_data.get('code') == 0:
-                    video_info['play_info'] = play_data['data']
-            
-            # 格式化返回数据
-            video_info['platform'] = 'B站'
+            if play_info:
+                video_info['play_info'] = play_info
             return video_info
             
         except Exception as e:
             print(f"带登录解析B站视频失败: {e}")
             return None
+    
+    @staticmethod
+    def _page_cid(pages, page: int):
+        """返回第 ``page`` 个分P的 cid，超出范围时取第一个"""
+        return pages[page - 1 if 0 < page <= len(pages) else 0]['cid']
+    
+    @staticmethod
+    def _request_bilibili_api(api_url: str, params: Dict[str, Any], headers: Dict[str, str]):
+        """请求B站接口，成功时返回 ``data`` 字段，否则返回 None；返回未登录时使登录状态失效"""
+        response = httpClient.get(api_url, headers=headers, params=params)
+        if response.status_code == 401:
+            loginState.report_auth_error()
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        if data.get('code') == -101:
+            loginState.report_auth_error()
+        if data.get('code') != 0:
+            return None
+        return data.get('data')
+    
+    def _request_playurl(self, params: Dict[str, Any], cid, headers: Dict[str, str]):
+        # playurl 接口的 av 号参数名为 avid
+        play_params = {'avid': params['aid']} if 'aid' in params else dict(params)
+        play_params.update(
+            cid=cid,
+            qn=80,  # 请求1080P质量
+            fnval=4048,  # 请求DASH格式
+            fourk=1
+        )
+        return self._request_bilibili_api(BILIBILI_PLAYURL_API, play_params, headers)
 
 
-class BilibiliDownloadThread(QThread):
-    """B站视频下载线程"""
-    progress = pyqtSignal(int)
-    finished = pyqtSignal(str)
+class ParsingVideoThread(QThread):
+    metadata = pyqtSignal(dict)  # 播放信息到达前先行发送的视频信息
+    finished = pyqtSignal(dict)
     error = pyqtSignal(str)
+
+    def __init__(self, share_link):
+        super(ParsingVideoThread, self).__init__()
+        self.shareUrl = ""
+        self.shareLink = share_link
+        self._parser = VideoParser(self.metadata.emit)
+
+    def run(self):
+        """线程运行方法"""
+        try:
+            # 提取URL并检测平台，短链接先在本地展开以便识别视频 ID
+            url = shortLinks.resolve(self.extract_url_from_text(self.shareLink))
+            self.finished.emit(self._parser.parse(url))
+        except ParseError as e:
+            self.error.emit(str(e))
+        except Exception as e:
+            self.error.emit(f'解析过程中发生错误: {str(e)}')
+
+    @staticmethod
+    def extract_url_from_text(text: str) -> str:
+        """从分享文本中提取URL"""
+        urls = ParsingVideoThread.extract_urls_from_text(text)
+        return urls[0] if urls else text.strip()
+
+    @staticmethod
+    def extract_urls_from_text(text: str) -> List[str]:
+        """按出现顺序提取分享文本中的所有URL，去掉完全相同的重复项"""
+        urls = []
+        for match in URL_PATTERN.finditer(text):
+            url = match.group(0)
+            url = url if url.startswith('http') else f"https://{url}"
+            if url not in urls:
+                urls.append(url)
+        return urls
+
+
+class BatchParseThread(QThread):
+    """批量解析线程
+
+    从粘贴的文本中提取所有链接，在有界线程池中并行解析。短链接展开后按视频 ID 去重，
+    每个平台的解析请求按 :attr:`PLATFORM_RATES` 限速（命中缓存的不计），
+    每完成一个就发送结果，不等全部结束。
+    """
+
+    itemParsed = pyqtSignal(str, dict)  # (链接, 解析结果)
+    itemFailed = pyqtSignal(str, str)   # (链接, 错误信息)
+    progress = pyqtSignal(int, int)     # (已处理, 总数)，重复的链接也计入已处理
+    allFinished = pyqtSignal(int, int)  # (成功数, 失败数)
+
+    MAX_WORKERS = 4
+    PLATFORM_RATES = {'bilibili': 2, 'douyin': 1}  # 每秒最多发起的解析次数
+
+    def __init__(self, text: str, parent=None):
+        super().__init__(parent)
+        self.urls = ParsingVideoThread.extract_urls_from_text(text)
+        self._parser = VideoParser()
+        self._limiters = {platform: RequestRateLimiter(rate) for platform, rate in self.PLATFORM_RATES.items()}
+        self._seen = set()
+        self._seen_lock = threading.Lock()
+        self._stopped = False
+
+    def stop(self):
+        """停止尚未开始的解析，已在进行的解析完成后丢弃结果"""
+        self._stopped = True
+
+    def run(self):
+        succeeded = failed = done = 0
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            futures = [executor.submit(self._parse_one, url) for url in self.urls]
+            for future in as_completed(futures):
+                done += 1
+                result = future.result()
+                if result is True:
+                    succeeded += 1
+                elif result is False:
+                    failed += 1
+                if not self._stopped:
+                    self.progress.emit(done, len(futures))
+        self.allFinished.emit(succeeded, failed)
+
+    def _parse_one(self, url: str) -> Optional[bool]:
+        """解析一个链接，成功返回 True，失败返回 False，重复或已停止返回 None"""
+        if self._stopped:
+            return None
+        limiter = self._limiters.get(VideoParser.detect_platform(url))
+        is_stopped = lambda: self._stopped
+        try:
+            # 展开短链接也要请求平台的服务器
+            if limiter and is_short_link(url) and shortLinks.lookup(url) is None:
+                limiter.consume(1, is_stopped)
+            resolved = shortLinks.resolve(url)
+
+            # 同一视频的不同分享链接只解析一次
+            key = canonical_key(resolved) or resolved
+            with self._seen_lock:
+                if key in self._seen:
+                    return None
+                self._seen.add(key)
+
+            limiter = self._limiters.get(VideoParser.detect_platform(resolved))
+            if limiter and parseCache.get(canonical_key(resolved)) is None:
+                limiter.consume(1, is_stopped)
+            if self._stopped:
+                return None
+            data = self._parser.parse(resolved)
+        except ParseError as e:
+            error = str(e)
+        except Exception as e:
+            error = f'解析过程中发生错误: {str(e)}'
+        else:
+            if not self._stopped:
+                self.itemParsed.emit(url, data)
+            return True
+
+        if not self._stopped:
+            self.itemFailed.emit(url, error)
+        return False
+
+
+class BilibiliDownloadTask(TransferTask):
+    """B站视频下载任务"""
     
     def __init__(self, quality_data, video_info, parent=None):
         super().__init__(parent)
         self.quality_data = quality_data
         self.video_info = video_info
-        self.is_stopped = False
+        self._streams_aborted = False  # 并行下载的某一路失败时通知其他流停止
+        self._stream_progress = {}     # 各流的 (已下载, 总大小)，用于按字节加权合并进度
+        self._progress_lock = threading.Lock()
+        self._needs_ffmpeg_merge = False  # 内置封装不支持该格式，需要 FFmpeg 合并
+        self._pending_merge = None        # 等待后处理的 (视频, 音频, 暂存输出, 最终输出, 下载器, 暂存目录)
+        self._pending_transcode = None    # 等待在后处理线程池中转码的 AudioTranscodeJob
+        self._space_reservation = None    # 为合并输出预留的磁盘空间
         
-    def run(self):
+    def target_url(self):
+        return self.quality_data.get('base_url', '')
+        
+    def run_sync(self):
         """执行下载"""
         try:
             download_folder = str(config.downloadFolder.value)
@@ -249,54 +412,224 @@ class BilibiliDownloadThread(QThread):
     def _download_dash_video_sync(self, download_folder, title):
         """下载DASH格式视频（需要合并音视频）"""
         
-        # 创建临时目录
-        temp_dir = tempfile.mkdtemp()
+        # 获取音频流（选择最高质量）
+        play_info = self.video_info.get('play_info', {})
+        audio_streams = play_info.get('dash', {}).get('audio', [])
+        if not audio_streams:
+            raise Exception("未找到音频流")
+        
+        best_audio = max(audio_streams, key=lambda x: x.get('bandwidth', 0))
+        
+        # 获取视频流和音频流地址
+        video_url = self.quality_data.get('base_url', '')
+        if not video_url:
+            raise Exception("视频下载链接无效")
+        
+        audio_url = best_audio.get('base_url', '')
+        if not audio_url:
+            raise Exception("音频下载链接无效")
+        
+        # 暂存目录按视频流固定，取消或失败后重新下载时可以断点续传；
+        # 与下载目录位于同一文件系统，封装结果最后只需重命名
+        os.makedirs(download_folder, exist_ok=True)
+        temp_dir = self._get_task_temp_dir(download_folder, video_url)
+        staged_path = os.path.join(temp_dir, 'output.mp4')
+        
+        output_path = os.path.join(download_folder, f"{title}.mp4")
+        output_path = self._get_unique_filename(output_path)
+        
+        video_path = os.path.join(temp_dir, 'video.m4v')
+        audio_path = os.path.join(temp_dir, 'audio.m4a')
+        if not self._reserve_dash_space(temp_dir, {video_path: self.quality_data, audio_path: best_audio}):
+            return
         
         try:
-            # 获取音频流（选择最高质量）
-            play_info = self.video_info.get('play_info', {})
-            audio_streams = play_info.get('dash', {}).get('audio', [])
-            if not audio_streams:
-                raise Exception("未找到音频流")
-            
-            best_audio = max(audio_streams, key=lambda x: x.get('bandwidth', 0))
-            
-            # 下载视频流
-            video_url = self.quality_data.get('base_url', '')
-            if not video_url:
-                raise Exception("视频下载链接无效")
-            
-            video_temp_path = os.path.join(temp_dir, 'video.m4v')
-            self._download_file_sync(video_url, video_temp_path, 'video')
-            
-            if self.is_stopped:
+            # 视频流和音频流来自不同的 CDN 地址，并行下载，同时边下载边封装；
+            # 封装器读过的部分随即从 .part 中释放，磁盘上不会同时存在两路流的完整副本和合并结果
+            downloaders = [
+                self._create_downloader(video_url, video_path, 'video',
+                                        self._get_backup_urls(self.quality_data), streaming=True),
+                self._create_downloader(audio_url, audio_path, 'audio',
+                                        self._get_backup_urls(best_audio), streaming=True)
+            ]
+            if not self._download_and_merge(downloaders, staged_path):
                 return
             
-            # 下载音频流
-            audio_url = best_audio.get('base_url', '')
-            if not audio_url:
-                raise Exception("音频下载链接无效")
-            
-            audio_temp_path = os.path.join(temp_dir, 'audio.m4a')
-            self._download_file_sync(audio_url, audio_temp_path, 'audio')
-            
-            if self.is_stopped:
+            if self._needs_ffmpeg_merge:
+                # 内置封装中途放弃时已释放的开头部分需要补回，FFmpeg 要读取完整的文件
+                downloaders = self._refill_released(downloaders)
+                if downloaders is None:
+                    return
+                
+                # 内置封装不支持的格式，下载已完成，交给后处理线程池用 FFmpeg 合并，预留的空间保留到合并结束
+                self._pending_merge = (downloaders[0].part_path, downloaders[1].part_path,
+                                       staged_path, output_path, downloaders, temp_dir)
                 return
-
-            # 使用FFmpeg合并
-            output_path = os.path.join(download_folder, f"{title}.mp4")
-            output_path = self._get_unique_filename(output_path)
-            
-            self._merge_video_audio_sync(video_temp_path, audio_temp_path, output_path)
             
+            self._finish_dash(staged_path, output_path, downloaders, temp_dir)
+        finally:
+            if self._pending_merge is None:
+                self._release_space()
+    
+    def _estimate_stream_size(self, stream):
+        """按码率和时长估算流的大小，无法估算时返回 0"""
+        dash = self.video_info.get('play_info', {}).get('dash', {})
+        duration = dash.get('duration') or self.video_info.get('duration') or 0
+        return int(stream.get('bandwidth', 0) * duration / 8)
+    
+    def _reserve_dash_space(self, temp_dir, streams):
+        """预检磁盘空间：两路流和合并输出各需要一份空间
+        
+        流下载时会预分配，这里只为合并输出持续预留；空间被其他任务占用时排队等待，被取消返回 False
+        """
+        estimates = {path: self._estimate_stream_size(stream) for path, stream in streams.items()}
+        output_size = sum(estimates.values())
+        # 续传时已存在的流文件已经占用了空间
+        pending_size = sum(size for path, size in estimates.items() if not os.path.exists(path + PART_SUFFIX))
+        self._space_reservation = diskSpace.reserve(
+            temp_dir, output_size + pending_size, held=output_size, is_stopped=lambda: self.is_stopped)
+        return self._space_reservation is not None
+    
+    def _release_space(self):
+        if self._space_reservation is not None:
+            self._space_reservation.release()
+            self._space_reservation = None
+    
+    def _finish_dash(self, staged_path, output_path, downloaders, temp_dir):
+        """检查封装结果并移动到下载目录，成功后才清理下载缓存"""
+        verify_file(staged_path)
+        finalize(staged_path, output_path)
+        for downloader in downloaders:
+            downloader.discard()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        
+        if not self.is_stopped:
+            self.report_finished(self._streams_total())
+            self.finished.emit(output_path)
+    
+    async def post_process(self):
+        """在后处理线程池中用FFmpeg合并或转码，此时下载名额已经释放"""
+        if self._pending_transcode is not None:
+            job, self._pending_transcode = self._pending_transcode, None
+            try:
+                await job.post_process()
+            except Exception as e:
+                if not self.is_stopped:
+                    self.error.emit(f"下载失败: {str(e)}")
+                return
             if not self.is_stopped:
-                self.finished.emit(output_path)
-                
+                self.report_finished(self._streams_total())
+                self.finished.emit(job.output_path)
+            return
+        
+        if self._pending_merge is None:
+            return
+        
+        video_path, audio_path, staged_path, output_path, downloaders, temp_dir = self._pending_merge
+        self._pending_merge = None
+        try:
+            ffmpeg_path = (await transferEngine.run_blocking(ffmpegLocator.require, 'mp4')).path
+            await postProcessPool.run(ffmpeg_merge, ffmpeg_path, video_path, audio_path, staged_path)
+            await transferEngine.run_blocking(self._finish_dash, staged_path, output_path, downloaders, temp_dir)
+        except Exception as e:
+            # 下载缓存保留，重试时不必重新下载
+            self._remove_file(staged_path)
+            if not self.is_stopped:
+                self.error.emit(f"下载失败: {str(e)}")
         finally:
+            self._release_space()
+    
+    def _download_and_merge(self, downloaders, output_path):
+        """并行下载音视频流，同时把已到达的数据交给封装器，完成返回 True，被取消返回 False"""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # 各路流在传输引擎中以协程下载，只有封装占用一个线程
+            download_futures = [transferEngine.submit(downloader.download_async()) for downloader in downloaders]
+            merge_future = executor.submit(self._stream_merge, downloaders, output_path)
+            merge_future.add_done_callback(self._on_stream_merge_done)
+            
             try:
-                shutil.rmtree(temp_dir)
-            except:
-                pass
+                results = [future.result() for future in as_completed(download_futures)]
+            except Exception:
+                # 任一路失败时停止其余的流并等待其退出，已下载部分保留用于续传
+                self._streams_aborted = True
+                wait(download_futures)
+                self._discard_output(merge_future, output_path)
+                raise
+            
+            if not all(results) or self.is_stopped:
+                self._discard_output(merge_future, output_path)
+                if not self.is_stopped:
+                    # 封装器发现需要 FFmpeg 但不可用时会提前中止下载
+                    ffmpegLocator.require('mp4')
+                return False
+            
+            try:
+                merge_future.result()
+            except Mp4RemuxError:
+                # 需要 FFmpeg 合并，登记后由 post_process 处理
+                self._remove_file(output_path)
+                self._needs_ffmpeg_merge = True
+            except Exception:
+                self._remove_file(output_path)
+                raise
+        
+        return True
+    
+    def _refill_released(self, downloaders):
+        """重新下载已被封装器释放的开头部分，返回可供 FFmpeg 读取的下载器列表，被取消返回 None"""
+        refilled = []
+        for file_type, downloader in zip(('video', 'audio'), downloaders):
+            if downloader.manifest.released:
+                # 清单中已去掉释放的区间，新的下载器只会补齐这部分，补齐后不再释放
+                downloader = SegmentedDownloader(
+                    downloader.url, downloader.output_path, downloader.headers,
+                    progress_callback=lambda done, total, file_type=file_type: self._on_download_progress(
+                        file_type, done, total),
+                    is_stopped=lambda: self.is_stopped,
+                    mirrors=downloader.mirrors,
+                    rate_limiter=self.rate_limiter,
+                    streaming=True
+                )
+                if not downloader.download():
+                    return None
+            refilled.append(downloader)
+        return refilled
+    
+    def _stream_merge(self, downloaders, output_path):
+        """从正在下载的 .part 文件中顺序读取并封装"""
+        readers = [PartFileReader(downloader) for downloader in downloaders]
+        try:
+            with open(output_path, 'wb') as output:
+                FragmentedMp4Muxer(readers, output).mux()
+        finally:
+            for reader in readers:
+                reader.close()
+    
+    def _on_stream_merge_done(self, future):
+        """读取到文件头就能判断是否需要 FFmpeg，不可用时立即停止下载，不必等到下载完成才报错"""
+        if future.cancelled():
+            return
+        if isinstance(future.exception(), Mp4RemuxError) and ffmpegLocator.locate() is None:
+            self._streams_aborted = True
+    
+    def _discard_output(self, merge_future, output_path):
+        """等待封装线程退出并删除未完成的输出文件"""
+        try:
+            merge_future.result()
+        except Exception:
+            pass
+        self._remove_file(output_path)
+    
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def _get_task_temp_dir(self, download_folder, video_url):
+        """获取与视频流对应的固定暂存目录"""
+        return url_staging_dir(download_folder, video_url)
     
     def _download_audio_only_sync(self, download_folder, title):
         """仅下载音频"""
@@ -312,12 +645,44 @@ class BilibiliDownloadThread(QThread):
         if not audio_url:
             raise Exception("音频下载链接无效")
         
+        fmt = audio_format()
+        if fmt is not None:
+            self._download_and_transcode_audio(download_folder, title, audio_url, best_audio, fmt)
+            return
+        
         output_path = os.path.join(download_folder, f"{title}.m4a")
         output_path = self._get_unique_filename(output_path)
         
-        self._download_file_sync(audio_url, output_path, 'audio')
+        self._download_file_sync(audio_url, output_path, 'audio', self._get_backup_urls(best_audio))
         
         if not self.is_stopped:
+            self.report_finished(self._streams_total())
+            self.finished.emit(output_path)
+    
+    def _download_and_transcode_audio(self, download_folder, title, audio_url, stream, fmt):
+        """边下载边转码为设置中的音频格式"""
+        ffmpeg_path = ffmpegLocator.require().path
+        os.makedirs(download_folder, exist_ok=True)
+        temp_dir = self._get_task_temp_dir(download_folder, audio_url)
+        
+        output_path = os.path.join(download_folder, f"{title}{audio_extension(fmt)}")
+        output_path = self._get_unique_filename(output_path)
+        
+        downloader = self._create_downloader(audio_url, os.path.join(temp_dir, 'audio.m4a'), 'audio',
+                                             self._get_backup_urls(stream), streaming=True)
+        job = AudioTranscodeJob(downloader, ffmpeg_path, output_path, temp_dir,
+                                fmt, config.get(config.audioBitrate))
+        if not job.run():
+            return
+        
+        if job.pending:
+            # FFmpeg 无法从管道读取，下载完成后在后处理线程池中转换
+            self._pending_transcode = job
+            return
+        
+        job.finish()
+        if not self.is_stopped:
+            self.report_finished(self._streams_total())
             self.finished.emit(output_path)
     
     def _download_traditional_video_sync(self, download_folder, title):
@@ -331,75 +696,62 @@ class BilibiliDownloadThread(QThread):
         output_path = os.path.join(download_folder, f"{title}.mp4")
         output_path = self._get_unique_filename(output_path)
         
-        self._download_file_sync(video_url, output_path, 'video')
+        self._download_file_sync(video_url, output_path, 'video', self._get_backup_urls(self.quality_data))
         
         if not self.is_stopped:
+            self.report_finished(self._streams_total())
             self.finished.emit(output_path)
     
-    def _download_file_sync(self, url, output_path, file_type):
-        """下载文件"""
+    @staticmethod
+    def _get_backup_urls(stream):
+        """获取流的备用地址，接口中同时存在 backup_url 与 backupUrl 两种写法"""
+        return stream.get('backup_url') or stream.get('backupUrl') or []
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Referer': 'https://www.bilibili.com/'
-        }
+    def _download_file_sync(self, url, output_path, file_type, mirrors=None):
+        """下载文件，完成返回 True，被取消返回 False"""
+        return self._create_downloader(url, output_path, file_type, mirrors).download()
+
+    def _create_downloader(self, url, output_path, file_type, mirrors=None, streaming=False):
+        """创建带登录 Cookie 的分段下载器"""
+
+        # User-Agent/Referer 由共享客户端统一附加
+        headers = {}
 
         try:
-            bili_login = BilibiliLogin()
-            if bili_login.load_cookies():
-                user_info = bili_login.get_user_info()
-                if user_info and not user_info.get('isLogin', False) == False:
-                    # 已登录，添加Cookie到请求头
-                    cookies = bili_login.cookies
-                    cookie_str = '; '.join([f'{k}={v}' for k, v in cookies.items()])
-                    headers['Cookie'] = cookie_str
+            if loginState.ensure_valid():
+                # 已登录，添加Cookie到请求头
+                headers['Cookie'] = loginState.cookie_header()
         except Exception as e:
             # 如果获取Cookie失败，继续使用基本请求头
             print(f"获取Cookie失败: {e}")
         
-        response = requests.get(url, headers=headers, stream=True)
-        if response.status_code != 200:
-            raise Exception(f"下载失败，状态码: {response.status_code}")
-        
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded = 0
-        
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if self.is_stopped:
-                    return
-                
-                f.write(chunk)
-                downloaded += len(chunk)
-                
-                if total_size > 0:
-                    progress = int((downloaded / total_size) * 100)
-                    self.progress.emit(progress)
+        self._stream_progress[file_type] = (0, 0)
+        return SegmentedDownloader(
+            url, output_path, headers,
+            progress_callback=lambda downloaded, total_size: self._on_download_progress(file_type, downloaded, total_size),
+            is_stopped=lambda: self.is_stopped or self._streams_aborted,
+            mirrors=mirrors,
+            rate_limiter=self.rate_limiter,
+            streaming=streaming,
+            release_consumed=streaming
+        )
+
+    def _streams_total(self):
+        """各路流的总字节数，下载完成时上报 100% 使用"""
+        with self._progress_lock:
+            return sum(size for _, size in self._stream_progress.values())
     
-    def _merge_video_audio_sync(self, video_path, audio_path, output_path):
-        """使用FFmpeg合并视频和音频"""
-
-        ffmpeg_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'ffmpeg', 'ffmpeg.exe')
-        
-        if not os.path.exists(ffmpeg_path):
-            raise Exception("FFmpeg未找到")
-        
-        # FFmpeg命令
-        cmd = [
-            ffmpeg_path,
-            '-i', video_path,
-            '-i', audio_path,
-            '-c', 'copy',
-            '-y',  # 覆盖输出文件
-            output_path
-        ]
-        
-        # 执行FFmpeg
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
+    def _on_download_progress(self, file_type, downloaded, total_size):
+        """分段下载进度回调，多路流按字节数加权合并为总进度"""
+        with self._progress_lock:
+            self._stream_progress[file_type] = (downloaded, total_size)
+            # 所有流都探测到大小之前不发送进度，避免进度条跳变
+            if any(total <= 0 for _, total in self._stream_progress.values()):
+                return
+            done = sum(size for size, _ in self._stream_progress.values())
+            total = sum(size for _, size in self._stream_progress.values())
         
-        if process.returncode != 0:
-            raise Exception(f"视频合并失败: {stderr.decode('utf-8', errors='ignore')}")
+        self.report_progress(done, total)
     
     def _sanitize_filename(self, filename):
         """清理文件名"""
@@ -422,226 +774,228 @@ class BilibiliDownloadThread(QThread):
             if not os.path.exists(new_path):
                 return new_path
             counter += 1
-    
-    def stop(self):
-        """停止下载"""
-        self.is_stopped = True
-        if self.isRunning():
-            self.wait(3000)
 
 
-class ImageLoaderThread(QThread):
-    """网络图片加载线程类"""
+class ImageLoaderTask(TransferTask):
+    """网络图片加载任务"""
     
     # 信号定义
     imageLoaded = pyqtSignal(QPixmap, str)  # 图片加载完成信号，传递QPixmap和图片类型
     loadFailed = pyqtSignal(str)            # 加载失败信号，传递图片类型
+    dataLoaded = pyqtSignal(bytes)          # 内部信号，把图片数据投递到界面线程解码
     
     def __init__(self, url, image_type, parent=None):
         super().__init__(parent)
         self.url = url
         self.image_type = image_type  # 'cover' 或 'avatar'
+        self.dataLoaded.connect(self._onDataLoaded)
     
-    def run(self):
-        try:
-            if not self.url:
-                self.loadFailed.emit(self.image_type)
-                return
-
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            response = requests.get(
-                self.url, 
-                headers=headers,
-                timeout=10,
-                stream=True
-            )
-            
-            if response.status_code == 200:
-                # 创建QPixmap对象并加载图片数据
-                pixmap = QPixmap()
-                success = pixmap.loadFromData(response.content)
-                
-                if success and not pixmap.isNull():
-                    self.imageLoaded.emit(pixmap, self.image_type)
-                else:
-                    self.loadFailed.emit(self.image_type)
-            else:
-                self.loadFailed.emit(self.image_type)
-                
-        except requests.exceptions.Timeout:
-            self.loadFailed.emit(self.image_type)
-        except requests.exceptions.RequestException:
+    async def run(self):
+        if not self.url:
             self.loadFailed.emit(self.image_type)
+            return
+
+        try:
+            data = await transferEngine.fetch_bytes(self.url, timeout=10)
+        except asyncio.CancelledError:
+            raise
         except Exception:
             self.loadFailed.emit(self.image_type)
+            return
+
+        self.dataLoaded.emit(data)
+    
+    def _onDataLoaded(self, data):
+        """在界面线程中创建QPixmap对象并加载图片数据"""
+        pixmap = QPixmap()
+        if pixmap.loadFromData(data) and not pixmap.isNull():
+            self.imageLoaded.emit(pixmap, self.image_type)
+        else:
+            self.loadFailed.emit(self.image_type)
     
     def stop(self):
-        """停止线程"""
-        self.terminate()
-        self.wait()
+        """取消加载"""
+        super().stop()
+        if self._future:
+            self._future.cancel()
 
 
-class VideoDownloadThread(QThread):
-    """视频下载线程"""
-    finished = pyqtSignal(str)
-    error = pyqtSignal(str)
-    progress = pyqtSignal(int)
+class VideoDownloadTask(TransferTask):
+    """视频下载任务"""
     
     def __init__(self, download_url, save_directory=None, filename=None, resolution=None):
-        super(VideoDownloadThread, self).__init__()
+        super(VideoDownloadTask, self).__init__()
         self.download_url = download_url
         self.save_directory = save_directory or str(config.downloadFolder.value)
         self.filename = filename
         self.resolution = resolution
-        self._is_cancelled = False
     
-    def run(self):
-        """执行下载"""
+    def target_url(self):
+        return self.download_url
+    
+    async def run(self):
+        """执行下载，传输在引擎事件循环中以协程进行"""
         try:
-            os.makedirs(self.save_directory, exist_ok=True)
-
-            if not self.filename:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                resolution_str = self.resolution or "unknown"
-                self.filename = f"{timestamp}_{resolution_str}.mp4"
-
-            if not os.path.splitext(self.filename)[1]:
-                self.filename += '.mp4'
-            
-            file_path = os.path.join(self.save_directory, self.filename)
-
-            counter = 1
-            original_path = file_path
-            while os.path.exists(file_path):
-                name, ext = os.path.splitext(original_path)
-                file_path = f"{name}({counter}){ext}"
-                counter += 1
+            file_path = await transferEngine.run_blocking(self._prepare_path)
             
             # 开始下载
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            response = requests.get(self.download_url, headers=headers, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
-            
-            with open(file_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if self._is_cancelled:
-                        file.close()
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                        return
-                    
-                    if chunk:
-                        file.write(chunk)
-                        downloaded_size += len(chunk)
-
-                        if total_size > 0:
-                            progress_percent = int((downloaded_size / total_size) * 100)
-                            self.progress.emit(progress_percent)
+            downloader = SegmentedDownloader(
+                self.download_url, file_path,
+                progress_callback=self.report_progress,
+                is_stopped=lambda: self.is_stopped,
+                rate_limiter=self.rate_limiter
+            )
+            if not await downloader.download_async():
+                # 已取消，保留 .part 文件供下次续传
+                return
             
             # 下载完成
-            self.progress.emit(100)
+            self.report_finished(downloader.total_size)
             self.finished.emit(file_path)
             
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             self.error.emit(f"网络错误: {str(e)}")
         except OSError as e:
             self.error.emit(f"文件操作错误: {str(e)}")
         except Exception as e:
             self.error.emit(f"下载失败: {str(e)}")
     
-    def cancel(self):
-        """取消下载"""
-        self._is_cancelled = True
+    def _prepare_path(self):
+        """确定保存路径，同一来源有未完成的下载时沿用原文件断点续传"""
+        os.makedirs(self.save_directory, exist_ok=True)
+
+        if not self.filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            resolution_str = self.resolution or "unknown"
+            self.filename = f"{timestamp}_{resolution_str}.mp4"
+
+        if not os.path.splitext(self.filename)[1]:
+            self.filename += '.mp4'
+        
+        file_path = os.path.join(self.save_directory, self.filename)
+
+        counter = 1
+        original_path = file_path
+        while os.path.exists(file_path):
+            name, ext = os.path.splitext(original_path)
+            file_path = f"{name}({counter}){ext}"
+            counter += 1
+
+        return PartManifest.find(self.save_directory, self.download_url) or file_path
     
-    def stop(self):
-        """停止线程"""
-        self.cancel()
-        if self.isRunning():
-            self.wait(3000)
 
 
-class AudioDownloadThread(QThread):
-    """音频下载线程"""
-    finished = pyqtSignal(str)
-    error = pyqtSignal(str)
-    progress = pyqtSignal(int)
+class AudioDownloadTask(TransferTask):
+    """音频下载任务"""
+    
+    SOURCE_EXTENSIONS = ('.mp3', '.m4a', '.aac', '.opus', '.ogg', '.flac', '.wav')
     
     def __init__(self, download_url, save_directory=None):
-        super(AudioDownloadThread, self).__init__()
+        super(AudioDownloadTask, self).__init__()
         self.download_url = download_url
         self.save_directory = save_directory or str(config.downloadFolder.value)
-        self._is_cancelled = False
+        self._pending_transcode = None  # 等待在后处理线程池中转码的 AudioTranscodeJob
     
-    def run(self):
+    def target_url(self):
+        return self.download_url
+    
+    async def run(self):
         try:
-            os.makedirs(self.save_directory, exist_ok=True)
+            # 设置了转码格式时使用目标格式的扩展名，否则沿用源文件的扩展名
+            fmt = audio_format()
+            file_path = await transferEngine.run_blocking(self._prepare_path, fmt)
 
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{timestamp}.mp3"
-            file_path = os.path.join(self.save_directory, filename)
-
-            counter = 1
-            original_path = file_path
-            while os.path.exists(file_path):
-                name, ext = os.path.splitext(original_path)
-                file_path = f"{name}({counter}){ext}"
-                counter += 1
+            if fmt is not None:
+                # 边下载边转码需要一个线程向 FFmpeg 输送数据
+                await transferEngine.run_blocking(self._download_and_transcode, file_path, fmt)
+                return
+
+            # 同一来源有未完成的下载时沿用原文件断点续传
+            file_path = (await transferEngine.run_blocking(
+                PartManifest.find, self.save_directory, self.download_url)) or file_path
             
             # 开始下载
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            response = requests.get(self.download_url, headers=headers, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
-            
-            with open(file_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if self._is_cancelled:
-                        file.close()
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                        return
-                    
-                    if chunk:
-                        file.write(chunk)
-                        downloaded_size += len(chunk)
-
-                        if total_size > 0:
-                            progress_percent = int((downloaded_size / total_size) * 100)
-                            self.progress.emit(progress_percent)
+            downloader = SegmentedDownloader(
+                self.download_url, file_path,
+                progress_callback=self.report_progress,
+                is_stopped=lambda: self.is_stopped,
+                rate_limiter=self.rate_limiter
+            )
+            if not await downloader.download_async():
+                # 已取消，保留 .part 文件供下次续传
+                return
             
             # 下载完成
-            self.progress.emit(100)
+            self.report_finished(downloader.total_size)
             self.finished.emit(file_path)
             
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             self.error.emit(f"网络错误: {str(e)}")
         except OSError as e:
             self.error.emit(f"文件操作错误: {str(e)}")
         except Exception as e:
             self.error.emit(f"下载失败: {str(e)}")
     
-    def cancel(self):
-        """取消下载"""
-        self._is_cancelled = True
-    
-    def stop(self):
-        """停止线程"""
-        self.cancel()
-        if self.isRunning():
-            self.wait(3000)  # 等待最多3秒
+    def _prepare_path(self, fmt):
+        """按目标格式确定不重名的保存路径"""
+        os.makedirs(self.save_directory, exist_ok=True)
 
+        if fmt is not None:
+            extension = audio_extension(fmt)
+        else:
+            extension = os.path.splitext(urlparse(self.download_url).path)[1].lower()
+            if extension not in self.SOURCE_EXTENSIONS:
+                extension = '.mp3'
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"{timestamp}{extension}"
+        file_path = os.path.join(self.save_directory, filename)
 
+        counter = 1
+        original_path = file_path
+        while os.path.exists(file_path):
+            name, ext = os.path.splitext(original_path)
+            file_path = f"{name}({counter}){ext}"
+            counter += 1
+        return file_path
+    
+    def _download_and_transcode(self, file_path, fmt):
+        """边下载边转码，源文件下载到暂存目录，按地址固定以便断点续传"""
+        ffmpeg_path = ffmpegLocator.require().path
+        temp_dir = url_staging_dir(self.save_directory, self.download_url)
+        downloader = SegmentedDownloader(
+            self.download_url, os.path.join(temp_dir, 'source'),
+            progress_callback=self.report_progress,
+            is_stopped=lambda: self.is_stopped,
+            rate_limiter=self.rate_limiter,
+            streaming=True
+        )
+        job = AudioTranscodeJob(downloader, ffmpeg_path, file_path, temp_dir,
+                                fmt, config.get(config.audioBitrate))
+        if not job.run():
+            return
+        
+        self.report_finished(downloader.total_size)
+        if job.pending:
+            # FFmpeg 无法从管道读取，下载完成后在后处理线程池中转换
+            self._pending_transcode = job
+            return
+        
+        job.finish()
+        self.finished.emit(file_path)
+    
+    async def post_process(self):
+        """在后处理线程池中转码已下载完成的文件"""
+        if self._pending_transcode is None:
+            return
+        
+        job, self._pending_transcode = self._pending_transcode, None
+        try:
+            await job.post_process()
+        except Exception as e:
+            if not self.is_stopped:
+                self.error.emit(f"下载失败: {str(e)}")
+            return
+        
+        if not self.is_stopped:
+            self.finished.emit(job.output_path)
@@ -0,0 +1,188 @@
+# coding:utf-8
+"""
+传输引擎模块
+一个常驻的 asyncio 事件循环线程承载所有传输协程，结果通过 Qt 信号回到界面线程
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+import aiohttp
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .http_client import USER_AGENT, HttpClient
+from .progress import ProgressReporter
+from .rate_limiter import TokenBucket
+
+
+class TransferEngine:
+    """后台传输引擎
+
+    所有图片获取、下载任务都作为协程运行在同一个事件循环线程中，由协程负责排队、调度和信号转发。
+    封面、头像等小文件和 :class:`~.downloader.SegmentedDownloader` 的每个分段连接都是共享
+    aiohttp 会话上的协程，数百个并发传输不需要对应数量的线程；只有刷盘、FFmpeg 管道等
+    阻塞操作通过 :meth:`run_blocking` 交给有上限的线程池。
+    """
+
+    CONNECTION_LIMIT = 256          # aiohttp 连接总数上限
+    CONNECTION_LIMIT_PER_HOST = 64  # 单个主机的连接上限，多个任务的分段常落在同一 CDN 节点
+    BLOCKING_WORKERS = 32           # 阻塞操作线程池大小
+    DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=30)
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.BLOCKING_WORKERS,
+            thread_name_prefix='TransferWorker'
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """延迟启动事件循环线程"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(
+                        target=self._run_loop, args=(loop,), name='TransferEngine', daemon=True)
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """从任意线程提交协程，返回线程安全的 Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def session(self) -> aiohttp.ClientSession:
+        """获取共享的 aiohttp 会话，只能在引擎线程内调用"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.CONNECTION_LIMIT,
+                limit_per_host=self.CONNECTION_LIMIT_PER_HOST,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.DEFAULT_TIMEOUT,
+                headers={'User-Agent': USER_AGENT},
+                cookie_jar=aiohttp.DummyCookieJar()
+            )
+        return self._session
+
+    async def fetch_bytes(self, url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 10) -> bytes:
+        """获取小文件（封面、头像等）的完整内容"""
+        session = await self.session()
+        request_headers = HttpClient.default_headers(url)
+        request_headers.update(headers or {})
+
+        async with session.get(url, headers=request_headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def run_blocking(self, func: Callable, *args, **kwargs) -> Any:
+        """在引擎线程池中执行阻塞函数"""
+        return await self.loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        """关闭会话并停止事件循环"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+
+        if loop is None:
+            return
+
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result(timeout=3)
+            self._session = None
+
+        loop.call_soon_threadsafe(loop.stop)
+        self._executor.shutdown(wait=False)
+
+
+transferEngine = TransferEngine()
+
+
+class TransferTask(QObject):
+    """传输任务基类
+
+    对外保持与原下载线程一致的接口（``progress``/``finished``/``error`` 信号以及
+    ``start``/``stop``/``isRunning``），内部作为协程运行在 :data:`transferEngine` 上。
+    信号在引擎线程中发出，Qt 会自动排队投递到界面线程。
+
+    子类实现协程 :meth:`run`，或只实现阻塞的 :meth:`run_sync` 交由引擎线程池执行；
+    合并、转码等后处理放在 :meth:`post_process` 中，经下载队列运行时会先释放下载名额再执行。
+    下载进度通过 :meth:`report_progress` 上报，合并为 10Hz 的 :class:`DownloadProgress` 记录。
+    """
+
+    progress = pyqtSignal(object)  # DownloadProgress
+    finished = pyqtSignal(str)
+    error = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.is_stopped = False
+        self._queued = False  # 是否还在下载队列中等待
+        self._future: Optional[Future] = None
+        self._reporter = ProgressReporter(self.progress.emit)
+        self.rate_limiter = TokenBucket()  # 任务自身的限速，与全局限速同时生效
+
+    def start(self):
+        """直接提交到传输引擎，不经过下载队列"""
+        self.is_stopped = False
+        self._future = transferEngine.submit(self._execute())
+
+    def isRunning(self) -> bool:
+        """运行中或排队中"""
+        return self._future is not None and not self._future.done()
+
+    def isQueued(self) -> bool:
+        return self._queued and self.isRunning()
+
+    def stop(self):
+        """请求停止，排队中的任务直接出队，阻塞操作会在下一次检查 ``is_stopped`` 时退出"""
+        self.is_stopped = True
+        if self._queued and self._future:
+            self._future.cancel()
+
+    def set_rate_limit(self, bytes_per_second: int):
+        """设置任务限速（字节/秒），0 表示只受全局限速约束，运行中修改立即生效"""
+        self.rate_limiter.set_rate(bytes_per_second)
+
+    def report_progress(self, downloaded: int, total: int):
+        """上报已下载字节数，可在任意线程中高频调用"""
+        self._reporter.update(downloaded, total)
+
+    def report_finished(self, total: int):
+        """下载完成，立即上报 100%"""
+        self._reporter.finish(total)
+
+    def target_url(self) -> str:
+        """任务主要访问的地址，下载队列据此按站点限制并发"""
+        return ''
+
+    async def _execute(self):
+        await self.run()
+        if not self.is_stopped:
+            await self.post_process()
+
+    async def run(self):
+        """任务协程，默认在引擎线程池中执行 :meth:`run_sync`"""
+        await transferEngine.run_blocking(self.run_sync)
+
+    async def post_process(self):
+        """下载完成后的后处理，默认无操作"""
+
+    def run_sync(self):
+        """阻塞的任务实现"""
+        raise NotImplementedError
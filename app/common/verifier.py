@@ -0,0 +1,232 @@
+# coding:utf-8
+"""
+下载校验模块
+下载完成后检查文件长度，并在不解码的前提下遍历 MP4 盒子/FLV 标签结构，定位损坏位置以便只重新下载损坏的尾部
+"""
+
+import hashlib
+import os
+import struct
+from typing import BinaryIO, List, Optional
+
+from .mp4_remuxer import Mp4RemuxError, _find_box, _iter_boxes
+
+# 常见的 MP4 顶层盒子，用于识别 MP4 文件；其他类型的顶层盒子长度自洽时直接跳过
+MP4_TOP_LEVEL_BOXES = (
+    b'ftyp', b'styp', b'moov', b'moof', b'mdat', b'sidx', b'free', b'skip', b'wide', b'uuid',
+    b'meta', b'pdin', b'emsg', b'prft', b'mfra', b'ssix', b'udta'
+)
+MAX_MOOV_SIZE = 256 * 1024 * 1024  # moov 整体读入内存检查，超过该大小视为损坏
+FLV_TAG_TYPES = (8, 9, 18)          # 音频、视频、脚本数据
+HASH_READ_SIZE = 4 * 1024 * 1024
+
+
+class VerificationError(Exception):
+    """校验失败
+
+    ``valid_size`` 为从文件开头起确认完好的字节数，重新下载时从这里开始即可。
+    """
+
+    def __init__(self, message: str, valid_size: int = 0):
+        super().__init__(message)
+        self.valid_size = valid_size
+
+
+def verify_file(path: str, expected_size: int = 0, check_structure: bool = True):
+    """校验下载结果，``expected_size`` 为 0 时不检查长度，失败时抛出 :class:`VerificationError`
+
+    ``check_structure`` 为 False 时只检查长度，用于开头已被释放、由读取方自行检查结构的文件。
+    """
+    size = os.path.getsize(path)
+    if expected_size and size != expected_size:
+        raise VerificationError(f"文件大小不符: {size}/{expected_size}", min(size, expected_size))
+    if not check_structure:
+        return
+
+    with open(path, 'rb') as f:
+        head = f.read(12)
+        if head[:3] == b'FLV':
+            check_flv(f, size)
+        elif len(head) >= 8 and head[4:8] in MP4_TOP_LEVEL_BOXES:
+            check_mp4(f, size)
+
+
+def check_mp4(f: BinaryIO, size: int):
+    """遍历顶层盒子，确认长度自洽、存在 moov 和 mdat 且样本表完整（分片 MP4 检查每个 moof 之后都有 mdat）
+
+    不认识的盒子（厂商扩展等）只检查长度。
+    """
+    moov_start = None
+    has_mdat = False
+    fragmented = False
+    expect_mdat = None  # 最近一个 moof 的起点，其后应当跟随 mdat
+    position = 0
+    previous = 0        # 上一个盒子的起点
+
+    while position < size:
+        if size - position < 8:
+            raise VerificationError("文件末尾存在不完整的盒子", position)
+        f.seek(position)
+        header = f.read(16)
+        box_size, box_type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if box_size == 1:
+            if len(header) < 16:
+                raise VerificationError("文件末尾存在不完整的盒子", position)
+            box_size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif box_size == 0 and box_type == b'mdat':
+            box_size = size - position
+
+        known = box_type in MP4_TOP_LEVEL_BOXES
+        if box_size < header_size or (not known and position + box_size > size):
+            # 盒子头部已损坏时，上一个盒子的内容多半也已损坏，从上一个盒子开始重新下载
+            raise VerificationError(f"无效的盒子 {box_type!r}", previous)
+        if position + box_size > size:
+            raise VerificationError(f"盒子 {box_type!r} 不完整", position)
+
+        if box_type == b'moov':
+            if box_size > MAX_MOOV_SIZE:
+                raise VerificationError("moov 过大", position)
+            f.seek(position)
+            moov = f.read(box_size)
+            try:
+                fragmented = _find_box(moov, (b'mvex',), header_size) is not None
+                if not fragmented:
+                    _check_sample_tables(moov, header_size, size)
+            except (Mp4RemuxError, struct.error) as e:
+                raise VerificationError(f"moov 损坏: {e}", position)
+            moov_start = position
+        elif box_type == b'moof':
+            if expect_mdat is not None:
+                raise VerificationError("分片缺少 mdat", expect_mdat)
+            expect_mdat = position
+            fragmented = True
+        elif box_type == b'mdat':
+            expect_mdat = None
+            has_mdat = True
+
+        previous = position
+        position += box_size
+
+    if expect_mdat is not None:
+        raise VerificationError("分片缺少 mdat", expect_mdat)
+    # 只有 moof 没有 moov 的是 DASH 的媒体分段，本身不包含初始化信息
+    if moov_start is None and not fragmented:
+        raise VerificationError("未找到 moov", position)
+    if not has_mdat:
+        raise VerificationError("未找到 mdat", position)
+
+
+def _check_sample_tables(moov: bytes, start: int, file_size: int):
+    """确认每个轨道的样本表齐全，且样本数据都落在文件范围内"""
+    for box_type, _, payload_start, box_end in _iter_boxes(moov, start):
+        if box_type != b'trak':
+            continue
+        stbl = _find_box(moov, (b'mdia', b'minf', b'stbl'), payload_start, box_end)
+        if stbl is None:
+            raise Mp4RemuxError("缺少 stbl")
+        _, stbl_start, stbl_end = stbl
+
+        boxes = {child: (child_start, child_end) for child, _, child_start, child_end
+                 in _iter_boxes(moov, stbl_start, stbl_end)}
+        for required in (b'stsd', b'stts', b'stsc'):
+            if required not in boxes:
+                raise Mp4RemuxError(f"缺少 {required.decode()}")
+
+        sizes = _read_sample_sizes(moov, *boxes[b'stsz']) if b'stsz' in boxes else None
+        if sizes is None and b'stz2' not in boxes:
+            raise Mp4RemuxError("缺少 stsz")
+        if b'stco' in boxes:
+            offsets = _read_table(moov, *boxes[b'stco'], '>I')
+        elif b'co64' in boxes:
+            offsets = _read_table(moov, *boxes[b'co64'], '>Q')
+        else:
+            raise Mp4RemuxError("缺少 stco")
+
+        if sizes is not None:
+            _check_chunk_bounds(moov, *boxes[b'stsc'], offsets, sizes, file_size)
+
+
+def _read_table(data: bytes, start: int, end: int, entry_format: str) -> List[int]:
+    """读取 ``entry_count`` 加定长条目形式的表"""
+    count = struct.unpack_from('>I', data, start + 4)[0]
+    entry_size = struct.calcsize(entry_format)
+    if start + 8 + count * entry_size > end:
+        raise Mp4RemuxError("样本表被截断")
+    return [value for value, in struct.iter_unpack(entry_format, data[start + 8:start + 8 + count * entry_size])]
+
+
+def _read_sample_sizes(data: bytes, start: int, end: int) -> List[int]:
+    sample_size, count = struct.unpack_from('>II', data, start + 4)
+    if sample_size:
+        return [sample_size] * count
+    if start + 12 + count * 4 > end:
+        raise Mp4RemuxError("样本表被截断")
+    return [value for value, in struct.iter_unpack('>I', data[start + 12:start + 12 + count * 4])]
+
+
+def _check_chunk_bounds(data: bytes, stsc_start: int, stsc_end: int,
+                        offsets: List[int], sizes: List[int], file_size: int):
+    """按 stsc 把样本分配到各 chunk，检查每个 chunk 的末尾不超过文件大小"""
+    count = struct.unpack_from('>I', data, stsc_start + 4)[0]
+    if stsc_start + 8 + count * 12 > stsc_end:
+        raise Mp4RemuxError("样本表被截断")
+    entries = [struct.unpack_from('>III', data, stsc_start + 8 + i * 12) for i in range(count)]
+
+    sample = 0
+    for index, (first_chunk, samples_per_chunk, _) in enumerate(entries):
+        last_chunk = entries[index + 1][0] - 1 if index + 1 < len(entries) else len(offsets)
+        for chunk in range(first_chunk - 1, min(last_chunk, len(offsets))):
+            chunk_size = sum(sizes[sample:sample + samples_per_chunk])
+            sample += samples_per_chunk
+            if offsets[chunk] + chunk_size > file_size:
+                raise Mp4RemuxError("样本数据超出文件范围")
+
+    if sample < len(sizes):
+        raise Mp4RemuxError("样本数与 chunk 表不符")
+
+
+def check_flv(f: BinaryIO, size: int):
+    """遍历 FLV 标签，确认每个标签长度与其后的 PreviousTagSize 一致"""
+    f.seek(0)
+    header = f.read(9)
+    if len(header) < 9:
+        raise VerificationError("FLV 文件头不完整", 0)
+    position = struct.unpack_from('>I', header, 5)[0] + 4  # 文件头 + PreviousTagSize0
+    previous = 0
+
+    while position < size:
+        f.seek(position)
+        tag_header = f.read(11)
+        if len(tag_header) < 11:
+            raise VerificationError("FLV 标签不完整", position)
+        tag_type = tag_header[0] & 0x1f
+        data_size = int.from_bytes(tag_header[1:4], 'big')
+        tag_end = position + 11 + data_size
+        if tag_type not in FLV_TAG_TYPES:
+            raise VerificationError(f"无效的 FLV 标签类型 {tag_type}", previous)
+        if tag_end > size:
+            raise VerificationError("FLV 标签不完整", position)
+        if tag_end + 4 > size:
+            # 部分封装器不写最后一个 PreviousTagSize
+            if tag_end == size:
+                break
+            raise VerificationError("FLV 标签不完整", position)
+
+        f.seek(tag_end)
+        previous_size = struct.unpack('>I', f.read(4))[0]
+        if previous_size != 11 + data_size:
+            raise VerificationError("FLV 标签长度不一致", position)
+        previous = position
+        position = tag_end + 4
+
+
+def tail_digest(path: str, offset: int) -> str:
+    """``offset`` 之后内容的摘要，用于比较两次下载的尾部是否相同"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for data in iter(lambda: f.read(HASH_READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
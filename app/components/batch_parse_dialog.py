@@ -0,0 +1,171 @@
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import QHBoxLayout, QListWidgetItem, QFileDialog
+from qfluentwidgets import (
+    MessageBoxBase, SubtitleLabel, CaptionLabel, PlainTextEdit, ListWidget, PushButton, PrimaryPushButton,
+    FluentIcon, InfoBar, InfoBarPosition
+)
+from ..common.threadManager import BatchParseThread, ParsingVideoThread
+
+TEXT_FILE_SUFFIX = '.txt'
+
+# 对话框关闭后仍在结束中的解析线程，保持引用直到线程退出
+_runningThreads = set()
+
+
+def read_text_file(path: str) -> str:
+    """读取拖入或选择的文本文件，兼容 UTF-8 和 GBK 编码"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    for encoding in ('utf-8-sig', 'gbk'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='ignore')
+
+
+class LinkTextEdit(PlainTextEdit):
+    """粘贴分享文本的输入框，拖入 .txt 文件时读取其内容"""
+
+    def dragEnterEvent(self, event):
+        if self._textFiles(event):
+            event.acceptProposedAction()
+        else:
+            super().dragEnterEvent(event)
+
+    def dragMoveEvent(self, event):
+        if self._textFiles(event):
+            event.acceptProposedAction()
+        else:
+            super().dragMoveEvent(event)
+
+    def dropEvent(self, event):
+        paths = self._textFiles(event)
+        if not paths:
+            super().dropEvent(event)
+            return
+        for path in paths:
+            self.appendPlainText(read_text_file(path))
+        event.acceptProposedAction()
+
+    @staticmethod
+    def _textFiles(event):
+        if not event.mimeData().hasUrls():
+            return []
+        return [url.toLocalFile() for url in event.mimeData().urls()
+                if url.isLocalFile() and url.toLocalFile().lower().endswith(TEXT_FILE_SUFFIX)]
+
+
+class BatchParseDialog(MessageBoxBase):
+    """批量解析对话框
+
+    粘贴多条分享文本或拖入 .txt 文件后开始解析，每完成一条就加入结果列表，
+    双击解析成功的条目在主页显示该视频。
+    """
+
+    videoSelected = pyqtSignal(dict)
+
+    def __init__(self, text='', parent=None):
+        super().__init__(parent)
+        self.parsing_thread = None
+
+        self.titleLabel = SubtitleLabel('批量解析', self)
+
+        self.textEdit = LinkTextEdit(self)
+        self.textEdit.setPlaceholderText("粘贴多条分享链接，或拖入 .txt 文件...")
+        self.textEdit.setFixedHeight(140)
+        self.textEdit.setPlainText(text)
+
+        self.buttonLayout = QHBoxLayout()
+        self.importButton = PushButton(FluentIcon.DOCUMENT, "导入文本文件", self)
+        self.startButton = PrimaryPushButton(FluentIcon.PLAY, "开始解析", self)
+        self.statusLabel = CaptionLabel(self)
+        self.buttonLayout.addWidget(self.importButton)
+        self.buttonLayout.addWidget(self.statusLabel, 1)
+        self.buttonLayout.addWidget(self.startButton)
+
+        self.resultList = ListWidget(self)
+        self.resultList.setFixedHeight(220)
+
+        self.viewLayout.addWidget(self.titleLabel)
+        self.viewLayout.addWidget(self.textEdit)
+        self.viewLayout.addLayout(self.buttonLayout)
+        self.viewLayout.addWidget(self.resultList)
+
+        self.yesButton.hide()
+        self.cancelButton.setText("关闭")
+        self.widget.setFixedWidth(600)
+
+        self.importButton.clicked.connect(self.onImportClicked)
+        self.startButton.clicked.connect(self.startParsing)
+        self.resultList.itemDoubleClicked.connect(self.onItemDoubleClicked)
+
+    def onImportClicked(self):
+        path, _ = QFileDialog.getOpenFileName(self, "导入文本文件", '', "文本文件 (*.txt)")
+        if path:
+            self.textEdit.appendPlainText(read_text_file(path))
+
+    def startParsing(self):
+        """提取链接并开始解析"""
+        text = self.textEdit.toPlainText()
+        if not ParsingVideoThread.extract_urls_from_text(text):
+            InfoBar.warning(
+                title="未找到链接",
+                content="文本中没有可解析的视频链接",
+                position=InfoBarPosition.TOP,
+                duration=2000,
+                parent=self.window()
+            )
+            return
+
+        self.stopParsing()
+        self.resultList.clear()
+        self.parsing_thread = BatchParseThread(text)
+        _runningThreads.add(self.parsing_thread)
+        self.parsing_thread.finished.connect(
+            lambda thread=self.parsing_thread: _runningThreads.discard(thread))
+        self.parsing_thread.itemParsed.connect(self.onItemParsed)
+        self.parsing_thread.itemFailed.connect(self.onItemFailed)
+        self.parsing_thread.progress.connect(self.onProgress)
+        self.parsing_thread.allFinished.connect(self.onAllFinished)
+        self.statusLabel.setText(f"共 {len(self.parsing_thread.urls)} 个链接")
+        self.startButton.setEnabled(False)
+        self.parsing_thread.start()
+
+    def stopParsing(self):
+        if self.parsing_thread:
+            self.parsing_thread.stop()
+            for signal in (self.parsing_thread.itemParsed, self.parsing_thread.itemFailed,
+                           self.parsing_thread.progress, self.parsing_thread.allFinished):
+                signal.disconnect()
+            self.parsing_thread = None
+
+    def onItemParsed(self, url, data):
+        item = QListWidgetItem(f"[{data.get('platform', '-')}] {data.get('title') or data.get('caption') or url}")
+        item.setData(Qt.UserRole, data)
+        item.setToolTip(url)
+        self.resultList.addItem(item)
+
+    def onItemFailed(self, url, error):
+        item = QListWidgetItem(f"[失败] {url}  {error}")
+        item.setToolTip(error)
+        self.resultList.addItem(item)
+
+    def onProgress(self, done, total):
+        self.statusLabel.setText(f"已处理 {done}/{total}")
+
+    def onAllFinished(self, succeeded, failed):
+        self.statusLabel.setText(f"完成：成功 {succeeded} 个，失败 {failed} 个")
+        self.startButton.setEnabled(True)
+        self.parsing_thread = None
+
+    def onItemDoubleClicked(self, item):
+        data = item.data(Qt.UserRole)
+        if data:
+            self.videoSelected.emit(data)
+            self.accept()
+
+    def done(self, code):
+        # 关闭对话框时停止尚未开始的解析
+        self.stopParsing()
+        super().done(code)
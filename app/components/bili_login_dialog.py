@@ -13,6 +13,7 @@ from qfluentwidgets import (
 
 from ..common.style_sheet import setStyleSheet
 from ..common.bilibili_login import BilibiliLogin, LoginThread
+from ..common.login_state import loginState
 
 
 class QRCodeWidget(QWidget):
@@ -112,6 +113,7 @@ class QRCodeWidget(QWidget):
             self.set_status("success")
             # 保存Cookie
             if self.bili_login.save_cookies():
+                loginState.invalidate()
                 self.login_success.emit()
         elif code == 86101:
             self.set_status("waiting")
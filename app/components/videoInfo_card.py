@@ -4,17 +4,21 @@ import os
 
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer, QPropertyAnimation, QEasingCurve, QRect, QRectF
 from PyQt5.QtGui import QFont, QImage, QColor, QPainter, QPen, QPixmap, QBrush
-from PyQt5.QtWidgets import QHBoxLayout, QWidget, QVBoxLayout, QGridLayout, QFrame, QLabel, QSizePolicy
+from PyQt5.QtWidgets import QHBoxLayout, QWidget, QVBoxLayout, QGridLayout, QFrame, QLabel, QSizePolicy, QActionGroup
 from qfluentwidgets import CardWidget, CaptionLabel, AvatarWidget, TitleLabel, BodyLabel, PrimaryPushButton, PushButton, \
-    ProgressBar, IconWidget, FluentIcon, FlowLayout, PillPushButton, InfoBar, InfoBarPosition
+    ProgressBar, IconWidget, FluentIcon, FlowLayout, PillPushButton, InfoBar, InfoBarPosition, Action, CheckableMenu, \
+    MenuIndicatorType
 
 from .coloricon_widget import ColorIconWidget
 from .videoCover_widget import VideoCover
 from ..common.signal_bus import signalBus
-from ..common.threadManager import VideoDownloadThread, AudioDownloadThread, BilibiliDownloadThread
+from ..common.download_queue import downloadQueue
+from ..common.downloader import PartManifest
+from ..common.progress import format_eta, format_size
+from ..common.threadManager import VideoDownloadTask, AudioDownloadTask, BilibiliDownloadTask
 from ..common.style_sheet import setStyleSheet, setCustomStyleSheetFromFile
-from ..common.threadManager import ImageLoaderThread
-from ..common.bilibili_login import BilibiliLogin
+from ..common.threadManager import ImageLoaderTask
+from ..common.login_state import loginState
 from ..common.vidflowicon import VidFlowIcon
 from ..components.video_quality_dialog import VideoQualityDialog
 from ..components.bilibili_quality_dialog import BilibiliQualityDialog
@@ -31,8 +35,11 @@ class ProgressAudioButton(PushButton):
         self.border_width = 2  # 边框宽度
 
     def setProgress(self, progress):
-        """设置进度值"""
-        self.progress = max(0, min(100, progress))
+        """设置进度值，数值不变时不重绘"""
+        progress = max(0, min(100, progress))
+        if progress == self.progress:
+            return
+        self.progress = progress
         self.update()  # 触发重绘
 
     def clearProgress(self):
@@ -262,12 +269,19 @@ class ProgressAudioButton(PushButton):
 
 
 class VideoInfoCard(CardWidget):
+    # 右键菜单中可选的任务限速（KB/s），0 表示只受全局限速约束
+    TASK_SPEED_LIMITS = (0, 512, 1024, 2048, 5120, 10240)
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
         self.videoInfoDict = {}
-        self.download_thread = None  # 下载线程
-        self.audio_download_thread = None
+        self.taskSpeedLimit = 0         # 本卡片下载任务的限速（KB/s），对运行中和之后加入的任务生效
+        self.playInfoPending = False    # 视频信息已显示，播放信息仍在获取
+        self.download_tasks = []        # 视频下载任务（含排队中）
+        self.audio_download_tasks = []  # 音频下载任务（含排队中）
+        self._task_progress = {}        # 各任务最近一次上报的 DownloadProgress
+        self._queuePending = 0          # 全局下载队列中等待的任务数
         self.mainLayout = QHBoxLayout(self)
         self.mainLayout.setContentsMargins(0, 0, 0, 0)
         self.mainLayout.setSpacing(0)
@@ -276,6 +290,7 @@ class VideoInfoCard(CardWidget):
         signalBus.startVideoDownloadSig.connect(self.startDownload)
         signalBus.startAudioDownloadSig.connect(self.startAudioDownload)
         signalBus.startBilibiliDownloadSig.connect(self.startBilibiliDownload)
+        downloadQueue.queueChanged.connect(self.onQueueChanged)
 
         # 视频封面区域
         self.videoCoverLabel = VideoCover(self)
@@ -533,10 +548,12 @@ class VideoInfoCard(CardWidget):
         self.progressLabel = CaptionLabel("视频下载进度", self.progressWidget)
 
         self.progressPercent = CaptionLabel("0%", self.progressWidget)
+        self.progressSpeed = CaptionLabel("", self.progressWidget)
 
         self.progressInfoLayout.addWidget(self.progressLabel)
         self.progressInfoLayout.addWidget(self.progressPercent)
         self.progressInfoLayout.addStretch()
+        self.progressInfoLayout.addWidget(self.progressSpeed)
 
         self.progressLayout.addLayout(self.progressInfoLayout)
 
@@ -788,10 +805,7 @@ class VideoInfoCard(CardWidget):
         self.tagsContainer.hide()
 
         # 更新封面图片
-        bili_login = BilibiliLogin()
-        is_logged_in = bili_login.load_cookies() and bili_login.get_user_info() is not None
-        
-        if is_logged_in:
+        if loginState.is_logged_in:
             cover_url = video_data.get('pic')  # 登录状态使用pic字段
         else:
             cover_url = video_data.get('cover')  # 未登录状态使用cover字段
@@ -807,6 +821,26 @@ class VideoInfoCard(CardWidget):
 
         signalBus.hideUnsureSignal.emit()
 
+    def set_play_info(self, video_data):
+        """补充播放信息，视频信息已由 update_bilibili_video 先行显示"""
+        self.videoInfoDict = video_data
+        self.playInfoPending = False
+
+    def _showPlayInfoPending(self) -> bool:
+        """播放信息尚未到达时提示稍候"""
+        if not self.playInfoPending:
+            return False
+        InfoBar.warning(
+            title="请稍候",
+            content="正在获取播放信息",
+            orient=Qt.Horizontal,
+            isClosable=True,
+            position=InfoBarPosition.TOP,
+            duration=2000,
+            parent=self.window()
+        )
+        return True
+
     def _format_number(self, num):
         """格式化数字显示"""
         if num >= 100000000:  # 1亿
@@ -830,7 +864,7 @@ class VideoInfoCard(CardWidget):
         if not url:
             return
 
-        loader = ImageLoaderThread(url, image_type)
+        loader = ImageLoaderTask(url, image_type)
         loader.imageLoaded.connect(self.on_image_loaded)
         loader.loadFailed.connect(self.on_image_load_failed)
         loader.start()
@@ -872,7 +906,7 @@ class VideoInfoCard(CardWidget):
 
     def onDownloadVideoClicked(self):
         """处理下载视频按钮点击事件"""
-        if not self.videoInfoDict:
+        if not self.videoInfoDict or self._showPlayInfoPending():
             return
         
         # 检查是否为B站视频
@@ -899,78 +933,160 @@ class VideoInfoCard(CardWidget):
             )
             return
 
-        # 如果已有下载任务在进行，先停止
-        if self.download_thread and self.download_thread.isRunning():
-            self.download_thread.stop()
-
-        # 禁用下载按钮
-        self.downloadVideoBtn.setEnabled(False)
-
-        # 显示进度条
-        self.progressWidget.show()
-        self.progressBar.setValue(0)
-        self.progressPercent.setText("0%")
-
         # 获取分辨率
         resolution = quality_data.get('resolution', 'unknown')
 
-        # 创建下载线程（使用时间戳+分辨率的文件名）
-        self.download_thread = VideoDownloadThread(
+        # 创建下载任务（使用时间戳+分辨率的文件名）
+        task = VideoDownloadTask(
             download_url=quality_data['url'],
             resolution=resolution
         )
-
-        self.download_thread.progress.connect(self.updateProgress)
-        self.download_thread.finished.connect(self.onDownloadFinished)
-        self.download_thread.error.connect(self.onDownloadError)
-
-        # 开始下载
-        self.download_thread.start()
+        self._enqueueVideoTask(task)
     
     def closeEvent(self, event):
         """组件关闭时清理资源"""
         # 清理图片加载线程
         self.cleanup_image_loaders()
         
-        # 清理下载线程
-        if self.download_thread and self.download_thread.isRunning():
-            self.download_thread.stop()
-            self.download_thread.deleteLater()
-            self.download_thread = None
+        # 停止所有下载任务
+        for task in self.download_tasks + self.audio_download_tasks:
+            task.stop()
+        self.download_tasks.clear()
+        self.audio_download_tasks.clear()
+        self._task_progress.clear()
         
         super().closeEvent(event)
 
-    def updateProgress(self, progress):
-        """更新下载进度"""
-        self.progressBar.setValue(progress)
-        self.progressPercent.setText(f"{progress}%")
+    def _enqueueVideoTask(self, task):
+        """把视频下载任务加入全局下载队列，已有任务时排队而不是中断
 
-    def onDownloadFinished(self, file_path):
-        """下载完成处理"""
-        # 重置进度条
-        self.progressBar.setValue(0)
-        self.progressPercent.setText("0%")
-        self.progressWidget.hide()
+        同一来源、同一清晰度的任务会共用暂存目录和 ``.part`` 文件，未结束前不重复加入。
+        """
+        source = PartManifest.url_key(task.target_url())
+        if any(PartManifest.url_key(other.target_url()) == source for other in self.download_tasks):
+            InfoBar.warning(
+                title="已在下载",
+                content="该视频的这个清晰度已在下载队列中",
+                orient=Qt.Horizontal,
+                isClosable=True,
+                position=InfoBarPosition.TOP,
+                duration=3000,
+                parent=self.window()
+            )
+            return
+
+        task.progress.connect(self.updateProgress)
+        task.finished.connect(self.onDownloadFinished)
+        task.error.connect(self.onDownloadError)
+        task.set_rate_limit(self.taskSpeedLimit * 1024)
 
-        # 启用下载按钮
-        self.downloadVideoBtn.setEnabled(True)
-
-        # 清理线程引用
-        if hasattr(self, 'download_thread') and self.download_thread:
-            # 断开信号连接
-            try:
-                self.download_thread.progress.disconnect()
-                self.download_thread.finished.disconnect()
-                self.download_thread.error.disconnect()
-            except:
-                pass
-            # 确保线程已经完成再删除
-            if not self.download_thread.isRunning():
-                self.download_thread.deleteLater()
+        self.download_tasks.append(task)
+        self._task_progress[task] = None
+        downloadQueue.enqueue(task)
+
+        # 显示进度条
+        self.progressWidget.show()
+        self._refreshProgress()
+
+    def contextMenuEvent(self, event):
+        """右键菜单：设置本卡片下载任务的限速"""
+        menu = CheckableMenu(parent=self, indicatorType=MenuIndicatorType.RADIO)
+        group = QActionGroup(menu)
+        for limit in self.TASK_SPEED_LIMITS:
+            if not limit:
+                text = "任务不限速"
+            elif limit < 1024:
+                text = f"任务限速 {limit} KB/s"
             else:
-                # 如果线程仍在运行，等待完成后再删除
-                self.download_thread.finished.connect(lambda: self.download_thread.deleteLater())
-            self.download_thread = None
+                text = f"任务限速 {limit // 1024} MB/s"
+            action = Action(FluentIcon.SPEED_OFF if limit else FluentIcon.SPEED_HIGH, text, checkable=True)
+            action.setChecked(limit == self.taskSpeedLimit)
+            action.triggered.connect(lambda checked, limit=limit: self.setTaskSpeedLimit(limit))
+            group.addAction(action)
+            menu.addAction(action)
+        menu.exec(event.globalPos())
+
+    def setTaskSpeedLimit(self, limit):
+        """设置本卡片任务的限速（KB/s），运行中的任务立即生效"""
+        self.taskSpeedLimit = limit
+        for task in self.download_tasks + self.audio_download_tasks:
+            task.set_rate_limit(limit * 1024)
+
+    def _removeTask(self, task):
+        """任务结束后断开信号并移除引用"""
+        try:
+            task.progress.disconnect()
+            task.finished.disconnect()
+            task.error.disconnect()
+        except TypeError:
+            pass
+
+        for tasks in (self.download_tasks, self.audio_download_tasks):
+            if task in tasks:
+                tasks.remove(task)
+        self._task_progress.pop(task, None)
+
+    def _averageProgress(self, tasks):
+        """多个任务的平均进度，排队中的任务按 0 计算"""
+        if not tasks:
+            return 0
+        records = [self._task_progress.get(task) for task in tasks]
+        return int(sum(record.percent for record in records if record) / len(tasks))
+
+    def _speedText(self, tasks):
+        """所有任务的合计速度与最长剩余时间"""
+        records = [self._task_progress.get(task) for task in tasks]
+        records = [record for record in records if record and record.smoothed_speed > 0]
+        if not records:
+            return ""
+
+        speed = sum(record.smoothed_speed for record in records)
+        etas = [record.eta for record in records]
+        eta = None if None in etas else max(etas)
+        return f"{format_size(speed)}/s · 剩余 {format_eta(eta)}"
+
+    def _refreshProgress(self):
+        """刷新视频下载进度条"""
+        count = len(self.download_tasks)
+        if count > 1:
+            self.progressLabel.setText(f"视频下载进度（{count}个任务）")
+        else:
+            self.progressLabel.setText("视频下载进度")
+
+        progress = self._averageProgress(self.download_tasks)
+        if self.progressBar.value() != progress:
+            self.progressBar.setValue(progress)
+        if self.download_tasks and all(task.isQueued() for task in self.download_tasks):
+            self.progressPercent.setText(f"排队中（共{self._queuePending}个等待）")
+        else:
+            self.progressPercent.setText(f"{progress}%")
+        self.progressSpeed.setText(self._speedText(self.download_tasks))
+
+    def onQueueChanged(self, pending, running):
+        """全局下载队列变化时刷新排队状态，任务开始运行后立即不再显示排队中"""
+        self._queuePending = pending
+        if self.download_tasks:
+            self._refreshProgress()
+
+    def updateProgress(self, record):
+        """更新下载进度，record 为任务上报的 DownloadProgress"""
+        task = self.sender()
+        if task in self._task_progress:
+            self._task_progress[task] = record
+        self._refreshProgress()
+
+    def onDownloadFinished(self, file_path):
+        """下载完成处理"""
+        self._removeTask(self.sender())
+
+        # 所有任务完成后重置进度条
+        if not self.download_tasks:
+            self.progressBar.setValue(0)
+            self.progressPercent.setText("0%")
+            self.progressSpeed.setText("")
+            self.progressWidget.hide()
+        else:
+            self._refreshProgress()
 
         InfoBar.success(
             title="下载完成",
@@ -984,30 +1100,16 @@ class VideoInfoCard(CardWidget):
 
     def onDownloadError(self, error_message):
         """下载错误处理"""
-        # 重置进度条
-        self.progressBar.setValue(0)
-        self.progressPercent.setText("0%")
-        self.progressWidget.hide()
-
-        # 启用下载按钮
-        self.downloadVideoBtn.setEnabled(True)
-
-        # 清理线程引用
-        if hasattr(self, 'download_thread') and self.download_thread:
-            # 断开信号连接
-            try:
-                self.download_thread.progress.disconnect()
-                self.download_thread.finished.disconnect()
-                self.download_thread.error.disconnect()
-            except:
-                pass
-            # 确保线程已经完成再删除
-            if not self.download_thread.isRunning():
-                self.download_thread.deleteLater()
-            else:
-                # 如果线程仍在运行，等待完成后再删除
-                self.download_thread.finished.connect(lambda: self.download_thread.deleteLater())
-            self.download_thread = None
+        self._removeTask(self.sender())
+
+        # 所有任务结束后重置进度条
+        if not self.download_tasks:
+            self.progressBar.setValue(0)
+            self.progressPercent.setText("0%")
+            self.progressSpeed.setText("")
+            self.progressWidget.hide()
+        else:
+            self._refreshProgress()
 
         InfoBar.error(
             title="下载失败",
@@ -1033,19 +1135,12 @@ class VideoInfoCard(CardWidget):
             )
             return
 
-        # 如果已有音频下载线程在运行，先停止
-        if self.audio_download_thread and self.audio_download_thread.isRunning():
-            self.audio_download_thread.stop()
-
-        # 禁用音频下载按钮
-        self.downloadAudioBtn.setEnabled(False)
-
         # 检查平台类型和音频格式
         platform = video_info.get('platform', '')
         play_info = video_info.get('play_info', {})
         
         if platform == 'Bilibili' or 'dash' in play_info:
-            # Bilibili平台或DASH格式，使用BilibiliDownloadThread
+            # Bilibili平台或DASH格式，使用BilibiliDownloadTask
             if 'durl' in play_info:
                 # 传统格式，无法单独提取音频
                 InfoBar.error(
@@ -1057,7 +1152,6 @@ class VideoInfoCard(CardWidget):
                     duration=3000,
                     parent=self.window()
                 )
-                self.downloadAudioBtn.setEnabled(True)
                 return
             
             if 'dash' not in play_info:
@@ -1070,21 +1164,20 @@ class VideoInfoCard(CardWidget):
                     duration=3000,
                     parent=self.window()
                 )
-                self.downloadAudioBtn.setEnabled(True)
                 return
 
-            # 使用BilibiliDownloadThread来下载音频，确保有正确的认证信息
+            # 使用BilibiliDownloadTask来下载音频，确保有正确的认证信息
             audio_quality_data = {
                 'type': 'audio_only',
                 'quality_desc': '音频'
             }
             
-            self.audio_download_thread = BilibiliDownloadThread(
+            task = BilibiliDownloadTask(
                 video_info=video_info,
                 quality_data=audio_quality_data
             )
         else:
-            # 其他平台（如抖音），使用AudioDownloadThread
+            # 其他平台（如抖音），使用AudioDownloadTask
             audio_url = video_info.get('audio_url') or video_info.get('music_url')
             if not audio_url:
                 InfoBar.error(
@@ -1096,30 +1189,36 @@ class VideoInfoCard(CardWidget):
                     duration=3000,
                     parent=self.window()
                 )
-                self.downloadAudioBtn.setEnabled(True)
                 return
 
-            self.audio_download_thread = AudioDownloadThread(
+            task = AudioDownloadTask(
                 download_url=audio_url
             )
 
-        self.audio_download_thread.finished.connect(self.onAudioDownloadFinished)
-        self.audio_download_thread.error.connect(self.onAudioDownloadError)
-        self.audio_download_thread.progress.connect(self.updateAudioProgress)
+        task.finished.connect(self.onAudioDownloadFinished)
+        task.error.connect(self.onAudioDownloadError)
+        task.progress.connect(self.updateAudioProgress)
+        task.set_rate_limit(self.taskSpeedLimit * 1024)
 
-        self.audio_download_thread.start()
+        # 音频文件较小，优先于排队中的视频任务
+        self.audio_download_tasks.append(task)
+        self._task_progress[task] = None
+        downloadQueue.enqueue(task, downloadQueue.PRIORITY_HIGH)
 
-    def updateAudioProgress(self, progress):
-        """更新音频下载进度"""
-        self.downloadAudioBtn.setProgress(progress)
+    def updateAudioProgress(self, record):
+        """更新音频下载进度，record 为任务上报的 DownloadProgress"""
+        task = self.sender()
+        if task in self._task_progress:
+            self._task_progress[task] = record
+        self.downloadAudioBtn.setProgress(self._averageProgress(self.audio_download_tasks))
 
     def onAudioDownloadFinished(self, file_path):
         """音频下载完成"""
-        # 清除进度显示
-        self.downloadAudioBtn.clearProgress()
+        self._removeTask(self.sender())
 
-        # 启用音频下载按钮
-        self.downloadAudioBtn.setEnabled(True)
+        # 所有音频任务完成后清除进度显示
+        if not self.audio_download_tasks:
+            self.downloadAudioBtn.clearProgress()
 
         InfoBar.success(
             title="音频下载完成",
@@ -1133,11 +1232,11 @@ class VideoInfoCard(CardWidget):
 
     def onAudioDownloadError(self, error_message):
         """音频下载错误处理"""
-        # 清除进度显示
-        self.downloadAudioBtn.clearProgress()
+        self._removeTask(self.sender())
 
-        # 启用音频下载按钮
-        self.downloadAudioBtn.setEnabled(True)
+        # 所有音频任务结束后清除进度显示
+        if not self.audio_download_tasks:
+            self.downloadAudioBtn.clearProgress()
 
         InfoBar.error(
             title="音频下载失败",
@@ -1163,6 +1262,9 @@ class VideoInfoCard(CardWidget):
             )
             return
 
+        if self._showPlayInfoPending():
+            return
+
         # 发送音频下载信号
         signalBus.startAudioDownloadSig.emit(self.videoInfoDict)
     
@@ -1180,28 +1282,9 @@ class VideoInfoCard(CardWidget):
             )
             return
         
-        # 如果已有下载任务在进行，先停止
-        if self.download_thread and self.download_thread.isRunning():
-            self.download_thread.stop()
-        
-        # 禁用下载按钮
-        self.downloadVideoBtn.setEnabled(False)
-        
-        # 显示进度条
-        self.progressWidget.show()
-        self.progressBar.setValue(0)
-        self.progressPercent.setText("0%")
-        
-        # 创建B站下载线程
-        self.download_thread = BilibiliDownloadThread(
+        # 创建B站下载任务
+        task = BilibiliDownloadTask(
             quality_data=quality_data,
             video_info=self.videoInfoDict
         )
-        
-        # 连接信号
-        self.download_thread.progress.connect(self.updateProgress)
-        self.download_thread.finished.connect(self.onDownloadFinished)
-        self.download_thread.error.connect(self.onDownloadError)
-        
-        # 开始下载
-        self.download_thread.start()
+        self._enqueueVideoTask(task)
@@ -7,7 +7,7 @@ from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QFont, QColor
 from qfluentwidgets import (
     LineEdit, ElevatedCardWidget, BodyLabel, CaptionLabel,
-    InfoBar, InfoBarPosition, FluentIcon, PrimaryPushButton, ScrollArea
+    InfoBar, InfoBarPosition, FluentIcon, PrimaryPushButton, PushButton, ScrollArea
 )
 
 from ..common.signal_bus import signalBus
@@ -15,9 +15,12 @@ from ..common.style_sheet import setStyleSheet, setCustomStyleSheetFromFile
 from ..common import resource_rc
 from ..common.vidflowicon import VidFlowIcon
 from ..common.threadManager import ParsingVideoThread
+from ..common.parse_cache import canonical_key, parseCache
+from ..common.short_links import shortLinks
 from ..components.coloricon_widget import ColorIconWidget
 from ..components.gradient_Label import GradientLabel
 from ..components.videoInfo_card import VideoInfoCard
+from ..components.batch_parse_dialog import BatchParseDialog
 
 
 class HomeHeaderWidget(QWidget):
@@ -72,6 +75,7 @@ class HomeHeaderWidget(QWidget):
 
 
 class InputCard(ElevatedCardWidget):
+    getMetadata = pyqtSignal(dict)
     getData = pyqtSignal(dict)
     getDataError = pyqtSignal(str)
 
@@ -97,12 +101,19 @@ class InputCard(ElevatedCardWidget):
         self.searchButton.setDisabled(True)
         self.searchButton.setFixedSize(120, 48)
 
+        # batch button
+        self.batchButton = PushButton("批量解析", self)
+        self.batchButton.setIcon(FluentIcon.DOCUMENT)
+        self.batchButton.setFixedSize(120, 48)
+
         self.hboxLayout.addWidget(self.lineEdit, 1)
         self.hboxLayout.addWidget(self.searchButton, 0)
+        self.hboxLayout.addWidget(self.batchButton, 0)
         
         # 连接文本变化信号
         self.lineEdit.textChanged.connect(self.onTextChanged)
         self.searchButton.clicked.connect(self.startParsingThread)
+        self.batchButton.clicked.connect(lambda: self.showBatchDialog())
         
         self.setQss()
     
@@ -110,8 +121,30 @@ class InputCard(ElevatedCardWidget):
         """当lineEdit文本变化时调用，控制searchButton的启用状态"""
         self.searchButton.setEnabled(bool(text.strip()))
 
+    def showBatchDialog(self, text='', autoStart=False):
+        """打开批量解析对话框，选中的结果按单个解析结果显示"""
+        dialog = BatchParseDialog(text, self.window())
+        dialog.videoSelected.connect(lambda data: self.getData.emit(data))
+        if autoStart:
+            dialog.startParsing()
+        dialog.exec_()
+
     def startParsingThread(self):
+        # 粘贴了多条链接时转为批量解析
+        if len(ParsingVideoThread.extract_urls_from_text(self.lineEdit.text())) > 1:
+            self.showBatchDialog(self.lineEdit.text(), autoStart=True)
+            return
+
+        # 命中缓存时直接显示，不启动解析线程
+        url = ParsingVideoThread.extract_url_from_text(self.lineEdit.text())
+        url = shortLinks.lookup(url) or url
+        cached = parseCache.get(canonical_key(url))
+        if cached:
+            self.getData.emit(cached)
+            return
+
         self.parsing_thread = ParsingVideoThread(self.lineEdit.text())
+        self.parsing_thread.metadata.connect(lambda data: self.getMetadata.emit(data))
         self.parsing_thread.finished.connect(lambda data: self.getData.emit(data))
         self.parsing_thread.error.connect(lambda info: self.getDataError.emit(info))
         self.parsing_thread.start()
@@ -156,6 +189,8 @@ class HomeInterface(ScrollArea):
         self.setWidget(self.scrollWidget)
         self.setQss()
 
+        self._metadataShown = False  # 本次解析的视频信息已先行显示，只差播放信息
+        self.inputCard.getMetadata.connect(self.setVideoMetadata)
         self.inputCard.getData.connect(self.setVideoInfo)
         self.inputCard.getDataError.connect(self.updataError)
 
@@ -164,11 +199,23 @@ class HomeInterface(ScrollArea):
         self.scrollWidget.setObjectName("scrollWidget")
         setStyleSheet(self, 'home_interface')
 
+    def setVideoMetadata(self, data):
+        """播放信息到达前先显示视频信息"""
+        if data.get('platform') != 'B站':
+            return
+        self.videoInfoCard.update_bilibili_video(data)
+        self.videoInfoCard.playInfoPending = True
+        self.videoInfoCard.setVisible(True)
+        self._metadataShown = True
+
     def setVideoInfo(self, data):
-        if data.get('platform') == '抖音':
+        if self._metadataShown and data.get('platform') == 'B站':
+            self.videoInfoCard.set_play_info(data)
+        elif data.get('platform') == '抖音':
             self.videoInfoCard.update_douyin_data(data)
         elif data.get('platform') == 'B站':
             self.videoInfoCard.update_bilibili_video(data)
+        self._metadataShown = False
         self.videoInfoCard.setVisible(True)
         self.inputCard.lineEdit.setEnabled(True)
         self.inputCard.searchButton.setEnabled(True)
@@ -182,6 +229,8 @@ class HomeInterface(ScrollArea):
         )
 
     def updataError(self, info):
+        self._metadataShown = False
+        self.videoInfoCard.playInfoPending = False
         self.inputCard.lineEdit.setEnabled(True)
         self.inputCard.searchButton.setEnabled(True)
         signalBus.hideUnsureSignal.emit()
@@ -15,6 +15,8 @@ from ..common.style_sheet import setStyleSheet
 from ..common import resource_rc
 from ..common.config import config
 from ..common.signal_bus import signalBus
+from ..common.transfer_engine import transferEngine
+from ..common.postprocess import postProcessPool
 from ..common.vidflowicon import VidFlowIcon
 from ..components.IndeterminateProgressDialog import CustomMessageBox
 from ..components.SlidingStackedWidget import SlidingStackedWidget
@@ -256,6 +258,8 @@ class MainWindow(FramelessWindow):
         """退出应用程序"""
         if self.trayIcon:
             self.trayIcon.hide()
+        transferEngine.shutdown()
+        postProcessPool.shutdown()
         QApplication.quit()
 
     def __connectSignalToSlot(self):
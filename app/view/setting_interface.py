@@ -1,5 +1,4 @@
 # coding:utf-8
-import os
 from PyQt5.QtCore import Qt, pyqtSignal, QUrl
 from PyQt5.QtGui import QDesktopServices
 from PyQt5.QtWidgets import QWidget, QLabel, QVBoxLayout, QStackedWidget, QFileDialog
@@ -13,11 +12,13 @@ from qfluentwidgets import (
 
 from ..common.vidflowicon import VidFlowIcon
 from ..components.bili_login_dialog import BiliLoginDialog
-from ..common.bilibili_login import BilibiliLogin
-from ..common.config import config, LOGIN_FILE_PATH
+from ..common.login_state import loginState
+from ..common.config import config
+from ..common.ffmpeg import ffmpegLocator
+from ..common.audio_transcoder import AudioConvertTask, audio_format
 from ..common.signal_bus import signalBus
+from ..common.transfer_engine import transferEngine
 from ..common.style_sheet import setStyleSheet
-from ..common.bilibili_login import BilibiliLogin
 
 
 class SettingInterface(ScrollArea):
@@ -233,7 +234,8 @@ class LoginManagementPage(QWidget):
             self.accountGroup
         )
         
-        # 初始化B站登录状态
+        # 初始化B站登录状态，验证结果在后台返回后更新
+        loginState.changed.connect(self._updateBiliLoginStatus)
         self._checkBiliLoginStatus()
         
         self.__initLayout()
@@ -258,28 +260,24 @@ class LoginManagementPage(QWidget):
             # 已登录，执行退出登录
             self._logoutBili()
         else:
-            # 未登录，打开登录对话框
+            # 未登录，打开登录对话框，登录成功后的状态通过 changed 信号更新UI
             dialog = BiliLoginDialog(self)
-            if dialog.exec_() == dialog.Accepted:
-                # 登录成功后更新UI
-                self._checkBiliLoginStatus()
+            dialog.exec_()
     
     def _checkBiliLoginStatus(self):
-        """检查B站登录状态并更新UI"""
-        try:
-            bili_login = BilibiliLogin()
-            if bili_login.load_cookies():
-                user_info = bili_login.get_user_info()
-                if user_info and not user_info.get('isLogin', False) == False:
-                    # 已登录状态
-                    username = user_info.get('uname', '未知用户')
-                    self._updateBiliLoginUI(True, username)
-                    return
-        except Exception:
-            pass
-        
-        # 未登录状态
-        self._updateBiliLoginUI(False)
+        """按缓存的登录状态更新UI，并在后台重新验证"""
+        self._updateBiliLoginStatus()
+        loginState.refresh()
+    
+    def _updateBiliLoginStatus(self):
+        """按缓存的验证结果更新UI，尚未验证时保持未登录的显示"""
+        user_info = loginState.user_info
+        if user_info:
+            # 已登录状态
+            self._updateBiliLoginUI(True, user_info.get('uname', '未知用户'))
+        else:
+            # 未登录状态
+            self._updateBiliLoginUI(False)
     
     def _updateBiliLoginUI(self, is_logged_in, username=None):
         """更新B站登录卡片UI"""
@@ -302,22 +300,14 @@ class LoginManagementPage(QWidget):
             self.biliLoginCard.contentLabel.setStyleSheet("")
     
     def _isBiliLoggedIn(self):
-        """检查是否已登录B站"""
-        
-        bili_login = BilibiliLogin()
-        if bili_login.load_cookies():
-            user_info = bili_login.get_user_info()
-            return user_info and not user_info.get('isLogin', False) == False
-        return False
+        """检查是否已登录B站，与卡片上显示的状态一致"""
+        return loginState.user_info is not None
     
     def _logoutBili(self):
         """退出B站登录"""
-
-        login_file = str(LOGIN_FILE_PATH)
         
         try:
-            if os.path.exists(login_file):
-                os.remove(login_file)
+            loginState.logout()
             
             # 更新UI
             self._updateBiliLoginUI(False)
@@ -346,11 +336,16 @@ class LoginManagementPage(QWidget):
 
 class DownloadSettingsPage(QWidget):
     """ 下载设置页面 """
+
+    ffmpegLocated = pyqtSignal(int, object)  # 检测序号, FFmpegInfo 或 None
     
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setObjectName("download")
         self.expandLayout = ExpandLayout(self)
+        self._ffmpegChecked = False
+        self._ffmpegRequest = 0
+        self._convertTasks = []
         
         # 下载路径组
         self.pathGroup = SettingCardGroup(self.tr('下载路径'), self)
@@ -371,20 +366,241 @@ class DownloadSettingsPage(QWidget):
             self.pathGroup
         )
         
+        self.ffmpegCard = PushSettingCard(
+            self.tr('选择文件'),
+            FIF.VIDEO,
+            self.tr('FFmpeg'),
+            self.tr('正在检测…'),
+            self.pathGroup
+        )
+        
+        # 下载选项组
+        self.downloadGroup = SettingCardGroup(self.tr('下载选项'), self)
+        
+        self.connectionsCard = RangeSettingCard(
+            config.downloadConnections,
+            FIF.SPEED_HIGH,
+            self.tr('分段连接数'),
+            self.tr('单个文件同时使用的下载连接数，服务器不支持分段时自动使用单连接'),
+            self.downloadGroup
+        )
+        
+        self.maxConcurrentCard = RangeSettingCard(
+            config.maxConcurrentDownloads,
+            FIF.DOWNLOAD,
+            self.tr('同时下载任务数'),
+            self.tr('超出数量的任务进入队列等待，按提交顺序依次开始'),
+            self.downloadGroup
+        )
+        
+        self.maxPerHostCard = RangeSettingCard(
+            config.maxDownloadsPerHost,
+            FIF.GLOBE,
+            self.tr('单站点同时下载数'),
+            self.tr('同一站点同时进行的任务数上限，过高可能触发站点限流'),
+            self.downloadGroup
+        )
+        
+        self.postProcessCard = RangeSettingCard(
+            config.maxPostProcessJobs,
+            FIF.IOT,
+            self.tr('同时后处理任务数'),
+            self.tr('合并、转码等后处理同时运行的数量，不占用下载名额'),
+            self.downloadGroup
+        )
+        
+        # 限速组
+        self.speedLimitGroup = SettingCardGroup(self.tr('下载限速'), self)
+        
+        self.speedLimitCard = RangeSettingCard(
+            config.speedLimit,
+            FIF.SPEED_OFF,
+            self.tr('全局限速（KB/s）'),
+            self.tr('所有下载任务合计的速度上限，0 表示不限速，修改后立即生效'),
+            self.speedLimitGroup
+        )
+        
+        self.speedLimitScheduleCard = SwitchSettingCard(
+            FIF.DATE_TIME,
+            self.tr('按时段限速'),
+            self.tr('只在下面的时段内限速，其余时间全速下载'),
+            config.speedLimitScheduleEnabled,
+            self.speedLimitGroup
+        )
+        
+        self.speedLimitStartCard = RangeSettingCard(
+            config.speedLimitStartHour,
+            FIF.STOP_WATCH,
+            self.tr('限速开始时间（时）'),
+            self.tr('开始时间晚于结束时间时表示跨夜'),
+            self.speedLimitGroup
+        )
+        
+        self.speedLimitEndCard = RangeSettingCard(
+            config.speedLimitEndHour,
+            FIF.STOP_WATCH,
+            self.tr('限速结束时间（时）'),
+            self.tr('到达该整点后恢复全速'),
+            self.speedLimitGroup
+        )
+        
+        # 音频组
+        self.audioGroup = SettingCardGroup(self.tr('音频'), self)
+        
+        self.audioFormatCard = ComboBoxSettingCard(
+            config.audioFormat,
+            FIF.MUSIC,
+            self.tr('音频格式'),
+            self.tr('下载音频时边下载边转码为所选格式，需要FFmpeg'),
+            texts=[self.tr('保持原始格式'), 'MP3', 'AAC', 'Opus', 'FLAC'],
+            parent=self.audioGroup
+        )
+        
+        self.audioBitrateCard = ComboBoxSettingCard(
+            config.audioBitrate,
+            FIF.SPEED_MEDIUM,
+            self.tr('音频码率'),
+            self.tr('有损格式的目标码率，FLAC 为无损格式时忽略'),
+            texts=['96 kbps', '128 kbps', '192 kbps', '256 kbps', '320 kbps'],
+            parent=self.audioGroup
+        )
+        
+        self.audioConvertCard = PushSettingCard(
+            self.tr('选择文件'),
+            FIF.SYNC,
+            self.tr('批量转换音频'),
+            self.tr('把已下载的音频文件转换为上面选择的格式，多个文件并行转换'),
+            self.audioGroup
+        )
+        
         self.__initLayout()
         self.__connectSignalToSlot()
     
     def __initLayout(self):
         self.pathGroup.addSettingCard(self.downloadFolderCard)
         self.pathGroup.addSettingCard(self.cacheFolderCard)
+        self.pathGroup.addSettingCard(self.ffmpegCard)
+        
+        self.downloadGroup.addSettingCard(self.connectionsCard)
+        self.downloadGroup.addSettingCard(self.maxConcurrentCard)
+        self.downloadGroup.addSettingCard(self.maxPerHostCard)
+        self.downloadGroup.addSettingCard(self.postProcessCard)
+        
+        self.speedLimitGroup.addSettingCard(self.speedLimitCard)
+        self.speedLimitGroup.addSettingCard(self.speedLimitScheduleCard)
+        self.speedLimitGroup.addSettingCard(self.speedLimitStartCard)
+        self.speedLimitGroup.addSettingCard(self.speedLimitEndCard)
+        
+        self.audioGroup.addSettingCard(self.audioFormatCard)
+        self.audioGroup.addSettingCard(self.audioBitrateCard)
+        self.audioGroup.addSettingCard(self.audioConvertCard)
         
         self.expandLayout.setSpacing(28)
         self.expandLayout.setContentsMargins(0, 0, 0, 0)
         self.expandLayout.addWidget(self.pathGroup)
+        self.expandLayout.addWidget(self.downloadGroup)
+        self.expandLayout.addWidget(self.speedLimitGroup)
+        self.expandLayout.addWidget(self.audioGroup)
     
     def __connectSignalToSlot(self):
         self.downloadFolderCard.clicked.connect(self.__onDownloadFolderCardClicked)
         self.cacheFolderCard.clicked.connect(self.__onCacheFolderCardClicked)
+        self.ffmpegCard.clicked.connect(self.__onFFmpegCardClicked)
+        self.audioConvertCard.clicked.connect(self.__onAudioConvertCardClicked)
+        self.ffmpegLocated.connect(self.__onFFmpegLocated)
+    
+    def showEvent(self, event):
+        super().showEvent(event)
+        # 首次显示时才检测，避免启动时运行 FFmpeg
+        if not self._ffmpegChecked:
+            self._ffmpegChecked = True
+            self.__updateFFmpegCard()
+    
+    def __updateFFmpegCard(self):
+        """ 在后台检测 FFmpeg（需要运行 ffmpeg -version），结果通过 ffmpegLocated 回到界面线程 """
+        self._ffmpegRequest += 1
+        request = self._ffmpegRequest
+        self.ffmpegCard.setContent(self.tr('正在检测FFmpeg...'))
+        future = transferEngine.submit(transferEngine.run_blocking(ffmpegLocator.locate))
+        future.add_done_callback(
+            lambda future: self.ffmpegLocated.emit(request, None if future.exception() else future.result()))
+
+    def __onFFmpegLocated(self, request, info):
+        """ 显示当前使用的 FFmpeg，忽略已被更新的检测结果 """
+        if request != self._ffmpegRequest:
+            return
+        if info is None:
+            self.ffmpegCard.setContent(self.tr('未找到FFmpeg，B站非分片格式视频的合并将不可用'))
+        else:
+            self.ffmpegCard.setContent(f"{info.path}（{info.version}）")
+    
+    def __onFFmpegCardClicked(self):
+        """ FFmpeg 卡片点击槽函数 """
+        path, _ = QFileDialog.getOpenFileName(self, self.tr("选择FFmpeg"), "./")
+        if not path or config.get(config.ffmpegPath) == path:
+            return
+        
+        config.set(config.ffmpegPath, path)
+        self.__updateFFmpegCard()
+    
+    def __onAudioConvertCardClicked(self):
+        """ 批量转换卡片点击槽函数 """
+        if audio_format() is None:
+            InfoBar.warning(
+                title=self.tr("未选择格式"),
+                content=self.tr("请先在音频格式中选择要转换的目标格式"),
+                orient=Qt.Horizontal,
+                isClosable=True,
+                position=InfoBarPosition.TOP,
+                duration=2000,
+                parent=self.window()
+            )
+            return
+        
+        paths, _ = QFileDialog.getOpenFileNames(
+            self, self.tr("选择音频文件"), str(config.get(config.downloadFolder)),
+            self.tr("音频文件 (*.mp3 *.m4a *.aac *.opus *.ogg *.flac *.wav);;所有文件 (*)"))
+        if not paths:
+            return
+        
+        task = AudioConvertTask(paths)
+        task.progress.connect(
+            lambda record: self.audioConvertCard.setContent(
+                self.tr('正在转换 {0}/{1}').format(record.downloaded, record.total)))
+        task.finished.connect(self.__onAudioConvertFinished)
+        task.error.connect(self.__onAudioConvertError)
+        self._convertTasks.append(task)
+        task.start()
+    
+    def __onAudioConvertFinished(self, folder):
+        self.__removeConvertTask(self.sender())
+        InfoBar.success(
+            title=self.tr("转换完成"),
+            content=self.tr("文件已保存至 {0}").format(folder),
+            orient=Qt.Horizontal,
+            isClosable=True,
+            position=InfoBarPosition.TOP,
+            duration=3000,
+            parent=self.window()
+        )
+    
+    def __onAudioConvertError(self, error_message):
+        self.__removeConvertTask(self.sender())
+        InfoBar.error(
+            title=self.tr("转换失败"),
+            content=error_message,
+            orient=Qt.Horizontal,
+            isClosable=True,
+            position=InfoBarPosition.TOP,
+            duration=4000,
+            parent=self.window()
+        )
+    
+    def __removeConvertTask(self, task):
+        if task in self._convertTasks:
+            self._convertTasks.remove(task)
+        if not self._convertTasks:
+            self.audioConvertCard.setContent(self.tr('把已下载的音频文件转换为上面选择的格式，多个文件并行转换'))
     
     def __onDownloadFolderCardClicked(self):
         """ 下载文件夹卡片点击槽函数 """